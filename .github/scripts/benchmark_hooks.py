@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Offline benchmark of the diff/prompt pipeline of the hooks.
+
+Every scenario runs the hook against a synthetic repository (see `synthetic_repo.py`) and a local stub
+of the chat completions endpoint (see `stub_openai_server.py`), and reports median wall time, peak RSS
+of the hook process (and its children), number of spawned git processes, requests and tokens sent, and changed
+lines of the diff sent - a scenario fails if none were sent, e.g. when the prompt is left with summary lines only.
+
+Unix only - peak RSS is taken from `os.wait4` and git processes are counted by a `git` shim on `PATH`.
+
+Usage:
+    python .github/scripts/benchmark_hooks.py [--runs 3] [--scenarios lines_1,lines_10k] [--latency 0.05] [--json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from stub_openai_server import start_server
+from synthetic_repo import create_repo
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+ROOT = Path(__file__).resolve().parents[2]
+
+# scenario: name -> (synthetic repo: lines, files, binary, renames), hook args, stub settings
+SCENARIOS: dict[str, tuple[tuple[int, int, int, int], list[str], dict]] = {
+    "lines_1": ((1, 1, 0, 0), [], {}),
+    "lines_100": ((100, 2, 0, 0), [], {}),
+    "lines_1k": ((1000, 10, 0, 0), [], {}),
+    "lines_10k": ((10000, 20, 0, 0), [], {}),
+    "lines_100k": ((100000, 50, 0, 0), [], {}),
+    "binary_renames": ((100, 5, 5, 10), [], {}),
+    "stream_1k": ((1000, 10, 0, 0), ["--stream"], {"stream_delay": 0.005}),
+    "faults_1k": ((1000, 10, 0, 0), ["--openai-max-retries", "6"], {"fail_rate": 0.3, "seed": 1}),
+    "map_reduce_10k": ((10000, 20, 0, 0), ["--map-reduce"], {}),
+    # summaries of the first run are reused by the next ones
+    "incremental_10k": ((10000, 20, 0, 0), ["--incremental"], {"content": "\n".join(f"{index}: update module" for index in range(1, 21))}),
+}
+
+GIT_SHIM = """#!/bin/sh
+echo "$@" >> "$BENCHMARK_GIT_LOG"
+exec "{git}" "$@"
+"""
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--scenarios", type=str, default=",".join(SCENARIOS), help="comma-separated scenario names")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the stub waits before responding")
+    parser.add_argument("--json", action="store_true", default=False)
+    return parser.parse_args()
+
+
+def create_git_shim(bin_dir: Path) -> None:
+    git = shutil.which("git")
+    if git is None:
+        raise SystemExit("git not found")
+    shim = bin_dir.joinpath("git")
+    shim.write_text(GIT_SHIM.format(git=git), encoding="utf-8")
+    shim.chmod(0o755)
+
+
+def run_hook(cwd: Path, env: dict[str, str], hook_args: list[str]) -> tuple[int, float, float]:
+    """Run hook - exit code, wall time in ms and peak RSS in MiB."""
+    msg_file = cwd.joinpath(".git", "COMMIT_EDITMSG")
+    msg_file.write_text("", encoding="utf-8")
+    commands = [sys.executable, "-m", "chatgpt_pre_commit_hooks.main", "--hook", "chatgpt-commit-message", "--no-cache", "--no-daemon", *hook_args, str(msg_file)]
+    start = time.perf_counter()
+    process = subprocess.Popen(commands, cwd=str(cwd), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)  # noqa: S603
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall_ms = (time.perf_counter() - start) * 1000
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak_rss_mib = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return process.returncode, wall_ms, peak_rss_mib
+
+
+def count_diff_lines(requests: list[dict]) -> int:
+    """Count changed lines of the diff sent in user messages of the requests."""
+    contents = [message.get("content", "") for request in requests for message in request["body"].get("messages", []) if message.get("role") == "user"]
+    count = 0
+    for content in contents:
+        in_hunk = False
+        for line in content.splitlines():
+            in_hunk = line.startswith("@@") or (in_hunk and line[:1] in " +-\\")
+            count += in_hunk and line[:1] in "+-"
+    return count
+
+
+def read_metrics(path: Path) -> dict:
+    lines = path.read_text(encoding="utf-8").splitlines() if path.exists() else []
+    return json.loads(lines[-1]) if lines else {}
+
+
+def benchmark_scenario(name: str, temp_dir: Path, base_env: dict[str, str], runs: int, latency: float) -> dict:
+    (lines, files, binary, renames), hook_args, stub_settings = SCENARIOS[name]
+    cwd = temp_dir.joinpath(name)
+    create_repo(cwd, lines, files=files, binary=binary, renames=renames)
+    stub = start_server(latency=latency, **stub_settings)
+    git_log = temp_dir.joinpath(f"{name}.git.log")
+    metrics_file = temp_dir.joinpath(f"{name}.metrics.jsonl")
+    env = {**base_env, "OPENAI_API_BASE": stub.api_base, "BENCHMARK_GIT_LOG": str(git_log), "CHATGPT_PRE_COMMIT_HOOKS_METRICS": f"jsonl:{metrics_file}"}
+
+    samples = []
+    for _ in range(runs):
+        git_log.write_text("", encoding="utf-8")
+        requests_before = len(stub.requests)
+        exit_code, wall_ms, peak_rss_mib = run_hook(cwd, env, hook_args)
+        requests = stub.requests[requests_before:]
+        metrics = read_metrics(metrics_file)
+        samples.append(
+            {
+                "exit_code": exit_code,
+                "wall_ms": wall_ms,
+                "peak_rss_mib": peak_rss_mib,
+                "git_processes": len(git_log.read_text(encoding="utf-8").splitlines()),
+                "requests": len(requests),
+                "bytes_sent": sum(request["size"] for request in requests),
+                "prompt_tokens": metrics.get("counts", {}).get("prompt_tokens", 0),
+                "diff_lines": count_diff_lines(requests),
+            },
+        )
+    stub.shutdown()
+
+    result: dict = {"scenario": name, "exit_code": max(sample["exit_code"] for sample in samples)}
+    # later runs of incremental scenarios send summaries only
+    result["diff_lines"] = max(sample["diff_lines"] for sample in samples)
+    for key in ["wall_ms", "peak_rss_mib", "git_processes", "requests", "bytes_sent", "prompt_tokens"]:
+        result[key] = round(statistics.median(sample[key] for sample in samples), 1)
+    return result
+
+
+def main() -> int:
+    if sys.platform == "win32":
+        logging.error("::error benchmark requires a Unix platform")
+        return 1
+    args = get_args()
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        logging.error(f"::error unknown scenarios: {', '.join(unknown)}")
+        return 1
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp:
+        temp_dir = Path(temp)
+        bin_dir = temp_dir.joinpath("bin")
+        bin_dir.mkdir()
+        create_git_shim(bin_dir)
+        base_env = {key: value for key, value in os.environ.items() if not key.endswith("OPENAI_API_KEY")}
+        base_env.update(
+            {
+                "PATH": os.pathsep.join([str(bin_dir), base_env.get("PATH", "")]),
+                "PYTHONPATH": os.pathsep.join([str(ROOT), base_env.get("PYTHONPATH", "")]),
+                "OPENAI_API_KEY": "sk-benchmark",
+                "OPENAI_API_TYPE": "open_ai",
+            },
+        )
+        for name in names:
+            results.append(benchmark_scenario(name, temp_dir, base_env, args.runs, args.latency))
+
+    if args.json:
+        print(json.dumps(results, indent=2))  # noqa: T201
+    else:
+        logging.info(f"{'scenario':<16} {'exit':>4} {'wall ms':>9} {'rss MiB':>8} {'git':>4} {'requests':>8} {'bytes sent':>10} {'tokens':>8} {'diff lines':>10}")
+        for result in results:
+            logging.info(
+                f"{result['scenario']:<16} {result['exit_code']:>4} {result['wall_ms']:>9} {result['peak_rss_mib']:>8} {result['git_processes']:>4} "
+                f"{result['requests']:>8} {result['bytes_sent']:>10} {result['prompt_tokens']:>8} {result['diff_lines']:>10}",
+            )
+    without_diff = [result["scenario"] for result in results if result["diff_lines"] == 0]
+    if without_diff:
+        logging.error(f"::error no diff content sent: {', '.join(without_diff)}")
+    return int(any(result["exit_code"] != 0 for result in results) or bool(without_diff))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
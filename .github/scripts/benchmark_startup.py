@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Cold-start benchmark of the hooks for each exit path.
+
+Every scenario runs the hook in a fresh `python -X importtime` process against a throwaway repository
+and reports wall time, total import time and whether the heavy dependencies (`openai`, `tiktoken`) were imported.
+
+Usage:
+    python .github/scripts/benchmark_startup.py [--runs 5] [--json] [--assert-lazy]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from stub_openai_server import start_server
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+ROOT = Path(__file__).resolve().parents[2]
+HEAVY_MODULES = ["openai", "tiktoken", "aiohttp", "requests"]
+# scenarios which must not import any of the heavy modules
+LAZY_SCENARIOS = ["skip_keyword", "missing_api_key", "empty_diff", "merge_source", "cache_hit", "reserved_setting"]
+# scenarios which must fail, e.g. a config file setting a mode which would turn every hook run into it
+FAILING_SCENARIOS = ["missing_api_key", "reserved_setting"]
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", default=False)
+    parser.add_argument("--assert-lazy", action="store_true", default=False, help="fail if heavy modules are imported on the lazy exit paths")
+    return parser.parse_args()
+
+
+def run_git(cwd: Path, *args: str) -> None:
+    subprocess.run(["git", *args], cwd=str(cwd), check=True, capture_output=True)
+
+
+def prep_repo(cwd: Path) -> None:
+    run_git(cwd, "init")
+    run_git(cwd, "config", "--local", "user.name", "benchmark")
+    run_git(cwd, "config", "--local", "user.email", "benchmark@example.com")
+    run_git(cwd, "config", "--local", "commit.gpgsign", "false")
+    cwd.joinpath("README.md").write_text("benchmark\n", encoding="utf-8")
+    run_git(cwd, "add", ".")
+    run_git(cwd, "commit", "-m", "Initial commit")
+
+
+def stage_change(cwd: Path) -> None:
+    cwd.joinpath("change.py").write_text("def change(a, b):\n    return a + b\n", encoding="utf-8")
+    run_git(cwd, "add", "change.py")
+
+
+def unstage_change(cwd: Path) -> None:
+    run_git(cwd, "reset", "-q")
+
+
+def parse_importtime(stderr: str) -> tuple[float, list[str]]:
+    """Get total import time in ms and the imported heavy modules."""
+    total_us = 0
+    heavy = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not name.startswith("  "):
+            total_us += int(cumulative)
+        module = name.strip().split(".")[0]
+        if module in HEAVY_MODULES:
+            heavy.add(module)
+    return total_us / 1000, sorted(heavy)
+
+
+def run_hook(cwd: Path, env: dict[str, str], msg_file: Path, message: str, hook_args: list[str]) -> tuple[int, float, float, list[str]]:
+    msg_file.write_text(message, encoding="utf-8")
+    commands = [sys.executable, "-X", "importtime", "-m", "chatgpt_pre_commit_hooks.main", "--hook", "chatgpt-commit-message", str(msg_file), *hook_args]
+    start = time.perf_counter()
+    result = subprocess.run(commands, cwd=str(cwd), env=env, capture_output=True, encoding="utf-8")  # noqa: S603
+    wall_ms = (time.perf_counter() - start) * 1000
+    import_ms, heavy = parse_importtime(result.stderr)
+    return result.returncode, wall_ms, import_ms, heavy
+
+
+def benchmark(runs: int) -> list[dict]:
+    stub = start_server()
+    base_env = {key: value for key, value in os.environ.items() if not key.endswith("OPENAI_API_KEY")}
+    base_env["PYTHONPATH"] = os.pathsep.join([str(ROOT), base_env.get("PYTHONPATH", "")])
+    env = {**base_env, "OPENAI_API_KEY": "sk-benchmark", "OPENAI_API_BASE": stub.api_base, "OPENAI_API_TYPE": "open_ai"}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cwd = Path(temp_dir)
+        prep_repo(cwd)
+        msg_file = cwd.joinpath(".git", "COMMIT_EDITMSG")
+
+        config_file = cwd.joinpath(".chatgpt-hooks.toml")
+
+        # scenario: (name, staged, env, message, hook args, warm-up runs, config file)
+        scenarios = [
+            ("skip_keyword", True, env, "fix typo #no-ai\n", [], 0, None),
+            ("missing_api_key", True, base_env, "", [], 0, None),
+            ("empty_diff", False, env, "", [], 0, None),
+            ("merge_source", True, env, "Merge branch 'feature'\n", ["merge"], 0, None),
+            ("cache_hit", True, env, "", ["message"], 1, None),
+            ("reserved_setting", True, env, "", ["message"], 0, '[hooks.chatgpt-commit-message]\nbatch = "HEAD"\n'),
+            ("request", True, env, "", ["message", "--no-cache"], 0, None),
+        ]
+        results = []
+        for name, staged, scenario_env, message, hook_args, warm_up, config in scenarios:
+            if staged:
+                stage_change(cwd)
+            else:
+                unstage_change(cwd)
+            if config is None:
+                config_file.unlink(missing_ok=True)
+            else:
+                config_file.write_text(config, encoding="utf-8")
+            for _ in range(warm_up):
+                run_hook(cwd, scenario_env, msg_file, message, hook_args)
+            samples = [run_hook(cwd, scenario_env, msg_file, message, hook_args) for _ in range(runs)]
+            results.append(
+                {
+                    "scenario": name,
+                    "exit_code": samples[-1][0],
+                    "wall_ms": round(statistics.median(sample[1] for sample in samples), 1),
+                    "import_ms": round(statistics.median(sample[2] for sample in samples), 1),
+                    "heavy_modules": samples[-1][3],
+                },
+            )
+    stub.shutdown()
+    return results
+
+
+def main() -> int:
+    args = get_args()
+    results = benchmark(args.runs)
+    if args.json:
+        print(json.dumps(results, indent=2))  # noqa: T201
+    else:
+        logging.info(f"{'scenario':<16} {'exit':>4} {'wall ms':>9} {'import ms':>10}  heavy modules")
+        for result in results:
+            heavy_modules = ", ".join(result["heavy_modules"]) or "-"
+            logging.info(f"{result['scenario']:<16} {result['exit_code']:>4} {result['wall_ms']:>9} {result['import_ms']:>10}  {heavy_modules}")
+
+    passing = [result["scenario"] for result in results if result["scenario"] in FAILING_SCENARIOS and result["exit_code"] == 0]
+    if passing:
+        logging.error(f"::error scenarios expected to fail passed: {', '.join(passing)}")
+        return 1
+    if args.assert_lazy:
+        eager = [result["scenario"] for result in results if result["scenario"] in LAZY_SCENARIOS and result["heavy_modules"]]
+        if eager:
+            logging.error(f"::error heavy modules imported on lazy exit paths: {', '.join(eager)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""Local stub of the OpenAI chat completions endpoint.
+
+Usage:
+    python .github/scripts/stub_openai_server.py --port 8080 --latency 0.5 [--fail-first 2 --fail-status 429] [--fail-rate 0.1 --fail-statuses 429,500,503] [--stream-delay 0.01] [--rate-limit-rpm 60]
+
+then point the hooks at it with `OPENAI_API_BASE=http://127.0.0.1:8080/v1`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+DEFAULT_CONTENT = "feat(stub): add stubbed changes\n\nDescribe stubbed changes."
+
+
+class StubOpenAiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StubOpenAiServer
+
+    def do_POST(self) -> None:  # noqa: N802
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.loads(data or b"{}")
+        with self.server.lock:
+            self.server.requests.append({"path": self.path, "body": body, "size": len(data), "time": time.time()})
+        if not self.path.endswith("/chat/completions"):
+            self.__send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        rate_limit_headers, rate_limited = self.server.get_rate_limit_headers()
+        if rate_limited:
+            self.__send_json(429, {"error": {"message": "Rate limit reached for requests", "type": "requests"}}, rate_limit_headers)
+            return
+
+        fail_status = self.server.get_fail_status()
+        if fail_status is not None:
+            self.__send_json(fail_status, {"error": {"message": f"Stubbed failure {fail_status}", "type": "server_error"}})
+            return
+
+        time.sleep(self.server.latency)
+        content = self.server.content
+        if body.get("stream"):
+            self.__send_stream(content, rate_limit_headers)
+        else:
+            self.__send_json(
+                200,
+                {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model") or "stub",
+                    "choices": [
+                        {"index": index, "message": {"role": "assistant", "content": content if index == 0 else f"{content} ({index + 1})"}, "finish_reason": "stop"}
+                        for index in range(int(body.get("n") or 1))
+                    ],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                },
+                rate_limit_headers,
+            )
+
+    def do_GET(self) -> None:  # noqa: N802
+        self.__send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        logging.debug(format % args)
+
+    def __send_json(self, status: int, payload: dict, headers: dict[str, str] | None = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __send_stream(self, content: str, headers: dict[str, str] | None = None) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for token in content.split(" "):
+                chunk = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": "stub",
+                    "choices": [{"index": 0, "delta": {"content": f"{token} "}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(self.server.stream_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            logging.debug("stream closed by the client")
+
+
+class StubOpenAiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.0,
+        content: str = DEFAULT_CONTENT,
+        fail_first: int = 0,
+        fail_status: int = 429,
+        fail_rate: float = 0.0,
+        fail_statuses: tuple[int, ...] = (429, 500, 503),
+        stream_delay: float = 0.0,
+        seed: int | None = None,
+        rate_limit_rpm: int | None = None,
+    ) -> None:
+        super().__init__(("127.0.0.1", port), StubOpenAiHandler)
+        self.latency = latency
+        self.content = content
+        self.failures = fail_first
+        self.fail_status = fail_status
+        self.fail_rate = fail_rate
+        self.fail_statuses = fail_statuses
+        self.stream_delay = stream_delay
+        self.rate_limit_rpm = rate_limit_rpm
+        self.rate_limit_bucket = float(rate_limit_rpm or 0)
+        self.rate_limit_updated = time.time()
+        self.rate_limit_accepted = 0
+        self.rate_limit_rejected = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests: list[dict] = []
+
+    def get_fail_status(self) -> int | None:
+        """Get status of a stubbed failure - the first `fail_first` requests fail, then randomly with `fail_rate`."""
+        with self.lock:
+            if self.failures > 0:
+                self.failures -= 1
+                return self.fail_status
+            if self.fail_rate > 0 and self.random.random() < self.fail_rate:
+                return self.random.choice(self.fail_statuses)
+        return None
+
+    def get_rate_limit_headers(self) -> tuple[dict[str, str] | None, bool]:
+        """Get `x-ratelimit-*` headers of the request and whether it's over the limit - requests are counted in a bucket refilled continuously, like OpenAI does."""
+        if self.rate_limit_rpm is None:
+            return None, False
+        with self.lock:
+            now = time.time()
+            self.rate_limit_bucket = min(self.rate_limit_bucket + (now - self.rate_limit_updated) * self.rate_limit_rpm / 60, self.rate_limit_rpm)
+            self.rate_limit_updated = now
+            over_limit = self.rate_limit_bucket < 1
+            if over_limit:
+                self.rate_limit_rejected += 1
+            else:
+                self.rate_limit_bucket -= 1
+                self.rate_limit_accepted += 1
+            reset = (self.rate_limit_rpm - self.rate_limit_bucket) * 60 / self.rate_limit_rpm
+            return {
+                "x-ratelimit-limit-requests": str(self.rate_limit_rpm),
+                "x-ratelimit-remaining-requests": str(int(self.rate_limit_bucket)),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+            }, over_limit
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+def start_server(**kwargs: object) -> StubOpenAiServer:
+    server = StubOpenAiServer(**kwargs)  # type: ignore[arg-type]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before responding")
+    parser.add_argument("--content", type=str, default=DEFAULT_CONTENT)
+    parser.add_argument("--fail-first", type=int, default=0, help="number of first requests to fail")
+    parser.add_argument("--fail-status", type=int, default=429, help="HTTP status of failed requests")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="probability of a random failure of later requests")
+    parser.add_argument("--fail-statuses", type=str, default="429,500,503", help="comma-separated HTTP statuses of random failures")
+    parser.add_argument("--stream-delay", type=float, default=0.0, help="seconds to wait after each streamed chunk")
+    parser.add_argument("--seed", type=int, default=None, help="seed of random failures")
+    parser.add_argument("--rate-limit-rpm", type=int, default=None, help="requests per minute before responding with 429 and x-ratelimit-* headers")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    stub = StubOpenAiServer(
+        port=args.port,
+        latency=args.latency,
+        content=args.content,
+        fail_first=args.fail_first,
+        fail_status=args.fail_status,
+        fail_rate=args.fail_rate,
+        fail_statuses=tuple(int(status) for status in args.fail_statuses.split(",")),
+        stream_delay=args.stream_delay,
+        seed=args.seed,
+        rate_limit_rpm=args.rate_limit_rpm,
+    )
+    logging.info(f"Serving stub OpenAI API at {stub.api_base}")
+    stub.serve_forever()
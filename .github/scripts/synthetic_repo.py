@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Generator of throwaway git repositories with staged changes of a controlled size.
+
+The initial commit holds `--files` source files; the staged changes add and remove about `--lines` lines
+across them (in several hunks per file), add `--binary` binary files and rename `--renames` files.
+
+Usage:
+    python .github/scripts/synthetic_repo.py /tmp/synthetic --lines 10000 --files 20 --binary 2 --renames 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import random
+import subprocess
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+BASE_FILE_LINES = 60
+HUNKS_PER_FILE = 4
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dest", type=Path)
+    parser.add_argument("--lines", type=int, default=100, help="number of changed lines")
+    parser.add_argument("--files", type=int, default=1, help="number of changed source files")
+    parser.add_argument("--binary", type=int, default=0, help="number of added binary files")
+    parser.add_argument("--renames", type=int, default=0, help="number of renamed files")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def run_git(cwd: Path, *args: str) -> None:
+    subprocess.run(["git", *args], cwd=str(cwd), check=True, capture_output=True)
+
+
+def get_source_lines(rng: random.Random, count: int, prefix: str) -> list[str]:
+    lines = []
+    for index in range(count):
+        if index % 6 == 0:
+            lines.append(f"def {prefix}_{index}(value: int) -> int:\n")
+        else:
+            lines.append(f"    value = value * {rng.randint(2, 97)} + {rng.randint(0, 10**6)}  # {prefix} step {index}\n")
+    return lines
+
+
+def write_lines(path: Path, lines: list[str]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("".join(lines), encoding="utf-8")
+
+
+def create_repo(dest: Path, lines: int, files: int = 1, binary: int = 0, renames: int = 0, seed: int = 0) -> None:
+    """Create repository with an initial commit and staged changes."""
+    rng = random.Random(seed)
+    files = max(files, 1)
+    dest.mkdir(parents=True, exist_ok=True)
+    run_git(dest, "init")
+    run_git(dest, "config", "--local", "user.name", "benchmark")
+    run_git(dest, "config", "--local", "user.email", "benchmark@example.com")
+    run_git(dest, "config", "--local", "commit.gpgsign", "false")
+
+    sources = [dest.joinpath("src", f"module_{index}.py") for index in range(files)]
+    renamed = [dest.joinpath("lib", f"helper_{index}.py") for index in range(renames)]
+    for path in [*sources, *renamed]:
+        write_lines(path, get_source_lines(rng, BASE_FILE_LINES, path.stem))
+    dest.joinpath("README.md").write_text("synthetic\n", encoding="utf-8")
+    run_git(dest, "add", ".")
+    run_git(dest, "commit", "-m", "Initial commit")
+
+    # changed lines: one removed line for every nine added, spread across the files in several hunks
+    removed_per_file = min((lines // 10) // files, BASE_FILE_LINES // 7)
+    added_per_file = max((lines - removed_per_file * files) // files, 1) if lines else 0
+    for path in sources:
+        content = path.read_text(encoding="utf-8").splitlines(keepends=True)
+        content = [line for index, line in enumerate(content) if not (index % 7 == 3 and index // 7 < removed_per_file)]
+        chunk = max(added_per_file // HUNKS_PER_FILE, 1)
+        added = 0
+        for hunk in range(HUNKS_PER_FILE):
+            count = added_per_file - added if hunk == HUNKS_PER_FILE - 1 else min(chunk, added_per_file - added)
+            if count <= 0:
+                break
+            position = len(content) * (hunk + 1) // (HUNKS_PER_FILE + 1)
+            content[position:position] = get_source_lines(rng, count, f"{path.stem}_added_{hunk}")
+            added += count
+        write_lines(path, content)
+        if lines < files:
+            break
+
+    for index in range(binary):
+        path = dest.joinpath("assets", f"blob_{index}.bin")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(bytes(rng.getrandbits(8) for _ in range(4096)))
+
+    for path in renamed:
+        target = dest.joinpath("lib", "renamed", path.name)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        run_git(dest, "mv", str(path.relative_to(dest)), str(target.relative_to(dest)))
+        with target.open("at", encoding="utf-8") as handle:
+            handle.write("# renamed\n")
+
+    run_git(dest, "add", ".")
+
+
+if __name__ == "__main__":
+    args = get_args()
+    create_repo(args.dest, args.lines, files=args.files, binary=args.binary, renames=args.renames, seed=args.seed)
+    logging.info(f"Created {args.dest} with staged changes")
@@ -1,152 +1,583 @@
 """Base module."""
 
+import abc
 import argparse
 import logging
 import os
 import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional, TypeVar
 
-import openai
-import tiktoken
-
+from chatgpt_pre_commit_hooks import profiler
+from chatgpt_pre_commit_hooks.cache import ResponseCache
+from chatgpt_pre_commit_hooks.client import OPENAI_TEMPERATURE, OPENAI_TOP_P, OpenAiClient, OpenAiEndpoint, get_client, is_healthy
+from chatgpt_pre_commit_hooks.config import ENV_SETTINGS, Config, ConfigError, get_config_path, load_config
+from chatgpt_pre_commit_hooks.context import get_context
 from chatgpt_pre_commit_hooks.logger import Logger
+from chatgpt_pre_commit_hooks.metrics import Metrics
+from chatgpt_pre_commit_hooks.ratelimit import RateLimiter, get_state_path
+from chatgpt_pre_commit_hooks.tokens import get_token_counter
 from chatgpt_pre_commit_hooks.utils import Utils
 
+T = TypeVar("T")
+
 PASS = 0
 FAIL = 1
 
+# defaults of the `openai` module, kept here so that it's imported only when a request is actually made
+OPENAI_API_BASE = "https://api.openai.com/v1"
+OPENAI_API_TYPE = "open_ai"
+# API key of backends if OPENAI_API_KEY is not set - local OpenAI-compatible servers usually ignore it
+OPENAI_BACKEND_API_KEY = "sk-no-key"
+
 
-class ChatGptPreCommitHooks:
+class ChatGptPreCommitHooks(abc.ABC):
     """TODO."""
 
+    # hook id, see `runner.HOOKS`
+    name: Optional[str] = None
+
     def __init__(self) -> None:
         """TODO."""
+        start = time.perf_counter()
         self.args_global, unparsed, self.args_parser = self.__get_args_global()
+        args_duration_ms = (time.perf_counter() - start) * 1000
 
-        self.logger = Logger(__name__, level=self.args_global.log_level.upper())
+        self.logger = Logger(level=self.args_global.log_level.upper())
         self.log = self.logger.logger
         self.log.debug(f"SYS_ARGV: {sys.argv}")
         self.log.debug(f"ARGS_GLOBAL: {self.args_global}")
         self.log.debug(f"ARGS_GLOBAL_UNPARSED: {unparsed}")
+        self.__check_config()
         self.__check_openai_api_key()
+        self.openai_routes = self.__get_openai_routes()
+        self.openai_backends = self.__get_openai_backends()
+        # deadline of all requests of the hook run (`time.monotonic()`), set by the first one
+        self.__latency_deadline: Optional[float] = None
         self.utils = Utils()
+        self.context = get_context()
         self.git_repo_path = "."
+        self.cache = self.__get_cache()
+        self.metrics = Metrics(self.name, self.args_global.metrics, self.get_git_dir() if self.args_global.metrics else None, start=start, log=self.log)
+        self.metrics.add_span("args", args_duration_ms)
+        self.metrics.tags["model"] = self.args_global.openai_model
+        self.metrics.activate()
+
+    @abc.abstractmethod
+    def __call__(self) -> int:
+        """Run hook - implemented by hooks."""
 
     def __get_args_global(self) -> tuple[argparse.Namespace, list[str], argparse.ArgumentParser]:
         """Get input arguments."""
         parser = argparse.ArgumentParser(prog="chatgpt-pre-commit-hooks")
         parser.add_argument("--log-level", choices=[key.lower() for key in logging._nameToLevel], default="error", required=False)  # args.log_level  # noqa: SLF001
-        parser.add_argument("--hook", type=str.lower, default=None, required=False)  # args.env_prefix
+        parser.add_argument("--hook", type=str.lower, action="append", default=None, required=False)  # args.hook
         parser.add_argument("--env-prefix", type=str, default=None, required=False)  # args.env_prefix
+        parser.add_argument("--config", type=Path, default=None, required=False)  # args.config
+        profiler.add_arguments(parser)  # args.profile, args.profile_output
 
         temp_args, unparsed = parser.parse_known_args()
-        temp_env_prefix = temp_args.env_prefix
-        env_prefix = ""
-        if temp_env_prefix is not None and temp_env_prefix:
-            env_prefix = f"{temp_env_prefix.upper()}__"
-
-        parser.add_argument("--openai-model", type=str, default=os.environ.get(f"{env_prefix}OPENAI_MODEL", "gpt-3.5-turbo"))  # args.openai_model
-        parser.add_argument("--openai-max-tokens", type=int, default=os.environ.get(f"{env_prefix}OPENAI_MAX_TOKENS", "1024"))  # args.openai_max_tokens
-        parser.add_argument("--openai-api-base", type=str, default=os.environ.get(f"{env_prefix}OPENAI_API_BASE", openai.api_base))  # args.openai_api_base
-        parser.add_argument("--openai-api-type", type=str.lower, default=os.environ.get(f"{env_prefix}OPENAI_API_TYPE", openai.api_type))  # args.openai_api_type
-        parser.add_argument("--openai-proxy", type=str, default=os.environ.get(f"{env_prefix}OPENAI_PROXY", None), required=False)  # args.openai_proxy
+        self.config, self.config_error = self.__get_config(temp_args.config)
+        settings = self.config.get_settings(self.name)
+        env_prefix = f"{temp_args.env_prefix.upper()}__" if temp_args.env_prefix else ""
+        # read at parse time - the environment differs between hook runs of a daemon process
+        openai_api_base = os.environ.get("OPENAI_API_BASE", settings.get("openai_api_base", OPENAI_API_BASE))
+        openai_api_type = os.environ.get("OPENAI_API_TYPE", settings.get("openai_api_type", OPENAI_API_TYPE))
+
+        def get_default(name: str, default: Optional[str]) -> Any:  # noqa: ANN401
+            """Get default of the argument - the environment variable (with the prefix) if set, the config file setting otherwise."""
+            return os.environ.get(f"{env_prefix}{name.upper()}", settings.get(name, default))
+
+        parser.add_argument("--openai-model", type=str, default=get_default("openai_model", "gpt-3.5-turbo"))  # args.openai_model
+        parser.add_argument("--openai-max-tokens", type=int, default=get_default("openai_max_tokens", "1024"))  # args.openai_max_tokens
+        parser.add_argument("--openai-api-base", type=str, default=os.environ.get(f"{env_prefix}OPENAI_API_BASE", openai_api_base))  # args.openai_api_base
+        parser.add_argument("--openai-api-type", type=str.lower, default=os.environ.get(f"{env_prefix}OPENAI_API_TYPE", openai_api_type))  # args.openai_api_type
+        parser.add_argument("--openai-proxy", type=str, default=get_default("openai_proxy", None), required=False)  # args.openai_proxy
+        parser.add_argument("--openai-timeout", type=float, default=get_default("openai_timeout", "30"))  # args.openai_timeout
+        parser.add_argument("--openai-max-retries", type=int, default=get_default("openai_max_retries", "2"))  # args.openai_max_retries
+        parser.add_argument("--openai-rate-limit", action=argparse.BooleanOptionalAction, default=True)  # args.openai_rate_limit
+        parser.add_argument("--openai-rate-limit-rpm", type=int, default=get_default("openai_rate_limit_rpm", None), required=False)  # args.openai_rate_limit_rpm
+        parser.add_argument("--openai-rate-limit-tpm", type=int, default=get_default("openai_rate_limit_tpm", None), required=False)  # args.openai_rate_limit_tpm
+        parser.add_argument("--openai-hedge-delay", type=float, default=None, required=False)  # args.openai_hedge_delay
+        parser.add_argument("--openai-hedge-env-prefix", type=str, default=None, required=False)  # args.openai_hedge_env_prefix
+        parser.add_argument("--openai-hedge-model", type=str, default=None, required=False)  # args.openai_hedge_model
+        parser.add_argument("--openai-route", type=str, action="append", default=None, required=False)  # args.openai_route
+        parser.add_argument("--openai-backend", type=str, action="append", default=None, required=False)  # args.openai_backend
+        parser.add_argument("--openai-backend-probe-ms", type=int, default=200)  # args.openai_backend_probe_ms
+        parser.add_argument(
+            "--latency-budget-ms",
+            type=int,
+            default=os.environ.get("CHATGPT_PRE_COMMIT_HOOKS_LATENCY_BUDGET_MS", settings.get("latency_budget_ms")),
+            required=False,
+        )  # args.latency_budget_ms
         parser.add_argument(
             "--openai-api-key",
             type=str,
-            default=os.environ.get(f"{env_prefix}OPENAI_API_KEY", openai.api_key),
+            default=os.environ.get(f"{env_prefix}OPENAI_API_KEY", os.environ.get("OPENAI_API_KEY")),
             help=argparse.SUPPRESS,
         )  # args.openai_api_key
 
+        self.__set_config_defaults(parser, settings)
         temp_args, unparsed = parser.parse_known_args()
-        temp_openai_api_type = temp_args.openai_api_type
-        if temp_openai_api_type == "azure":
+        if temp_args.openai_api_type == "azure":
             parser.add_argument(
                 "--openai-api-version",
                 type=str,
-                default=os.environ.get(f"{env_prefix}OPENAI_API_VERSION", "2023-03-15-preview"),
+                default=get_default("openai_api_version", "2023-03-15-preview"),
                 help=argparse.SUPPRESS,
             )  # args.openai_api_version
         else:
             parser.add_argument(
                 "--openai-organization",
                 type=str,
-                default=os.environ.get(f"{env_prefix}OPENAI_ORGANIZATION", openai.organization),
+                default=os.environ.get(f"{env_prefix}OPENAI_ORGANIZATION", os.environ.get("OPENAI_ORGANIZATION", settings.get("openai_organization"))),
                 help=argparse.SUPPRESS,
             )  # args.openai_organization
+        parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=True)  # args.cache
+        parser.add_argument("--cache-ttl", type=int, default=604800)  # args.cache_ttl
+        parser.add_argument("--cache-max-size", type=int, default=5242880)  # args.cache_max_size
+        parser.add_argument("--metrics", type=str, default=os.environ.get("CHATGPT_PRE_COMMIT_HOOKS_METRICS", settings.get("metrics")), required=False)  # args.metrics
+        validated = self.__set_config_defaults(parser, settings)
         args, unparsed = parser.parse_known_args()
+        for name, env_name in (("openai_route", "OPENAI_ROUTES"), ("openai_backend", "OPENAI_BACKENDS")):
+            if getattr(args, name) is None:
+                setattr(args, name, self.__get_list_default(f"{env_prefix}{env_name}", env_name, validated.get(name, [])))
         return args, unparsed, parser
 
+    def __set_config_defaults(self, parser: argparse.ArgumentParser, settings: dict[str, Any]) -> dict[str, Any]:
+        """Set defaults of the arguments known so far to the validated config file settings.
+
+        Defaults of settings read from environment variables are replaced only if they are the config file setting, so set
+        environment variables keep precedence. If the config file is invalid, its settings are dropped - the error is reported
+        (and the hook exits) once the logger is set, instead of argparse failing on the values.
+
+        Returns:
+        Get `dict` argument destination -> validated value.
+        """
+        try:
+            validated = self.config.get_validated(self.name, parser, complete=False)
+        except ConfigError as err:
+            self.config_error = str(err)
+            validated = {}
+        defaults = {action.dest: action.default for action in parser._actions if action.option_strings}  # noqa: SLF001
+        env_defaults = {name: validated.get(name) for name in ENV_SETTINGS & set(settings) if name in defaults and defaults[name] is settings[name]}
+        parser.set_defaults(**{name: value for name, value in validated.items() if name not in ENV_SETTINGS}, **env_defaults)
+        return validated
+
+    @staticmethod
+    def __get_list_default(env_name: str, global_env_name: str, default: list[str]) -> list[str]:
+        """Get default of a repeatable argument - the comma-separated environment variable (prefixed one first) if set, `default` otherwise."""
+        value = os.environ.get(env_name, os.environ.get(global_env_name))
+        if value is None:
+            return default
+        return [item.strip() for item in value.split(",") if item.strip()]
+
+    def __get_config(self, path: Optional[Path]) -> tuple[Config, Optional[str]]:
+        """Get config file (`--config`, `.chatgpt-hooks.toml` or `pyproject.toml`) - and the error if it can't be loaded, reported once the logger is set."""
+        try:
+            return load_config(get_config_path(path)), None
+        except ConfigError as err:
+            return Config(None, {}), str(err)
+
+    def __check_config(self) -> None:
+        """Check config file - settings of the arguments known so far, the rest are checked by `get_config_settings` of the hook."""
+        self.log.debug(f"CONFIG: {self.config.path}")
+        self.get_config_settings(complete=False)
+
+    def get_config_settings(self, *, complete: bool = True) -> dict[str, Any]:
+        """Get validated config file settings of the hook - exits if any of them is invalid.
+
+        Args:
+        complete: if all arguments of the hook are added to the parser - settings of unknown arguments are invalid then.
+
+        Returns:
+        Get `dict` argument destination -> value, settings read from environment variables excluded
+        (their defaults are set when the global arguments are added).
+        """
+        try:
+            settings = self.config.get_validated(self.name, self.args_parser, complete=complete)
+        except ConfigError as err:
+            self.config_error = str(err)
+        if self.config_error is not None:
+            self.log.error(f"Invalid config file {self.config_error}")
+            sys.exit(FAIL)
+        return {name: value for name, value in settings.items() if name not in ENV_SETTINGS}
+
     def __check_openai_api_key(self) -> None:
-        """Check API Key."""
-        if self.args_global.openai_api_key is None:
+        """Check API Key - not required with backends (e.g. a local server), the primary endpoint is the last resort then."""
+        if self.args_global.openai_api_key is None and not self.args_global.openai_backend:
             self.log.error("OPENAI_API_KEY is not set")
             sys.exit(FAIL)
 
-    def get_openai_chat_response(self, messages: list[dict[str, str]]) -> str:
-        """Get OpenAI Chat Response."""
-        if self.log.isEnabledFor(logging.DEBUG):
-            openai.debug = True
-
-        openai.api_key = self.args_global.openai_api_key
-        openai.api_base = self.args_global.openai_api_base
-        openai.api_type = self.args_global.openai_api_type
-        openai.proxy = self.args_global.openai_proxy
-
-        # ref: https://platform.openai.com/docs/api-reference/chat-completions/create
-        # ref: https://platform.openai.com/docs/guides/chat
-        if self.args_global.openai_api_type == "azure":
-            model = None
-            engine = self.args_global.openai_model
-            api_version = self.args_global.openai_api_version
-        else:
-            openai.organization = self.args_global.openai_organization
-            model = self.args_global.openai_model
-            engine = None
-            api_version = None
-
-        response = openai.ChatCompletion.create(
-            model=model,
-            engine=engine,
-            api_version=api_version,
-            messages=messages,
-            max_tokens=int(self.args_global.openai_max_tokens),
-            temperature=0,
-            top_p=0.1,
+    def __get_openai_routes(self) -> list[tuple[str, Optional[int], Optional[int]]]:
+        """Get routes of `--openai-route MODEL[:MAX_PROMPT_TOKENS[:MAX_FILES]]` - limits are `None` if not set."""
+        routes = []
+        for route in self.args_global.openai_route:
+            model, _, limits = route.partition(":")
+            max_prompt_tokens, _, max_files = limits.partition(":")
+            if not model or not all(limit.isdigit() for limit in (max_prompt_tokens, max_files) if limit):
+                self.log.error(f"Invalid --openai-route {route}, expected MODEL[:MAX_PROMPT_TOKENS[:MAX_FILES]]")
+                sys.exit(FAIL)
+            routes.append((model, int(max_prompt_tokens) if max_prompt_tokens else None, int(max_files) if max_files else None))
+        self.log.debug(f"OPENAI_ROUTES: {routes}")
+        return routes
+
+    def __get_openai_backends(self) -> list[tuple[str, Optional[str]]]:
+        """Get backends of `--openai-backend API_BASE[#MODEL]` - the model is `None` if not set (the model of the request is used)."""
+        backends = []
+        for backend in self.args_global.openai_backend:
+            api_base, _, model = backend.partition("#")
+            if not api_base.startswith(("http://", "https://")):
+                self.log.error(f"Invalid --openai-backend {backend}, expected API_BASE[#MODEL], e.g. http://127.0.0.1:8080/v1")
+                sys.exit(FAIL)
+            backends.append((api_base, model or None))
+        self.log.debug(f"OPENAI_BACKENDS: {backends}")
+        return backends
+
+    def get_openai_models(self) -> list[str]:
+        """Get models requests can be routed to - models of the routes, followed by `--openai-model`."""
+        return [*(model for model, _, _ in self.openai_routes), self.args_global.openai_model]
+
+    def route_openai_model(self, messages: list[dict[str, str]], files: int) -> str:
+        """Get model of the request - the first route within the limits whose context window fits the prompt and the completion.
+
+        Args:
+        messages: prompt messages.
+        files: number of source files touched by the changes.
+
+        Returns:
+        Get `str` model of the first fitting route, `--openai-model` if none of them fit and it does, the model with the largest context window otherwise.
+        """
+        if not self.openai_routes:
+            return self.args_global.openai_model
+
+        max_tokens = int(self.args_global.openai_max_tokens)
+        routes = [*self.openai_routes, (self.args_global.openai_model, None, None)]
+        for model, max_prompt_tokens, max_files in routes:
+            prompt_tokens = self.num_tokens_from_messages(messages, model)
+            if (max_prompt_tokens is not None and prompt_tokens > max_prompt_tokens) or (max_files is not None and files > max_files):
+                continue
+            if prompt_tokens + max_tokens <= self.get_openai_model_context_window(model):
+                self.log.debug(f"OPENAI_ROUTE: {model} - {prompt_tokens} prompt tokens, {files} files")
+                self.metrics.tags["routed_model"] = model
+                return model
+
+        model = max(self.get_openai_models(), key=self.get_openai_model_context_window)
+        self.log.debug(f"OPENAI_ROUTE: {model} - largest context window, no route fits")
+        self.metrics.tags["routed_model"] = model
+        return model
+
+    def get_git_dir(self) -> Optional[Path]:
+        """Get path of the `.git` directory (if in a git repository) - looked up once per run."""
+        return self.context.get_git_dir()
+
+    def __get_cache(self) -> Optional[ResponseCache]:
+        """Get response cache stored under `.git/` (if enabled)."""
+        if not self.args_global.cache:
+            return None
+
+        git_dir = self.get_git_dir()
+        if git_dir is None:
+            self.log.debug("CACHE: disabled - not a git repository")
+            return None
+
+        return ResponseCache(git_dir.joinpath("chatgpt-pre-commit-hooks", "cache"), ttl=self.args_global.cache_ttl, max_size=self.args_global.cache_max_size, log=self.log)
+
+    def __get_cache_key(self, messages: list[dict[str, str]], max_tokens: int, model: str, n: int = 1) -> str:
+        """Get response cache key of the request."""
+        return ResponseCache.get_key(
+            {
+                "messages": messages,
+                "model": model,
+                "max_tokens": max_tokens,
+                "n": n,
+                "temperature": OPENAI_TEMPERATURE,
+                "top_p": OPENAI_TOP_P,
+                "api_type": self.args_global.openai_api_type,
+                "api_base": self.args_global.openai_api_base,
+            },
         )
-        self.log.debug(f"OPENAI_CHAT_RESPONSE: {response}")
 
-        return response["choices"][0]["message"]["content"]  # type: ignore  # noqa: PGH003
+    def get_openai_chat_response(
+        self,
+        messages: list[dict[str, str]],
+        on_delta: Optional[Callable[[str], bool]] = None,
+        max_tokens: Optional[int] = None,
+        model: Optional[str] = None,
+    ) -> str:
+        """Get OpenAI Chat Response (from the response cache if available).
+
+        Args:
+        messages: prompt messages.
+        on_delta: if set, the response is streamed and the callback is called with every received chunk of content;
+            returning `False` from the callback stops the stream early - the partial response isn't cached then.
+        max_tokens: max tokens of the completion, `--openai-max-tokens` if not set.
+        model: model of the request (see `route_openai_model`), `--openai-model` if not set.
+
+        Returns:
+        Get `str` content of the response.
+        """
+        max_tokens = int(self.args_global.openai_max_tokens) if max_tokens is None else max_tokens
+        model = model or self.args_global.openai_model
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.__get_cache_key(messages, max_tokens, model)
+            cached_response = self.cache.get(cache_key)
+            if cached_response is not None:
+                self.log.debug(f"OPENAI_CHAT_RESPONSE_CACHE_HIT: {cache_key}")
+                self.metrics.set_outcome("cache_hit")
+                self.metrics.add_count("cache_hits", 1)
+                if on_delta is not None:
+                    on_delta(cached_response)
+                return cached_response
+            self.log.debug(f"OPENAI_CHAT_RESPONSE_CACHE_MISS: {cache_key}")
+            self.metrics.add_count("cache_misses", 1)
+
+        start = time.perf_counter()
+        # set once some of a streamed response was received - it doesn't fail over then
+        received = threading.Event()
+        # set if the stream was stopped early by the callback
+        stopped = threading.Event()
+        on_delta_timed = on_delta
+        if on_delta is not None:
+
+            def on_delta_timed(delta: str) -> bool:
+                received.set()
+                self.metrics.mark("api_first_token", start)
+                if on_delta(delta):
+                    return True
+                stopped.set()
+                return False
+
+        content = self.run_openai_request(model, lambda client, timeout: client.chat(messages, max_tokens, on_delta_timed, timeout), "api", received=received)
+        if self.cache is not None and cache_key is not None and not stopped.is_set():
+            self.cache.put(cache_key, content)
+        self.__add_token_counts([messages], [content], model)
+
+        return content
+
+    def get_openai_chat_choices(self, messages: list[dict[str, str]], n: int, model: Optional[str] = None) -> list[str]:
+        """Get OpenAI Chat Response choices of a single request (from the response cache if available).
+
+        Args:
+        messages: prompt messages.
+        n: number of choices, sampled with a higher temperature if more than one.
+        model: model of the request (see `route_openai_model`), `--openai-model` if not set.
+
+        Returns:
+        Get `list[str]` content of each choice.
+        """
+        max_tokens = int(self.args_global.openai_max_tokens)
+        model = model or self.args_global.openai_model
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.__get_cache_key(messages, max_tokens, model, n)
+            cached_choices = self.cache.get(cache_key)
+            if isinstance(cached_choices, list):
+                self.log.debug(f"OPENAI_CHAT_RESPONSE_CACHE_HIT: {cache_key}")
+                self.metrics.set_outcome("cache_hit")
+                self.metrics.add_count("cache_hits", 1)
+                return cached_choices
+            self.log.debug(f"OPENAI_CHAT_RESPONSE_CACHE_MISS: {cache_key}")
+            self.metrics.add_count("cache_misses", 1)
+
+        choices = self.run_openai_request(model, lambda client, timeout: client.chat_choices(messages, max_tokens, n, timeout), "api")
+        if self.cache is not None and cache_key is not None:
+            self.cache.put(cache_key, choices)
+        self.__add_token_counts([messages], ["".join(choices)], model)
+
+        return choices
+
+    def get_openai_chat_responses(
+        self,
+        requests: list[list[dict[str, str]]],
+        max_tokens: Optional[int] = None,
+        concurrency: int = 4,
+        model: Optional[str] = None,
+    ) -> list[str]:
+        """Get OpenAI Chat Responses of many requests - cache misses are sent concurrently over a shared connection pool.
+
+        Args:
+        requests: prompt messages of each request.
+        max_tokens: max tokens of each completion, `--openai-max-tokens` if not set.
+        concurrency: max number of requests sent at the same time.
+        model: model of the requests, `--openai-model` if not set.
+
+        Returns:
+        Get `list[str]` content of each response.
+        """
+        max_tokens = int(self.args_global.openai_max_tokens) if max_tokens is None else max_tokens
+        model = model or self.args_global.openai_model
+        responses: list[Optional[str]] = [None] * len(requests)
+        cache_keys: list[Optional[str]] = [None] * len(requests)
+        if self.cache is not None:
+            for index, messages in enumerate(requests):
+                cache_keys[index] = self.__get_cache_key(messages, max_tokens, model)
+                responses[index] = self.cache.get(cache_keys[index])  # type: ignore  # noqa: PGH003
+        self.log.debug(f"OPENAI_CHAT_RESPONSES_CACHE_HITS: {sum(response is not None for response in responses)}/{len(requests)}")
+
+        missing = [index for index, response in enumerate(responses) if response is None]
+        if self.cache is not None:
+            self.metrics.add_count("cache_hits", len(requests) - len(missing))
+            self.metrics.add_count("cache_misses", len(missing))
+        missing_requests = [requests[index] for index in missing]
+        contents = self.run_openai_request(
+            model,
+            lambda client, timeout: client.chat_many(missing_requests, max_tokens, concurrency, timeout),
+            "api_many",
+        )
+        self.__add_token_counts(missing_requests, contents, model)
+        for index, content in zip(missing, contents):
+            responses[index] = content
+            cache_key = cache_keys[index]
+            if self.cache is not None and cache_key is not None:
+                self.cache.put(cache_key, content)
+
+        return [response or "" for response in responses]
+
+    def __add_token_counts(self, requests: list[list[dict[str, str]]], contents: list[str], model: str) -> None:
+        """Add prompt and completion tokens of sent requests to the metrics."""
+        if not self.metrics.enabled:
+            return
+        counter = get_token_counter(model)
+        self.metrics.add_count("requests", len(requests))
+        self.metrics.add_count("prompt_tokens", sum(counter.count_messages(messages) for messages in requests))
+        self.metrics.add_count("completion_tokens", sum(counter.count_batch(contents)))
+
+    def run_openai_request(self, model: str, request: Callable[[OpenAiClient, Optional[float]], T], span: str, *, received: Optional[threading.Event] = None) -> T:
+        """Run request on the clients of the model, failing over to the next one on errors, within the latency budget.
+
+        Args:
+        model: model of the request.
+        request: function sending the request with the client, and the timeout in seconds (`None` without the latency budget).
+        span: metrics span of the request.
+        received: event set once some of a streamed response was received - the request doesn't fail over then.
+
+        Returns:
+        Get response of the first client answering.
+        Exits with PASS - leaving the commit message untouched - if no client answers within `--latency-budget-ms`,
+        which is shared by all requests of the hook run (e.g. map-reduce summaries).
+        """
+        deadline = self.__get_latency_deadline()
+        with self.metrics.span("client"):
+            clients = self.get_openai_clients(model)
+        error: Optional[BaseException] = None
+        for name, client in clients:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                with self.metrics.span(span):
+                    return request(client, timeout)
+            except Exception as err:  # noqa: BLE001
+                error = err
+                self.log.debug(f"OPENAI_BACKEND: {name} failed - {err.__class__.__name__}: {err}")
+                self.metrics.add_count("failovers", 1)
+                if received is not None and received.is_set():
+                    break
+        if deadline is not None and (error is None or time.monotonic() >= deadline):
+            self.log.warning(f"No response within the latency budget of {self.args_global.latency_budget_ms} ms - commit message left untouched")
+            self.metrics.set_outcome("latency_budget")
+            self.self_exit(PASS)
+        elif deadline is not None:
+            self.log.warning(f"No response - {error.__class__.__name__}: {error} - commit message left untouched")
+            self.metrics.set_outcome("error")
+            self.self_exit(PASS)
+        raise error  # type: ignore  # noqa: PGH003
+
+    def __get_latency_deadline(self) -> Optional[float]:
+        """Get deadline (`time.monotonic()`) of requests - the latency budget starts with the first request of the hook run, `None` without it."""
+        if self.args_global.latency_budget_ms is None:
+            return None
+        if self.__latency_deadline is None:
+            self.__latency_deadline = time.monotonic() + int(self.args_global.latency_budget_ms) / 1000
+        return self.__latency_deadline
+
+    def get_openai_clients(self, model: Optional[str] = None) -> list[tuple[str, OpenAiClient]]:
+        """Get clients of the model in order of preference - healthy backends (see `--openai-backend`), followed by the primary endpoint."""
+        model = model or self.args_global.openai_model
+        clients = []
+        for api_base, backend_model in self.openai_backends:
+            with self.metrics.span("probe"):
+                healthy = is_healthy(api_base, int(self.args_global.openai_backend_probe_ms) / 1000)
+            if not healthy:
+                self.log.debug(f"OPENAI_BACKEND: {api_base} - unhealthy, skipped")
+                continue
+            endpoint = OpenAiEndpoint(model=backend_model or model, api_key=self.args_global.openai_api_key or OPENAI_BACKEND_API_KEY, api_base=api_base, api_type="open_ai")
+            # backends fail over instead of retrying
+            client = get_client(endpoint, timeout=float(self.args_global.openai_timeout), max_retries=0, proxy=self.args_global.openai_proxy, log=self.log)
+            clients.append((api_base, client))
+        clients.append((self.args_global.openai_api_base, self.get_openai_client(model)))
+        return clients
+
+    def get_openai_client(self, model: Optional[str] = None) -> OpenAiClient:
+        """Get OpenAI client of the model (`--openai-model` if not set) shared by all requests of the process."""
+        import openai
+
+        openai.log = "debug" if self.log.isEnabledFor(logging.DEBUG) else None
+
+        endpoint = OpenAiEndpoint(
+            model=model or self.args_global.openai_model,
+            api_key=self.args_global.openai_api_key,
+            api_base=self.args_global.openai_api_base,
+            api_type=self.args_global.openai_api_type,
+            api_version=getattr(self.args_global, "openai_api_version", None),
+            organization=getattr(self.args_global, "openai_organization", None),
+        )
+        return get_client(
+            endpoint,
+            timeout=float(self.args_global.openai_timeout),
+            max_retries=int(self.args_global.openai_max_retries),
+            proxy=self.args_global.openai_proxy,
+            hedge_endpoint=self.__get_openai_hedge_endpoint(endpoint),
+            hedge_delay=self.args_global.openai_hedge_delay,
+            rate_limiter=self.__get_rate_limiter(endpoint),
+            log=self.log,
+        )
+
+    def __get_rate_limiter(self, endpoint: OpenAiEndpoint) -> Optional[RateLimiter]:
+        """Get rate limiter of the endpoint, API key and model - shared by all processes of the host (if enabled)."""
+        if not self.args_global.openai_rate_limit:
+            return None
+        return RateLimiter(
+            get_state_path(endpoint.api_base, endpoint.api_key, endpoint.model),
+            requests_per_minute=self.args_global.openai_rate_limit_rpm,
+            tokens_per_minute=self.args_global.openai_rate_limit_tpm,
+            log=self.log,
+        )
+
+    def __get_openai_hedge_endpoint(self, endpoint: OpenAiEndpoint) -> Optional[OpenAiEndpoint]:
+        """Get endpoint of hedged requests - from `--openai-hedge-env-prefix` prefixed environment variables, falling back to the primary endpoint."""
+        if self.args_global.openai_hedge_delay is None:
+            return None
+
+        hedge_env_prefix = f"{self.args_global.openai_hedge_env_prefix.upper()}__" if self.args_global.openai_hedge_env_prefix else ""
+        api_type = os.environ.get(f"{hedge_env_prefix}OPENAI_API_TYPE", endpoint.api_type).lower()
+        return OpenAiEndpoint(
+            model=self.args_global.openai_hedge_model or os.environ.get(f"{hedge_env_prefix}OPENAI_MODEL", endpoint.model),
+            api_key=os.environ.get(f"{hedge_env_prefix}OPENAI_API_KEY", endpoint.api_key),
+            api_base=os.environ.get(f"{hedge_env_prefix}OPENAI_API_BASE", endpoint.api_base),
+            api_type=api_type,
+            api_version=os.environ.get(f"{hedge_env_prefix}OPENAI_API_VERSION", endpoint.api_version or "2023-03-15-preview"),
+            organization=os.environ.get(f"{hedge_env_prefix}OPENAI_ORGANIZATION", endpoint.organization),
+        )
+
+    def get_openai_model_context_window(self, model: str) -> int:
+        """Return the context window size (in tokens) of the model."""
+        return get_token_counter(model).context_window
+
+    def num_tokens_from_strings(self, texts: list[str], model: str) -> list[int]:
+        """Return the number of tokens of each string."""
+        with self.metrics.span("tokens"):
+            return self.context.count_tokens_batch(model, texts, get_token_counter(model).count_batch)
 
     def num_tokens_from_messages(self, messages: list[dict[str, str]], model: str) -> int:
         """Return the number of tokens used by a list of messages."""
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            encoding = tiktoken.get_encoding("cl100k_base")
-        if model == "gpt-3.5-turbo":
-            # Warning: gpt-3.5-turbo may change over time. Returning num tokens assuming gpt-3.5-turbo-0301.
-            return self.num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301")
-        if model == "gpt-4":
-            # Warning: gpt-4 may change over time. Returning num tokens assuming gpt-4-0314.
-            return self.num_tokens_from_messages(messages, model="gpt-4-0314")
-        if model == "gpt-3.5-turbo-0301":
-            tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-            tokens_per_name = -1  # if there's a name, the role is omitted
-        elif model == "gpt-4-0314":
-            tokens_per_message = 3
-            tokens_per_name = 1
-        else:
-            error_msg = f"""num_tokens_from_messages() is not implemented for model {model}.
-                See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
-            self.log.error(error_msg)
-            self.self_exit(FAIL)
-        num_tokens = 0
-        for message in messages:
-            num_tokens += tokens_per_message
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":
-                    num_tokens += tokens_per_name
-        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+        key = (model, *((message["role"], message["content"]) for message in messages))
+        with self.metrics.span("tokens"):
+            num_tokens = self.context.count_tokens(key, lambda: get_token_counter(model).count_messages(messages))
         self.log.debug(f"NUM_TOKENS: {num_tokens}")
         return num_tokens
 
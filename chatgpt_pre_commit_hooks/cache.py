@@ -0,0 +1,126 @@
+"""``cache``.
+
+A module containing the on-disk, content-addressed response cache.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+
+class ResponseCache:
+    """Content-addressed cache with TTL and size-based LRU eviction.
+
+    Every entry is stored as a single JSON file named after its key. The file modification time
+    is bumped on every hit, so it doubles as the "last used" timestamp for LRU eviction.
+    """
+
+    def __init__(self, directory: Path, ttl: int, max_size: int, log: Optional[logging.Logger] = None) -> None:
+        """Initialize cache.
+
+        Args:
+        directory: directory where cache entries are stored.
+        ttl: time to live of an entry in seconds.
+        max_size: max size of all entries in bytes.
+        log: logger.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.log = log or logging.getLogger(__name__)
+
+    @staticmethod
+    def get_key(payload: dict[str, Any]) -> str:
+        """Get cache key as a hash of the payload.
+
+        Args:
+        payload: JSON serializable request payload.
+
+        Returns:
+        Get `str` SHA-256 hex digest.
+        """
+        serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get cached value.
+
+        Args:
+        key: cache key.
+
+        Returns:
+        Get cached value or `None` if missing or expired.
+        """
+        entry_path = self.__get_entry_path(key)
+        try:
+            with entry_path.open("rt", encoding="utf-8") as handle:
+                entry = json.load(handle)
+            if time.time() - entry["created"] > self.ttl:
+                self.log.debug(f"CACHE_EXPIRED: {key}")
+                entry_path.unlink(missing_ok=True)
+                return None
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            self.log.debug(f"CACHE_READ_ERROR: {key} - {err}")
+            return None
+
+        return entry["value"]
+
+    def put(self, key: str, value: Any) -> None:  # noqa: ANN401
+        """Set cached value and evict entries above the limits.
+
+        Args:
+        key: cache key.
+        value: JSON serializable value.
+        """
+        self.put_many({key: value})
+
+    def put_many(self, values: dict[str, Any]) -> None:
+        """Set cached values and evict entries above the limits (once).
+
+        Args:
+        values: JSON serializable values by cache key.
+        """
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for key, value in values.items():
+                with tempfile.NamedTemporaryFile("wt", encoding="utf-8", dir=self.directory, suffix=".tmp", delete=False) as handle:
+                    json.dump({"created": time.time(), "value": value}, handle, ensure_ascii=False)
+                Path(handle.name).replace(self.__get_entry_path(key))
+            if values:
+                self.__evict()
+        except OSError as err:
+            self.log.debug(f"CACHE_WRITE_ERROR: {', '.join(values)} - {err}")
+
+    def __get_entry_path(self, key: str) -> Path:
+        """Get path of the cache entry."""
+        return self.directory.joinpath(f"{key}.json")
+
+    def __evict(self) -> None:
+        """Remove expired entries, then least recently used ones until the cache fits max size."""
+        now = time.time()
+        entries = []
+        for entry_path in self.directory.glob("*.json"):
+            try:
+                stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                entry_path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            self.log.debug(f"CACHE_EVICT: {entry_path.stem}")
+            entry_path.unlink(missing_ok=True)
+            total_size -= size
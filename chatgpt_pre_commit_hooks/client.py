@@ -0,0 +1,452 @@
+"""``client``.
+
+A module containing the async OpenAI chat completions client.
+"""
+
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import random
+import threading
+import time
+from collections.abc import Awaitable
+from typing import TYPE_CHECKING, Any, Callable, Optional, TypeVar
+
+from chatgpt_pre_commit_hooks import profiler
+from chatgpt_pre_commit_hooks.metrics import get_current
+from chatgpt_pre_commit_hooks.ratelimit import RateLimiter
+from chatgpt_pre_commit_hooks.tokens import get_token_counter
+
+if TYPE_CHECKING:
+    import aiohttp
+
+T = TypeVar("T")
+
+OPENAI_TEMPERATURE = 0
+OPENAI_TOP_P = 0.1
+# sampling of multiple choices - they would be all the same with the defaults
+OPENAI_CHOICES_TEMPERATURE = 0.8
+OPENAI_CHOICES_TOP_P = 1
+
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+RETRY_STATUSES = [408, 409, 429, 500, 502, 503, 504]
+CONNECTION_POOL_LIMIT = 16
+# results of backend health probes are reused for this many seconds
+PROBE_TTL = 30.0
+
+
+class OpenAiEndpoint:
+    """Settings of an OpenAI or Azure OpenAI endpoint."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        model: str,
+        api_key: Optional[str],
+        api_base: str,
+        api_type: str,
+        api_version: Optional[str] = None,
+        organization: Optional[str] = None,
+    ) -> None:
+        """Initialize endpoint."""
+        self.model = model
+        self.api_key = api_key
+        self.api_base = api_base
+        self.api_type = api_type
+        self.api_version = api_version
+        self.organization = organization
+
+    def __repr__(self) -> str:
+        """Get representation without the API key."""
+        return f"OpenAiEndpoint(model={self.model!r}, api_base={self.api_base!r}, api_type={self.api_type!r})"
+
+    def get_request_params(self) -> dict[str, Any]:
+        """Get endpoint specific request params of `openai.ChatCompletion.acreate`."""
+        # ref: https://platform.openai.com/docs/api-reference/chat-completions/create
+        # ref: https://learn.microsoft.com/en-us/azure/cognitive-services/openai/reference#chat-completions
+        params: dict[str, Any] = {"api_key": self.api_key, "api_base": self.api_base, "api_type": self.api_type}
+        if self.api_type == "azure":
+            params.update({"engine": self.model, "api_version": self.api_version})
+        else:
+            params.update({"model": self.model, "organization": self.organization})
+        return params
+
+
+class ProxiedSession:
+    """`aiohttp` session wrapper passing the proxy of its client to every request."""
+
+    def __init__(self, session: "aiohttp.ClientSession", proxy: Optional[str]) -> None:
+        """Initialize session wrapper."""
+        self.session = session
+        self.proxy = proxy
+
+    def request(self, method: str, url: str, **kwargs: object) -> Awaitable["aiohttp.ClientResponse"]:
+        """Send request through the proxy of the client - unless it was given one."""
+        kwargs["proxy"] = kwargs.get("proxy") or self.proxy
+        return self.session.request(method, url, **kwargs)  # type: ignore[arg-type]
+
+    def __getattr__(self, name: str) -> object:
+        """Get attribute of the wrapped session."""
+        return getattr(self.session, name)
+
+
+class OpenAiClient:
+    """Async chat completions client with a pooled HTTP session, timeouts, retries and optional hedging.
+
+    The client owns an event loop, running in a background thread, and a single `aiohttp` session, so connections are reused
+    across all requests of the process - also of hooks running concurrently in threads.
+    With a rate limiter, requests to the primary endpoint are scheduled within its limits, shared by all processes of the host.
+    With hedging, a duplicate request is sent to the hedge endpoint if the primary one doesn't answer within the hedge delay,
+    and whichever answers first wins.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        endpoint: OpenAiEndpoint,
+        timeout: float,
+        max_retries: int,
+        proxy: Optional[str] = None,
+        hedge_endpoint: Optional[OpenAiEndpoint] = None,
+        hedge_delay: Optional[float] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        log: Optional[logging.Logger] = None,
+    ) -> None:
+        """Initialize client."""
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.proxy = proxy
+        self.hedge_endpoint = hedge_endpoint
+        self.hedge_delay = hedge_delay
+        self.rate_limiter = rate_limiter
+        self.log = log or logging.getLogger(__name__)
+        self.__lock = threading.Lock()
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__thread: Optional[threading.Thread] = None
+        self.__session: Optional[aiohttp.ClientSession] = None
+
+    def run(self, coroutine: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """Run coroutine on the client's event loop and wait for its result - coroutines of concurrent callers run concurrently.
+
+        The coroutine runs in a copy of the caller's context, so e.g. metrics of the current hook run are recorded.
+        If it doesn't complete within `timeout` seconds, it's cancelled and `concurrent.futures.TimeoutError` is raised.
+        """
+        with self.__lock:
+            if self.__loop is None or self.__loop.is_closed():
+                self.__loop = asyncio.new_event_loop()
+                self.__thread = threading.Thread(target=self.__loop.run_forever, name="chatgpt-pre-commit-hooks-client", daemon=True)
+                self.__thread.start()
+            loop = self.__loop
+        future = asyncio.run_coroutine_threadsafe(self.__with_session(coroutine), loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def chat(self, messages: list[dict[str, str]], max_tokens: int, on_delta: Optional[Callable[[str], bool]] = None, timeout: Optional[float] = None) -> str:
+        """Get chat completion content."""
+        return self.run(lambda: self.achat(messages, max_tokens, on_delta), timeout)
+
+    def chat_choices(self, messages: list[dict[str, str]], max_tokens: int, n: int, timeout: Optional[float] = None) -> list[str]:
+        """Get contents of `n` chat completion choices of a single request."""
+        return self.run(lambda: self.__request(self.endpoint, messages, max_tokens, n=n), timeout)
+
+    def chat_many(self, requests: list[list[dict[str, str]]], max_tokens: int, concurrency: int, timeout: Optional[float] = None) -> list[str]:
+        """Get chat completion contents of many requests, running up to `concurrency` of them at the same time."""
+
+        async def chat_many() -> list[str]:
+            semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+            async def achat(messages: list[dict[str, str]]) -> str:
+                async with semaphore:
+                    return await self.achat(messages, max_tokens)
+
+            return list(await asyncio.gather(*(achat(messages) for messages in requests)))
+
+        return self.run(chat_many, timeout)
+
+    async def achat(self, messages: list[dict[str, str]], max_tokens: int, on_delta: Optional[Callable[[str], bool]] = None) -> str:
+        """Get chat completion content - hedged if configured (streamed responses are never hedged)."""
+        if on_delta is not None or self.hedge_endpoint is None or self.hedge_delay is None:
+            return (await self.__request(self.endpoint, messages, max_tokens, on_delta))[0]
+
+        primary = asyncio.ensure_future(self.__request(self.endpoint, messages, max_tokens))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay)
+        if done:
+            return primary.result()[0]
+
+        self.log.debug(f"OPENAI_HEDGE: no response after {self.hedge_delay}s - sending request to {self.hedge_endpoint}")
+        hedge = asyncio.ensure_future(self.__request(self.hedge_endpoint, messages, max_tokens))
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    self.log.debug(f"OPENAI_HEDGE: {'primary' if task is primary else 'hedge'} request won")
+                    return task.result()[0]
+                error = task.exception()
+        raise error  # type: ignore  # noqa: PGH003
+
+    def close(self) -> None:
+        """Close the HTTP session and stop the event loop."""
+        with self.__lock:
+            if self.__loop is None or self.__loop.is_closed():
+                return
+            if self.__session is not None:
+                asyncio.run_coroutine_threadsafe(self.__session.close(), self.__loop).result()
+                self.__session = None
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            if self.__thread is not None:
+                self.__thread.join()
+            self.__loop.close()
+
+    async def __with_session(self, coroutine: Callable[[], Awaitable[T]]) -> T:
+        """Run coroutine with the pooled session set as the `openai` module session.
+
+        The `openai` module passes its global proxy to every request, so the session passes the proxy of this client instead -
+        clients with different proxies may run concurrently.
+        """
+        import aiohttp
+        import openai
+
+        if self.__session is None or self.__session.closed:
+            connector = aiohttp.TCPConnector(limit=CONNECTION_POOL_LIMIT, keepalive_timeout=60)
+            self.__session = aiohttp.ClientSession(connector=connector, trust_env=True, trace_configs=[self.__get_trace_config()])
+        openai.aiosession.set(ProxiedSession(self.__session, self.proxy))  # type: ignore[arg-type]
+        return await coroutine()
+
+    def __get_trace_config(self) -> "aiohttp.TraceConfig":
+        """Get trace config recording time to first byte (response headers) of the current hook run - and passing rate limit headers of the primary endpoint to the rate limiter.
+
+        With `--profile`, network phases of every request are recorded too - DNS, connect, time to first byte and body.
+        """
+        import aiohttp
+
+        async def on_request_start(_session: aiohttp.ClientSession, context: Any, params: Any) -> None:  # noqa: ANN401
+            context.start = time.perf_counter()
+            active = profiler.get_active()
+            context.profile = active.add_request(params.method, params.url.host or "") if active is not None else None
+
+        async def on_request_end(_session: aiohttp.ClientSession, context: Any, params: Any) -> None:  # noqa: ANN401
+            metrics = get_current()
+            if metrics is not None:
+                metrics.mark("api_ttfb", context.start)
+            if self.rate_limiter is not None and str(params.url).startswith(self.endpoint.api_base.rstrip("/")):
+                self.rate_limiter.update(params.response.headers, params.response.status)
+            if context.profile is not None:
+                context.headers = time.perf_counter()
+                connected = context.profile.get("connected", context.start)
+                context.profile.update(ttfb=(context.headers - connected) * 1000, status=params.response.status)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        for phase, signals in self.__get_profile_signals(trace_config).items():
+            start_signal, end_signal = signals
+            start_signal.append(self.__get_profile_phase_start(phase))
+            end_signal.append(self.__get_profile_phase_end(phase))
+        trace_config.on_response_chunk_received.append(self.__on_profile_chunk)
+        return trace_config
+
+    @staticmethod
+    def __get_profile_signals(trace_config: "aiohttp.TraceConfig") -> dict[str, tuple[Any, Any]]:
+        """Get start and end signals of the profiled network phases of requests."""
+        return {
+            "dns": (trace_config.on_dns_resolvehost_start, trace_config.on_dns_resolvehost_end),
+            "connect": (trace_config.on_connection_create_start, trace_config.on_connection_create_end),
+        }
+
+    @staticmethod
+    def __get_profile_phase_start(phase: str) -> Callable[..., Awaitable[None]]:
+        """Get trace callback of the start of the network phase."""
+
+        async def on_start(_session: Any, context: Any, _params: Any) -> None:  # noqa: ANN401
+            if getattr(context, "profile", None) is not None:
+                context.profile[f"{phase}_start"] = time.perf_counter()
+
+        return on_start
+
+    @staticmethod
+    def __get_profile_phase_end(phase: str) -> Callable[..., Awaitable[None]]:
+        """Get trace callback of the end of the network phase - the connection is ready after it."""
+
+        async def on_end(_session: Any, context: Any, _params: Any) -> None:  # noqa: ANN401
+            if getattr(context, "profile", None) is not None and f"{phase}_start" in context.profile:
+                context.profile["connected"] = time.perf_counter()
+                context.profile[phase] = (context.profile["connected"] - context.profile.pop(f"{phase}_start")) * 1000
+
+        return on_end
+
+    @staticmethod
+    async def __on_profile_chunk(_session: Any, context: Any, params: Any) -> None:  # noqa: ANN401
+        """Record time of the response body and its size - up to the last received chunk."""
+        if getattr(context, "profile", None) is not None and hasattr(context, "headers"):
+            context.profile["body"] = (time.perf_counter() - context.headers) * 1000
+            context.profile["bytes"] += len(params.chunk)
+
+    async def __request(
+        self,
+        endpoint: OpenAiEndpoint,
+        messages: list[dict[str, str]],
+        max_tokens: int,
+        on_delta: Optional[Callable[[str], bool]] = None,
+        *,
+        n: int = 1,
+    ) -> list[str]:
+        """Send request with timeout, retrying with exponential backoff on rate limits, server errors and timeouts.
+
+        Returns:
+        Get `list[str]` contents of the `n` choices (a single one if streamed).
+        """
+        import openai
+
+        attempt = 0
+        while True:
+            received: list[str] = []
+            if self.rate_limiter is not None and endpoint is self.endpoint:
+                await self.__wait_rate_limit(endpoint, messages, max_tokens * n)
+            try:
+                response = await openai.ChatCompletion.acreate(
+                    **endpoint.get_request_params(),
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=OPENAI_TEMPERATURE if n == 1 else OPENAI_CHOICES_TEMPERATURE,
+                    top_p=OPENAI_TOP_P if n == 1 else OPENAI_CHOICES_TOP_P,
+                    n=n,
+                    stream=on_delta is not None,
+                    request_timeout=self.timeout,
+                )
+                if on_delta is None:
+                    self.log.debug(f"OPENAI_CHAT_RESPONSE: {response}")
+                    return [choice["message"]["content"] for choice in response["choices"]]  # type: ignore  # noqa: PGH003
+                return [await self.__read_stream(response, on_delta, received)]  # type: ignore  # noqa: PGH003
+            except (openai.error.OpenAIError, asyncio.TimeoutError) as err:
+                # a partially streamed response can't be retried
+                if attempt >= self.max_retries or received or not self.__is_retryable(err):
+                    raise
+                delay = self.__get_backoff_delay(err, attempt)
+                self.log.debug(f"OPENAI_RETRY: {err.__class__.__name__} - retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def __wait_rate_limit(self, endpoint: OpenAiEndpoint, messages: list[dict[str, str]], max_tokens: int) -> None:
+        """Reserve the request in the rate limiter and wait if its buckets are exhausted - tokens are the prompt tokens and max tokens of the completion."""
+        if self.rate_limiter is None:
+            return
+        wait = self.rate_limiter.acquire(lambda: get_token_counter(endpoint.model).count_messages(messages) + max_tokens)
+        if wait > 0:
+            metrics = get_current()
+            if metrics is not None:
+                metrics.add_span("rate_limit_wait", wait * 1000)
+            await asyncio.sleep(wait)
+
+    async def __read_stream(self, response: Any, on_delta: Callable[[str], bool], received: list[str]) -> str:  # noqa: ANN401
+        """Read streamed response chunks."""
+        try:
+            async for chunk in response:
+                delta = chunk["choices"][0]["delta"].get("content") if chunk["choices"] else None
+                if not delta:
+                    continue
+                received.append(delta)
+                if on_delta(delta) is False:
+                    self.log.debug("OPENAI_CHAT_RESPONSE_STREAM: stopped early")
+                    break
+        finally:
+            await response.aclose()
+
+        self.log.debug(f"OPENAI_CHAT_RESPONSE_STREAM: {received}")
+        return "".join(received)
+
+    def __is_retryable(self, err: BaseException) -> bool:
+        """Check if the request failure is worth retrying."""
+        import openai
+
+        if isinstance(err, (asyncio.TimeoutError, openai.error.Timeout, openai.error.APIConnectionError, openai.error.RateLimitError, openai.error.ServiceUnavailableError)):
+            return True
+        return isinstance(err, openai.error.OpenAIError) and err.http_status in RETRY_STATUSES
+
+    def __get_backoff_delay(self, err: BaseException, attempt: int) -> float:
+        """Get delay before the retry - `Retry-After` header if sent, exponential backoff with full jitter otherwise."""
+        headers = getattr(err, "headers", None) or {}
+        retry_after = headers.get("retry-after") or headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                pass
+        return random.uniform(0, min(BACKOFF_BASE * 2**attempt, BACKOFF_MAX))  # noqa: S311
+
+
+_clients: dict[tuple[Any, ...], OpenAiClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(  # noqa: PLR0913
+    endpoint: OpenAiEndpoint,
+    timeout: float,
+    max_retries: int,
+    proxy: Optional[str] = None,
+    hedge_endpoint: Optional[OpenAiEndpoint] = None,
+    hedge_delay: Optional[float] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    log: Optional[logging.Logger] = None,
+) -> OpenAiClient:
+    """Get memoized client, shared by all requests of the process with the same settings."""
+    hedge_key = tuple(vars(hedge_endpoint).items()) if hedge_endpoint else None
+    key = (tuple(vars(endpoint).items()), timeout, max_retries, proxy, hedge_key, hedge_delay, rate_limiter.key if rate_limiter else None)
+    with _clients_lock:
+        if key not in _clients:
+            if not _clients:
+                atexit.register(close_clients)
+            _clients[key] = OpenAiClient(
+                endpoint,
+                timeout,
+                max_retries,
+                proxy=proxy,
+                hedge_endpoint=hedge_endpoint,
+                hedge_delay=hedge_delay,
+                rate_limiter=rate_limiter,
+                log=log,
+            )
+        return _clients[key]
+
+
+_probes: dict[str, tuple[float, bool]] = {}
+_probes_lock = threading.Lock()
+
+
+def is_healthy(api_base: str, timeout: float) -> bool:
+    """Probe OpenAI-compatible endpoint (`GET <api_base>/models`) - any HTTP response within the timeout means it's up.
+
+    Results are reused for PROBE_TTL seconds, so hooks running in the daemon don't probe on every commit.
+    """
+    import urllib.error
+    import urllib.request
+
+    with _probes_lock:
+        probed_at, healthy = _probes.get(api_base, (0.0, False))
+        if time.monotonic() - probed_at < PROBE_TTL:
+            return healthy
+    try:
+        with profiler.timed("network", "backend probe"), urllib.request.urlopen(f"{api_base.rstrip('/')}/models", timeout=timeout):  # noqa: S310
+            healthy = True
+    except urllib.error.HTTPError:
+        healthy = True
+    except (OSError, ValueError):
+        healthy = False
+    with _probes_lock:
+        _probes[api_base] = (time.monotonic(), healthy)
+    return healthy
+
+
+def close_clients() -> None:
+    """Close all memoized clients."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
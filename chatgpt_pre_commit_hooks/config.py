@@ -0,0 +1,222 @@
+"""``config``.
+
+A module containing the project config file loader.
+
+Settings are read from `.chatgpt-hooks.toml`, or the `[tool.chatgpt-pre-commit-hooks]` table of `pyproject.toml`,
+in the current directory. Top-level keys apply to all hooks, `[hooks.<hook>]` tables are profiles of single hooks:
+
+    [tool.chatgpt-pre-commit-hooks]
+    openai-model = "gpt-3.5-turbo"
+    cache-ttl = 86400
+
+    [tool.chatgpt-pre-commit-hooks.hooks.chatgpt-commit-message]
+    emoji = true
+    diff-exclude = ["docs/*"]
+
+Keys are names of the arguments (without leading dashes). Config files are parsed and validated once per process,
+snapshots are keyed on the file path, modification time and size.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Any, Optional
+
+CONFIG_FILE_NAME = ".chatgpt-hooks.toml"
+PYPROJECT_FILE_NAME = "pyproject.toml"
+PYPROJECT_TABLE = "chatgpt-pre-commit-hooks"
+
+# settings read from environment variables - the config file sets only their defaults
+ENV_SETTINGS = {
+    "openai_model",
+    "openai_max_tokens",
+    "openai_api_base",
+    "openai_api_type",
+    "openai_proxy",
+    "openai_timeout",
+    "openai_max_retries",
+    "openai_api_version",
+    "openai_organization",
+    "openai_route",
+    "openai_rate_limit_rpm",
+    "openai_rate_limit_tpm",
+    "openai_backend",
+    "latency_budget_ms",
+    "metrics",
+}
+# settings which can't be set in the config file - secrets, and modes or internal flags which would turn every hook run into them
+RESERVED_SETTINGS = {
+    "hook",
+    "env_prefix",
+    "config",
+    "openai_api_key",
+    "speculate",
+    "speculate_key",
+    "profile",
+    "profile_output",
+    "batch",
+    "batch_apply",
+    "deferred_worker",
+    "deferred_apply",
+    "deferred_check",
+    "pick",
+}
+
+# (path, mtime, size) -> config
+_snapshots: dict[tuple[str, int, int], "Config"] = {}
+
+
+class ConfigError(Exception):
+    """Invalid config file."""
+
+    def __init__(self, path: Optional[Path], message: str) -> None:
+        """Initialize error of the config file."""
+        super().__init__(f"{path}: {message}")
+        self.path = path
+
+
+class Config:
+    """Snapshot of a config file - global settings and profiles of hooks, validated once per hook and set of arguments."""
+
+    def __init__(self, path: Optional[Path], data: dict[str, Any]) -> None:
+        """Initialize config.
+
+        Args:
+        path: path of the config file, `None` if there is none.
+        data: settings table of the config file.
+        """
+        self.path = path
+        self.data = data
+        # (hook, arguments, complete) -> validated settings
+        self.__validated: dict[tuple[Optional[str], frozenset[str], bool], dict[str, Any]] = {}
+
+    def get_settings(self, hook: Optional[str]) -> dict[str, Any]:
+        """Get settings of the hook - global ones overridden by the hook profile, with names normalized to argument destinations."""
+        profiles = self.data.get("hooks", {})
+        profile = profiles.get(hook, {}) if hook is not None and isinstance(profiles, dict) else {}
+        settings = {name: value for name, value in self.data.items() if name != "hooks"}
+        settings.update(profile if isinstance(profile, dict) else {})
+        return {name.lstrip("-").replace("-", "_"): value for name, value in settings.items()}
+
+    def get_validated(self, hook: Optional[str], parser: argparse.ArgumentParser, *, complete: bool = True) -> dict[str, Any]:
+        """Get settings of the hook validated and converted by the arguments of the parser.
+
+        Args:
+        hook: hook name.
+        parser: parser of the hook arguments.
+        complete: if all arguments of the hook are added to the parser - settings of unknown arguments are invalid then, skipped otherwise.
+
+        Returns:
+        Get `dict` argument destination -> value.
+
+        Raises:
+        ConfigError: if any of the settings is invalid.
+        """
+        actions = {action.dest: action for action in parser._actions if action.option_strings}  # noqa: SLF001
+        key = (hook, frozenset(actions), complete)
+        if key not in self.__validated:
+            validated = {}
+            for name, value in self.get_settings(hook).items():
+                if name in RESERVED_SETTINGS:
+                    msg = f"{name} can't be set in the config file"
+                    raise ConfigError(self.path, msg)
+                if name in actions:
+                    validated[name] = get_value(actions[name], value, self.path)
+                elif complete:
+                    msg = f"unknown setting {name}"
+                    raise ConfigError(self.path, msg)
+            self.__validated[key] = validated
+        return self.__validated[key]
+
+
+def get_config_path(path: Optional[Path] = None) -> Optional[Path]:
+    """Get path of the config file - `path` if set, `.chatgpt-hooks.toml` or `pyproject.toml` of the current directory otherwise."""
+    if path is not None:
+        return path
+    for name in (CONFIG_FILE_NAME, PYPROJECT_FILE_NAME):
+        if Path(name).is_file():
+            return Path(name)
+    return None
+
+
+def load_config(path: Optional[Path]) -> Config:
+    """Load config file - parsed once per modification of the file.
+
+    Raises:
+    ConfigError: if the file can't be read or parsed.
+    """
+    if path is None:
+        return Config(None, {})
+    try:
+        stat = path.stat()
+    except OSError as err:
+        msg = str(err)
+        raise ConfigError(path, msg) from err
+    key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+    if key not in _snapshots:
+        data = read_toml(path)
+        if path.name == PYPROJECT_FILE_NAME:
+            data = data.get("tool", {}).get(PYPROJECT_TABLE, {})
+        if not isinstance(data, dict):
+            msg = "settings must be a table"
+            raise ConfigError(path, msg)
+        # older snapshots of the same file are stale
+        for stale_key in [stale_key for stale_key in _snapshots if stale_key[0] == key[0]]:
+            del _snapshots[stale_key]
+        _snapshots[key] = Config(path, data)
+    return _snapshots[key]
+
+
+def read_toml(path: Path) -> dict[str, Any]:
+    """Read TOML file - with `tomllib` of Python 3.11+, `tomli` otherwise."""
+    if sys.version_info >= (3, 11):
+        import tomllib
+    else:
+        import tomli as tomllib
+
+    try:
+        with path.open("rb") as file:
+            return tomllib.load(file)
+    except (OSError, tomllib.TOMLDecodeError) as err:
+        msg = str(err)
+        raise ConfigError(path, msg) from err
+
+
+def get_value(action: argparse.Action, value: Any, path: Optional[Path]) -> Any:  # noqa: ANN401
+    """Get value of the setting converted by the argument type - flags take booleans, appended arguments take lists.
+
+    Raises:
+    ConfigError: if the value is invalid.
+    """
+    name = action.dest
+    if action.nargs == 0:
+        if not isinstance(value, bool):
+            msg = f"{name} must be a boolean"
+            raise ConfigError(path, msg)
+        return value
+    if isinstance(action, argparse._AppendAction):  # noqa: SLF001
+        if not isinstance(value, list):
+            msg = f"{name} must be a list"
+            raise ConfigError(path, msg)
+        return [get_scalar_value(action, item, path) for item in value]
+    return get_scalar_value(action, value, path)
+
+
+def get_scalar_value(action: argparse.Action, value: Any, path: Optional[Path]) -> Any:  # noqa: ANN401
+    """Get single value of the setting converted by the argument type.
+
+    Raises:
+    ConfigError: if the value is invalid.
+    """
+    if isinstance(value, (bool, dict, list)):
+        msg = f"{action.dest} must be a {getattr(action.type, '__name__', 'str')}"
+        raise ConfigError(path, msg)
+    try:
+        converted = action.type(value) if callable(action.type) else str(value)
+    except (TypeError, ValueError) as err:
+        msg = f"{action.dest} - {err}"
+        raise ConfigError(path, msg) from err
+    if action.choices is not None and converted not in action.choices:
+        msg = f"{action.dest} must be one of {', '.join(map(str, action.choices))}"
+        raise ConfigError(path, msg)
+    return converted
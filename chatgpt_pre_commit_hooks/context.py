@@ -0,0 +1,102 @@
+"""``context``.
+
+A module containing the state shared by all hooks of a single run.
+
+Staged changes don't change while the hooks of a commit run, so the `.git` directory, outputs of read-only git
+commands (e.g. the staged diff) and token counts are computed once and shared by all hooks - also by hooks
+running concurrently in threads.
+"""
+
+import threading
+from collections.abc import Hashable, Iterator
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Optional
+
+from chatgpt_pre_commit_hooks.utils import Utils
+
+_current: ContextVar[Optional["HookContext"]] = ContextVar("chatgpt_pre_commit_hooks_context", default=None)
+
+
+class HookContext:
+    """State shared by the hooks of a single run."""
+
+    def __init__(self) -> None:
+        """Initialize context."""
+        self.utils = Utils()
+        self.__lock = threading.Lock()
+        self.__command_locks: dict[Hashable, threading.Lock] = {}
+        self.__outputs: dict[Hashable, str] = {}
+        self.__lines: dict[Hashable, list[str]] = {}
+        self.__tokens: dict[Hashable, int] = {}
+
+    def activate(self) -> None:
+        """Make the context current - shared by hooks created in this (or a copied) context."""
+        _current.set(self)
+
+    def get_git_dir(self) -> Optional[Path]:
+        """Get path of the `.git` directory (if in a git repository)."""
+        git_dir = self.cmd_output(["git", "rev-parse", "--git-dir"])
+        return Path(git_dir) if git_dir else None
+
+    def cmd_output(self, commands: list[str], text_input: Optional[str] = None) -> str:
+        """Run read-only command once - concurrent callers wait for the first one.
+
+        Args:
+        commands: list of commands.
+        text_input: standard input of the command.
+
+        Returns:
+        Get `str` output.
+        """
+        key = (tuple(commands), text_input)
+        with self.__get_command_lock(key):
+            if key not in self.__outputs:
+                self.__outputs[key] = self.utils.cmd_output(commands, text_input=text_input)
+            return self.__outputs[key]
+
+    def cmd_output_lines(self, commands: list[str]) -> Iterator[str]:
+        """Stream output lines of read-only command - from memory once a caller has read the whole output.
+
+        Concurrent callers wait for the one streaming the output. Callers which stop reading early (see `Utils.cmd_output_lines`)
+        don't keep the output, so the next caller runs the command again.
+        """
+        key = tuple(commands)
+        with self.__get_command_lock(key):
+            lines = self.__lines.get(key)
+            if lines is None:
+                lines = []
+                stream = self.utils.cmd_output_lines(commands)
+                try:
+                    for line in stream:
+                        lines.append(line)
+                        yield line
+                    self.__lines[key] = lines
+                finally:
+                    stream.close()
+                return
+        yield from lines
+
+    def count_tokens(self, key: Hashable, count: Callable[[], int]) -> int:
+        """Get token count of the key (e.g. model and text), counted once."""
+        if key not in self.__tokens:
+            self.__tokens[key] = count()
+        return self.__tokens[key]
+
+    def count_tokens_batch(self, model: str, texts: list[str], count_batch: Callable[[list[str]], list[int]]) -> list[int]:
+        """Get token counts of the texts, counting those not counted yet in a single batch."""
+        missing = [text for text in dict.fromkeys(texts) if (model, text) not in self.__tokens]
+        if missing:
+            self.__tokens.update({(model, text): count for text, count in zip(missing, count_batch(missing))})
+        return [self.__tokens[(model, text)] for text in texts]
+
+    def __get_command_lock(self, key: Hashable) -> threading.Lock:
+        """Get lock of the command."""
+        with self.__lock:
+            return self.__command_locks.setdefault(key, threading.Lock())
+
+
+def get_context() -> HookContext:
+    """Get context of the current run - a new one, not shared with other hooks, if there is none."""
+    context = _current.get()
+    return context if context is not None else HookContext()
@@ -0,0 +1,317 @@
+"""``daemon``.
+
+A module containing the optional local daemon serving hook runs over a Unix socket.
+
+The daemon keeps the process-wide state warm between commits - imported modules, tiktoken encodings
+and the pooled HTTP connections of the OpenAI client. Hooks forward their arguments, environment and
+working directory to the daemon and fall back to running in-process when it's not running - or when it was
+started by another installation (package version or Python interpreter), which it rejects.
+"""
+
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import time
+import traceback
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+DAEMON_SOCKET_NAME = "daemon.sock"
+PACKAGE_NAME = "chatgpt-pre-commit-hooks"
+DAEMON_CONNECT_TIMEOUT = 1.0
+DAEMON_START_TIMEOUT = 10.0
+DAEMON_IDLE_TIMEOUT = 3600.0
+
+log = logging.getLogger(__name__)
+
+
+def is_supported() -> bool:
+    """Check if the daemon is supported on the platform (Unix sockets)."""
+    return sys.platform != "win32" and hasattr(socket, "AF_UNIX")
+
+
+def get_socket_path() -> Path:
+    """Get per-user path of the daemon socket (`CHATGPT_PRE_COMMIT_HOOKS_DAEMON_SOCKET` if set)."""
+    if os.environ.get("CHATGPT_PRE_COMMIT_HOOKS_DAEMON_SOCKET"):
+        return Path(os.environ["CHATGPT_PRE_COMMIT_HOOKS_DAEMON_SOCKET"])
+    base_dir = Path(os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache"))
+    return base_dir.joinpath("chatgpt-pre-commit-hooks", DAEMON_SOCKET_NAME)
+
+
+def get_identity() -> dict[str, str]:
+    """Get identity of the installation - package version and Python interpreter, the daemon runs only hooks of the same one."""
+    from importlib import metadata
+
+    try:
+        version = metadata.version(PACKAGE_NAME)
+    except metadata.PackageNotFoundError:
+        version = "0.0.0"
+    return {"version": version, "python": sys.executable}
+
+
+def send(request: dict[str, Any], timeout: Optional[float] = DAEMON_CONNECT_TIMEOUT) -> Optional[socket.socket]:
+    """Connect to the daemon and send the request.
+
+    Returns:
+    Get `socket.socket` connection to read the response from, `None` if the daemon is not running.
+    """
+    if not is_supported():
+        return None
+    socket_path = get_socket_path()
+    if not socket_path.exists():
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(timeout)
+        connection.connect(str(socket_path))
+        connection.settimeout(None)
+        connection.sendall(json.dumps({**request, **get_identity()}).encode("utf-8") + b"\n")
+    except OSError as err:
+        log.debug(f"DAEMON: not available - {err}")
+        connection.close()
+        return None
+    return connection
+
+
+def forward(argv: list[str]) -> Optional[int]:
+    """Run the hook in the daemon, relaying its output.
+
+    Args:
+    argv: arguments of the `chatgpt-pre-commit-hooks` entry point.
+
+    Returns:
+    Get `int` exit code of the hook, `None` if it has to run in-process (`--no-daemon`, daemon not running, gone
+    or of another installation).
+    """
+    if "--no-daemon" in argv:
+        return None
+    connection = send({"command": "run", "argv": argv, "env": dict(os.environ), "cwd": str(Path.cwd())})
+    if connection is None:
+        return None
+    with connection, connection.makefile("r", encoding="utf-8") as reader:
+        for line in reader:
+            message = json.loads(line)
+            if "exit_code" in message:
+                return int(message["exit_code"])
+            if "error" in message:
+                log.debug(f"DAEMON: {message['error']} - running in-process")
+                return None
+            stream = sys.stdout if message.get("stream") == "stdout" else sys.stderr
+            stream.write(message.get("data", ""))
+            stream.flush()
+    log.debug("DAEMON: connection closed without exit code - running in-process")
+    return None
+
+
+def get_status() -> Optional[dict[str, Any]]:
+    """Get status of the running daemon, `None` if not running."""
+    connection = send({"command": "status"})
+    if connection is None:
+        return None
+    try:
+        with connection, connection.makefile("r", encoding="utf-8") as reader:
+            line = reader.readline()
+    except OSError:
+        return None
+    return json.loads(line) if line else None
+
+
+def start(idle_timeout: float = DAEMON_IDLE_TIMEOUT) -> bool:
+    """Start the daemon in background (if not running) and wait until it accepts connections.
+
+    Returns:
+    Get `bool` if the daemon of this installation is running - `False` if it didn't start or another installation's one is running.
+    """
+    status = get_status()
+    if status is not None:
+        return is_same_installation(status)
+    commands = [sys.executable, "-m", "chatgpt_pre_commit_hooks.main", "--daemon", "run", "--daemon-idle-timeout", str(idle_timeout)]
+    subprocess.Popen(commands, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True, cwd=str(Path.home()))  # noqa: S603
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if get_status() is not None:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def is_same_installation(status: dict[str, Any]) -> bool:
+    """Check if the daemon (its status) runs the same installation - logs the running one otherwise."""
+    identity = get_identity()
+    if all(status.get(name) == value for name, value in identity.items()):
+        return True
+    log.error(f"Daemon of another installation is running (version {status.get('version')}, {status.get('python')}) - stop it first")
+    return False
+
+
+def stop() -> bool:
+    """Stop the running daemon."""
+    connection = send({"command": "stop"})
+    if connection is None:
+        return False
+    with connection, connection.makefile("r", encoding="utf-8") as reader:
+        reader.readline()
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while get_socket_path().exists() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return True
+
+
+class DaemonStream(io.TextIOBase):
+    """Text stream relaying writes to the connected hook client."""
+
+    def __init__(self, wfile: io.BufferedIOBase, name: str) -> None:
+        """Initialize stream."""
+        self.wfile = wfile
+        self.name = name
+        self.broken = False
+
+    def writable(self) -> bool:
+        """Check if stream is writable."""
+        return True
+
+    def write(self, data: str) -> int:
+        """Send data to the client - ignored once the client is gone."""
+        if data and not self.broken:
+            try:
+                self.wfile.write(json.dumps({"stream": self.name, "data": data}).encode("utf-8") + b"\n")
+                self.wfile.flush()
+            except OSError:
+                self.broken = True
+        return len(data)
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """Handler of a single daemon request - `run`, `status` or `stop`."""
+
+    server: "DaemonServer"
+
+    def handle(self) -> None:
+        """Handle request."""
+        line = self.rfile.readline()
+        if not line:
+            return
+        request = json.loads(line)
+        command = request.get("command")
+        identity = {name: request.get(name) for name in self.server.identity}
+        if command == "run" and identity != self.server.identity:
+            # e.g. the package was upgraded, or hooks of another virtualenv - they run in-process
+            daemon_identity = self.server.identity
+            response = {"error": f"daemon of version {daemon_identity['version']} ({daemon_identity['python']}) can't run version {identity['version']} ({identity['python']})"}
+        elif command == "run":
+            response = {"exit_code": self.server.run_hook(request, self.wfile)}
+        elif command == "status":
+            response = {"pid": os.getpid(), **self.server.identity, "started": self.server.started, "served": self.server.served}
+        elif command == "stop":
+            self.server.stopping = True
+            response = {"exit_code": 0}
+        else:
+            response = {"exit_code": 1}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class DaemonServer(socketserver.UnixStreamServer):
+    """Unix socket server running hooks one at a time in the daemon process.
+
+    Requests are handled serially - each one swaps the process arguments, environment, working directory
+    and standard streams for the ones of the client.
+    """
+
+    def __init__(self, socket_path: Path, hook: Callable[[], int], idle_timeout: float) -> None:
+        """Initialize server."""
+        super().__init__(str(socket_path), DaemonRequestHandler)
+        self.hook = hook
+        self.identity = get_identity()
+        self.timeout = idle_timeout
+        self.started = time.time()
+        self.served = 0
+        self.stopping = False
+
+    def handle_timeout(self) -> None:
+        """Stop after the idle timeout."""
+        log.debug("DAEMON: idle timeout")
+        self.stopping = True
+
+    def run_hook(self, request: dict[str, Any], wfile: io.BufferedIOBase) -> int:
+        """Run hook with the client's arguments, environment and working directory."""
+        saved_argv, saved_environ, saved_cwd, saved_stdout, saved_stderr = sys.argv, dict(os.environ), Path.cwd(), sys.stdout, sys.stderr
+        try:
+            os.chdir(request["cwd"])
+            os.environ.clear()
+            os.environ.update(request["env"])
+            sys.argv = ["chatgpt-pre-commit-hooks", *request["argv"]]
+            sys.stdout = DaemonStream(wfile, "stdout")  # type: ignore  # noqa: PGH003
+            sys.stderr = DaemonStream(wfile, "stderr")  # type: ignore  # noqa: PGH003
+            return self.__call_hook()
+        finally:
+            sys.argv, sys.stdout, sys.stderr = saved_argv, saved_stdout, saved_stderr
+            os.environ.clear()
+            os.environ.update(saved_environ)
+            os.chdir(saved_cwd)
+            self.served += 1
+
+    def __call_hook(self) -> int:
+        """Call hook - `SystemExit` is converted into the exit code."""
+        try:
+            return int(self.hook())
+        except SystemExit as err:
+            if isinstance(err.code, str):
+                sys.stderr.write(f"{err.code}\n")
+            return err.code if isinstance(err.code, int) else int(err.code is not None)
+        except Exception:  # noqa: BLE001
+            traceback.print_exc()
+            return 1
+
+
+def serve(hook: Callable[[], int], idle_timeout: float = DAEMON_IDLE_TIMEOUT) -> int:
+    """Serve hook runs until stopped or idle for `idle_timeout` seconds.
+
+    Args:
+    hook: function running the hook of the current `sys.argv` and returning its exit code.
+    idle_timeout: seconds without requests after which the daemon exits.
+
+    Returns:
+    Get `int` exit code.
+    """
+    if not is_supported():
+        log.error("Daemon is not supported on this platform")
+        return 1
+    if get_status() is not None:
+        log.error("Daemon is already running")
+        return 1
+
+    socket_path = get_socket_path()
+    socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    socket_path.parent.chmod(0o700)
+    socket_path.unlink(missing_ok=True)
+    umask = os.umask(0o177)
+    try:
+        server = DaemonServer(socket_path, hook, idle_timeout)
+    finally:
+        os.umask(umask)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    log.debug(f"DAEMON: serving at {socket_path}")
+
+    # pay the import cost once, before the first request
+    try:
+        import openai  # noqa: F401
+        import tiktoken  # noqa: F401
+    except ImportError:
+        pass
+
+    try:
+        while not server.stopping:
+            server.handle_request()
+    finally:
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
+        from chatgpt_pre_commit_hooks.client import close_clients
+
+        close_clients()
+    return 0
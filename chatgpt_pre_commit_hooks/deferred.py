@@ -0,0 +1,167 @@
+"""``deferred``.
+
+A module containing the queue of deferred commit messages.
+
+In deferred mode, `prepare-commit-msg` only writes a placeholder (or the user's draft) and enqueues a snapshot
+commit of the staged changes, so the commit is instant. A background worker generates the messages, and they are
+applied to the unpushed commits later. Every job is a single JSON file under `.git/`, and its state is the suffix
+of the file name - a worker claims a pending job by renaming it, so concurrent workers never process the same job.
+A stale running job (its worker died) is reclaimed by exclusively creating a lease file named after the modification
+time of the job, so only one of the workers which found it stale gets it.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STATES = [PENDING, RUNNING, DONE, FAILED]
+
+# running jobs older than this (their worker died) are claimable again
+STALE_SECONDS = 600
+
+
+class DeferredQueue:
+    """Persistent queue of deferred commit messages."""
+
+    def __init__(self, directory: Path, log: Optional[logging.Logger] = None) -> None:
+        """Initialize queue.
+
+        Args:
+        directory: directory where jobs are stored.
+        log: logger.
+        """
+        self.directory = directory
+        self.log = log or logging.getLogger(__name__)
+
+    def put(self, key: str, job: dict[str, Any]) -> bool:
+        """Enqueue pending job - unless the job of the key is already queued.
+
+        Args:
+        key: job key, e.g. hash of the staged changes and arguments.
+        job: JSON serializable job.
+
+        Returns:
+        Get `bool` if the job was enqueued.
+        """
+        if any(self.__get_job_path(key, state).is_file() for state in STATES):
+            self.log.debug(f"DEFERRED: {key} - already queued")
+            return False
+        self.__write(self.__get_job_path(key, PENDING), {"created": time.time(), **job})
+        self.log.debug(f"DEFERRED: {key} - queued")
+        return True
+
+    def get_jobs(self) -> dict[str, tuple[str, dict[str, Any]]]:
+        """Get all jobs - key -> (state, job), oldest first."""
+        jobs = []
+        for job_path in self.directory.glob("*.json"):
+            key, _, state = job_path.stem.rpartition(".")
+            job = self.__read(job_path)
+            if state in STATES and job is not None:
+                jobs.append((job.get("created", 0), key, state, job))
+        return {key: (state, job) for _, key, state, job in sorted(jobs, key=lambda item: item[0])}
+
+    def claim(self) -> Optional[tuple[str, dict[str, Any]]]:
+        """Claim the oldest pending job (or a stale running one) - `None` if there are none left."""
+        now = time.time()
+        for key, (state, job) in self.get_jobs().items():
+            job_path = self.__get_job_path(key, state)
+            if state == RUNNING:
+                if not self.__reclaim(key, job_path, now):
+                    continue
+            elif state != PENDING:
+                continue
+            else:
+                try:
+                    job_path.rename(self.__get_job_path(key, RUNNING))
+                    # bump the modification time - it's the start of the run
+                    os.utime(self.__get_job_path(key, RUNNING))
+                except OSError:
+                    # claimed by another worker
+                    continue
+            self.log.debug(f"DEFERRED: {key} - claimed")
+            return key, job
+        return None
+
+    def finish(self, key: str, job: dict[str, Any], state: str) -> None:
+        """Store the result of the claimed job - `done` or `failed`."""
+        self.__write(self.__get_job_path(key, state), job)
+        self.__get_job_path(key, RUNNING).unlink(missing_ok=True)
+        self.__remove_leases(key)
+        self.log.debug(f"DEFERRED: {key} - {state}")
+
+    def retry(self, key: str) -> None:
+        """Move failed job of the key back to pending."""
+        try:
+            self.__get_job_path(key, FAILED).rename(self.__get_job_path(key, PENDING))
+        except OSError as err:
+            self.log.debug(f"DEFERRED_RETRY_ERROR: {key} - {err}")
+
+    def remove(self, key: str) -> None:
+        """Remove job of the key (e.g. once it's applied)."""
+        for state in STATES:
+            self.__get_job_path(key, state).unlink(missing_ok=True)
+        self.__remove_leases(key)
+
+    def prune(self, keep: set[str], max_age: float = STALE_SECONDS) -> int:
+        """Remove finished jobs older than max_age seconds, except the kept ones - e.g. jobs of aborted commits, or commits whose message was edited.
+
+        Returns:
+        Get `int` number of removed jobs.
+        """
+        now = time.time()
+        stale = [key for key, (state, job) in self.get_jobs().items() if state in (DONE, FAILED) and key not in keep and now - job.get("created", 0) > max_age]
+        for key in stale:
+            self.log.debug(f"DEFERRED: {key} - pruned")
+            self.remove(key)
+        return len(stale)
+
+    def __reclaim(self, key: str, job_path: Path, now: float) -> bool:
+        """Reclaim the running job if it's stale - the lease file of its modification time is created exclusively, so it fails for all workers but one.
+
+        Returns:
+        Get `bool` if the job was reclaimed - its modification time is bumped then, the start of the run.
+        """
+        try:
+            mtime_ns = job_path.stat().st_mtime_ns
+            if now - mtime_ns / 1e9 < STALE_SECONDS:
+                return False
+            os.close(os.open(self.directory.joinpath(f"{key}.{mtime_ns}.lease"), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            os.utime(job_path)
+        except OSError:
+            # finished, or reclaimed by another worker
+            return False
+        return True
+
+    def __remove_leases(self, key: str) -> None:
+        """Remove lease files of reclaimed runs of the job."""
+        for lease_path in self.directory.glob(f"{key}.*.lease"):
+            lease_path.unlink(missing_ok=True)
+
+    def __get_job_path(self, key: str, state: str) -> Path:
+        """Get path of the job in the state."""
+        return self.directory.joinpath(f"{key}.{state}.json")
+
+    def __read(self, job_path: Path) -> Optional[dict[str, Any]]:
+        """Read job - `None` if it's missing (e.g. claimed in the meantime) or invalid."""
+        try:
+            with job_path.open("rt", encoding="utf-8") as handle:
+                job = json.load(handle)
+        except (OSError, ValueError) as err:
+            self.log.debug(f"DEFERRED_READ_ERROR: {job_path.name} - {err}")
+            return None
+        return job if isinstance(job, dict) else None
+
+    def __write(self, job_path: Path, job: dict[str, Any]) -> None:
+        """Write job atomically."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile("wt", encoding="utf-8", dir=self.directory, suffix=".tmp", delete=False) as handle:
+            json.dump(job, handle, ensure_ascii=False)
+        Path(handle.name).replace(job_path)
@@ -0,0 +1,110 @@
+"""``diff_filter``.
+
+A module containing the preprocessing filters collapsing files of a unified diff into one-line summaries.
+"""
+
+from fnmatch import fnmatch
+from pathlib import PurePosixPath
+from typing import Optional
+
+from chatgpt_pre_commit_hooks.diff_packer import LOCKFILE_NAMES, DiffPacker
+
+# gitattributes marking files which are collapsed, and their notes
+GITATTRIBUTES = {
+    "linguist-generated": "generated",
+    "linguist-vendored": "vendored",
+}
+
+
+class DiffFilter:
+    """Filters deciding which files of the diff are collapsed into one-line summaries instead of their patches.
+
+    Filters are applied in order, the first matching one wins:
+
+    - size - files with more changed lines than tokens of the budget, which can't fit into the prompt
+    - exclude - paths matching any of the glob patterns
+    - include - paths not matching any of the glob patterns (if set)
+    - gitattributes - files marked `linguist-generated` or `linguist-vendored`
+    - lockfiles - known lockfiles
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        numstat: dict[str, tuple[int, int]],
+        include: list[str],
+        exclude: list[str],
+        attributes: dict[str, set[str]],
+        max_lines: Optional[int],
+        *,
+        lockfiles: bool,
+        keep_collapsed: bool = False,
+    ) -> None:
+        """Initialize filter.
+
+        Args:
+        numstat: added and removed lines of every file (`git diff --numstat`).
+        include: glob patterns of paths to keep - all paths are kept if empty.
+        exclude: glob patterns of paths to collapse.
+        attributes: set gitattributes of paths (see `parse_check_attr`).
+        max_lines: max changed lines of a file, `None` if the size of files isn't limited.
+        lockfiles: if known lockfiles are collapsed.
+        keep_collapsed: if lines of collapsed files are kept in `collapsed_lines`, e.g. to count saved tokens.
+        """
+        self.numstat = numstat
+        self.include = include
+        self.exclude = exclude
+        self.attributes = attributes
+        self.max_lines = max_lines
+        self.lockfiles = lockfiles
+        self.keep_collapsed = keep_collapsed
+        # path -> (filter, note) of collapsed files
+        self.collapsed: dict[str, tuple[str, str]] = {}
+        # filter -> lines of the files it collapsed
+        self.collapsed_lines: dict[str, list[str]] = {}
+        self.__current: Optional[tuple[str, str]] = None
+
+    @staticmethod
+    def parse_check_attr(output: str) -> dict[str, set[str]]:
+        """Parse `git check-attr -z` output into set attributes of every path."""
+        attributes: dict[str, set[str]] = {}
+        parts = output.split("\0")
+        for path, attribute, value in zip(parts[0::3], parts[1::3], parts[2::3]):
+            if value in ("set", "true"):
+                attributes.setdefault(path, set()).add(attribute)
+        return attributes
+
+    def get_collapse_reason(self, path: str) -> Optional[tuple[str, str]]:
+        """Get filter collapsing the file and the note of its summary line, `None` if the file is kept."""
+        if self.max_lines is not None and sum(self.numstat.get(path, (0, 0))) > self.max_lines:
+            return "size", "too large"
+        if self.__matches(path, self.exclude):
+            return "exclude", "excluded"
+        if self.include and not self.__matches(path, self.include):
+            return "include", "not included"
+        for attribute, note in GITATTRIBUTES.items():
+            if attribute in self.attributes.get(path, set()):
+                return "gitattributes", note
+        if self.lockfiles and PurePosixPath(path).name in LOCKFILE_NAMES:
+            return "lockfiles", "lockfile"
+        return None
+
+    def is_kept(self, line: str) -> bool:
+        """Check if the line of the diff is kept - lines have to be fed in order."""
+        if line.startswith("diff --git "):
+            path = DiffPacker.parse_header_path(line)
+            self.__current = self.get_collapse_reason(path)
+            if self.__current is not None:
+                self.collapsed[path] = self.__current
+        if self.__current is None:
+            return True
+        if self.keep_collapsed:
+            self.collapsed_lines.setdefault(self.__current[0], []).append(line)
+        return False
+
+    def get_notes(self) -> dict[str, str]:
+        """Get notes of the summary lines of collapsed files."""
+        return {path: note for path, (_, note) in self.collapsed.items()}
+
+    def __matches(self, path: str, patterns: list[str]) -> bool:
+        """Check if the path (or the file name) matches any of the patterns."""
+        return any(fnmatch(path, pattern) or fnmatch(PurePosixPath(path).name, pattern) for pattern in patterns)
@@ -0,0 +1,423 @@
+"""``diff_packer``.
+
+A module containing the token-budgeted packer of unified diffs.
+"""
+
+import hashlib
+from fnmatch import fnmatch
+from pathlib import PurePosixPath
+from typing import Callable, Optional
+
+LOCKFILE_NAMES = {
+    "Cargo.lock",
+    "Gemfile.lock",
+    "Package.resolved",
+    "Pipfile.lock",
+    "composer.lock",
+    "flake.lock",
+    "go.sum",
+    "mix.lock",
+    "npm-shrinkwrap.json",
+    "package-lock.json",
+    "packages.lock.json",
+    "pdm.lock",
+    "pnpm-lock.yaml",
+    "poetry.lock",
+    "pubspec.lock",
+    "yarn.lock",
+}
+
+GENERATED_PATTERNS = [
+    "*.min.js",
+    "*.min.css",
+    "*.map",
+    "*.snap",
+    "*_pb2.py",
+    "*_pb2_grpc.py",
+    "*.pb.go",
+    "*.g.dart",
+    "*.generated.*",
+    "dist/*",
+    "build/*",
+    "vendor/*",
+    "node_modules/*",
+]
+
+PRIORITY_SOURCE = 0
+PRIORITY_GENERATED = 1
+
+OMITTED_HEADER = "\n# Changes omitted from the diff above (git diff --stat):\n"
+TRUNCATED_HUNK_MARKER = "... (hunk truncated)\n"
+# smallest head of a hunk worth including when the whole hunk doesn't fit
+TRUNCATED_HUNK_MIN_TOKENS = 50
+
+
+def get_priority(path: str) -> int:
+    """Get packing priority of the file path - lockfiles and generated files go after source files."""
+    posix_path = PurePosixPath(path)
+    if posix_path.name in LOCKFILE_NAMES or any(fnmatch(posix_path.as_posix(), pattern) or fnmatch(posix_path.name, pattern) for pattern in GENERATED_PATTERNS):
+        return PRIORITY_GENERATED
+    return PRIORITY_SOURCE
+
+
+def get_stat_line(path: str, added: int, removed: int, note: str) -> str:
+    """Get `git diff --stat` like summary line of the file."""
+    return f" {path} | +{added} -{removed} ({note})\n"
+
+
+class DiffHunk:
+    """Single hunk of a file diff."""
+
+    def __init__(self, diff_file: "DiffFile", index: int, lines: list[str]) -> None:
+        """Initialize hunk."""
+        self.diff_file = diff_file
+        self.index = index
+        self.lines = lines
+        self.tokens = 0
+
+    @property
+    def text(self) -> str:
+        """Get hunk text."""
+        return "".join(self.lines)
+
+    @property
+    def content_hash(self) -> str:
+        """Get hash of the file path and the hunk content - line numbers are left out, so it's stable when other hunks shift them."""
+        section = self.lines[0].split("@@", 2)[-1] if self.lines else ""
+        content = "\0".join([self.diff_file.path, section, *self.lines[1:]])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class DiffFile:
+    """Diff of a single file - header lines followed by hunks."""
+
+    def __init__(self, header_line: str) -> None:
+        """Initialize file diff."""
+        self.header_lines = [header_line]
+        self.hunks: list[DiffHunk] = []
+        self.header_tokens = 0
+        self.numstat: Optional[tuple[int, int]] = None
+        self.truncated = False
+        self.note: Optional[str] = None
+
+    @property
+    def header(self) -> str:
+        """Get file header text."""
+        return "".join(self.header_lines)
+
+    @property
+    def path(self) -> str:
+        """Get path of the file (destination path for renames)."""
+        for prefix in ("+++ b/", "rename to ", "--- a/"):
+            for line in self.header_lines:
+                if line.startswith(prefix):
+                    return line[len(prefix) :].rstrip("\n")
+        return DiffPacker.parse_header_path(self.header_lines[0])
+
+    @property
+    def added(self) -> int:
+        """Get number of added lines."""
+        if self.numstat is not None:
+            return self.numstat[0]
+        return sum(1 for hunk in self.hunks for line in hunk.lines[1:] if line.startswith("+"))
+
+    @property
+    def removed(self) -> int:
+        """Get number of removed lines."""
+        if self.numstat is not None:
+            return self.numstat[1]
+        return sum(1 for hunk in self.hunks for line in hunk.lines[1:] if line.startswith("-"))
+
+    @property
+    def priority(self) -> int:
+        """Get packing priority of the file - lower goes first."""
+        return get_priority(self.path)
+
+    def get_stat_line(self, included_hunks: int = 0, truncated_hunks: int = 0) -> str:
+        """Get `git diff --stat` like summary line of the file - `truncated_hunks` are included only partially."""
+        omitted_hunks = len(self.hunks) - included_hunks - truncated_hunks
+        if self.note is not None:
+            note = self.note
+        elif not self.hunks and not self.truncated:
+            note = "binary or mode change"
+        elif included_hunks == 0 and truncated_hunks == 0:
+            note = "omitted"
+        else:
+            notes = [f"{count} of {len(self.hunks)} hunks {state}" for count, state in ((omitted_hunks, "omitted"), (truncated_hunks, "truncated")) if count]
+            note = ", ".join(notes)
+        return get_stat_line(self.path, self.added, self.removed, note)
+
+
+class DiffPacker:
+    """Packer filling a token budget with diff hunks ranked by priority.
+
+    Hunks of source files go before lockfiles and generated files, and smaller hunks go before larger ones.
+    The budget left over by whole hunks is shared by heads of hunks which don't fit, one per file.
+    Files (or hunks) which do not fit into the budget are summarized with `--stat` like lines.
+    """
+
+    def __init__(
+        self,
+        diff: str,
+        count_tokens: Callable[[list[str]], list[int]],
+        numstat: Optional[dict[str, tuple[int, int]]] = None,
+        notes: Optional[dict[str, str]] = None,
+        *,
+        truncated: bool = False,
+    ) -> None:
+        """Initialize packer.
+
+        Args:
+        diff: output of the `git diff` command.
+        count_tokens: function returning the number of tokens for each of the given texts.
+        numstat: added and removed lines of every file (`git diff --numstat`), covering files missing in a truncated diff.
+        notes: notes of summary lines of files left out of the diff on purpose (e.g. collapsed lockfiles).
+        truncated: if the diff was cut off - the last hunk is kept as a truncated one, without its (possibly incomplete) last line.
+        """
+        self.files = self.parse(diff)
+        self.count_tokens = count_tokens
+        self.__counted = False
+        if truncated and self.files:
+            last_file = self.files[-1]
+            last_file.truncated = True
+            if last_file.hunks:
+                last_hunk = last_file.hunks[-1]
+                last_hunk.lines = [*last_hunk.lines[: max(len(last_hunk.lines) - 1, 1)], TRUNCATED_HUNK_MARKER]
+        if numstat is not None:
+            self.__add_numstat(numstat, notes or {})
+
+    @staticmethod
+    def parse(diff: str) -> list[DiffFile]:
+        """Parse unified diff into files and hunks."""
+        files: list[DiffFile] = []
+        current: Optional[DiffFile] = None
+        for line in diff.splitlines(keepends=True):
+            if line.startswith("diff --git "):
+                current = DiffFile(line)
+                files.append(current)
+            elif current is None:
+                continue
+            elif line.startswith("@@"):
+                current.hunks.append(DiffHunk(current, len(current.hunks), [line]))
+            elif current.hunks:
+                current.hunks[-1].lines.append(line)
+            else:
+                current.header_lines.append(line)
+        return files
+
+    @staticmethod
+    def parse_header_path(header_line: str) -> str:
+        """Parse `diff --git a/... b/...` line into the (destination) path."""
+        return header_line.rstrip("\n").rsplit(" b/", 1)[-1]
+
+    @staticmethod
+    def parse_numstat_line(line: str) -> Optional[tuple[str, tuple[int, int]]]:
+        """Parse `git diff --numstat` line into the path (destination path for renames) and added and removed lines."""
+        parts = line.rstrip("\n").split("\t", 2)
+        if len(parts) != 3:  # noqa: PLR2004
+            return None
+        added, removed, path = parts
+        if " => " in path:
+            if "{" in path:
+                prefix, rest = path.split("{", 1)
+                renamed, suffix = rest.split("}", 1)
+                path = f"{prefix}{renamed.split(' => ', 1)[1]}{suffix}".replace("//", "/")
+            else:
+                path = path.split(" => ", 1)[1]
+        return path, (int(added) if added.isdigit() else 0, int(removed) if removed.isdigit() else 0)
+
+    def __add_numstat(self, numstat: dict[str, tuple[int, int]], notes: dict[str, str]) -> None:
+        """Set numstat of parsed files and add files which are missing in the (truncated or filtered) diff."""
+        files = {diff_file.path: diff_file for diff_file in self.files}
+        for path, stat in numstat.items():
+            if path not in files:
+                files[path] = DiffFile(f"diff --git a/{path} b/{path}\n")
+                files[path].truncated = True
+                files[path].note = notes.get(path)
+                self.files.append(files[path])
+            files[path].numstat = stat
+
+    def count(self) -> int:
+        """Count tokens of every file header and hunk (once).
+
+        Returns:
+        Get `int` number of tokens of the whole diff.
+        """
+        hunks = [hunk for diff_file in self.files for hunk in diff_file.hunks]
+        if not self.__counted:
+            counts = self.count_tokens([diff_file.header for diff_file in self.files] + [hunk.text for hunk in hunks])
+            for diff_file, count in zip(self.files, counts[: len(self.files)]):
+                diff_file.header_tokens = count
+            for hunk, count in zip(hunks, counts[len(self.files) :]):
+                hunk.tokens = count
+            self.__counted = True
+        return sum(diff_file.header_tokens for diff_file in self.files) + sum(hunk.tokens for hunk in hunks)
+
+    def pack(self, max_token_count: int) -> str:
+        """Pack diff hunks into the token budget.
+
+        Args:
+        max_token_count: token budget of the packed diff.
+
+        Returns:
+        Get `str` packed diff.
+        """
+        self.count()
+        hunks = [hunk for diff_file in self.files for hunk in diff_file.hunks]
+        stat_lines = [diff_file.get_stat_line() for diff_file in self.files]
+        stat_tokens = sum(self.count_tokens([OMITTED_HEADER, *stat_lines]))
+        if stat_tokens >= max_token_count:
+            return self.__get_stat_only(stat_lines, max_token_count)
+
+        ranked = sorted(hunks, key=lambda hunk: (hunk.diff_file.priority, hunk.tokens, hunk.diff_file.path, hunk.index))
+        included: set[int] = set()
+        opened: set[int] = set()
+        used = self.__fill(ranked, max_token_count - stat_tokens, included, opened)
+
+        # stat lines are reserved for all files; release what is not needed and try again with the leftover
+        omitted = self.__get_omitted_stat_lines(included)
+        omitted_tokens = sum(self.count_tokens([OMITTED_HEADER, *omitted])) if omitted else 0
+        used += self.__fill(ranked, max_token_count - omitted_tokens - used, included, opened)
+
+        # heads of hunks which don't fit whole - with stat lines as if every candidate file had a truncated hunk
+        candidates = self.__get_truncation_candidates(ranked, included)
+        omitted = self.__get_omitted_stat_lines(included, {id(hunk): "" for hunk in candidates})
+        omitted_tokens = sum(self.count_tokens([OMITTED_HEADER, *omitted])) if omitted else 0
+        truncated = self.__fill_truncated(candidates, max_token_count - omitted_tokens - used, opened)
+
+        return self.__render(included, truncated)
+
+    def split(self, max_token_count: int) -> list[str]:
+        """Split diff into chunks of whole files (or hunk groups of large files) in the original order.
+
+        Args:
+        max_token_count: token budget of a single chunk.
+
+        Returns:
+        Get `list[str]` chunks of the diff.
+        """
+        self.count()
+        chunks: list[str] = []
+        current: list[str] = []
+        current_tokens = 0
+        for text, tokens in (piece for diff_file in self.files for piece in self.__split_file(diff_file, max_token_count)):
+            if current and current_tokens + tokens > max_token_count:
+                chunks.append("".join(current).strip())
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            chunks.append("".join(current).strip())
+        return chunks
+
+    def __split_file(self, diff_file: DiffFile, max_token_count: int) -> list[tuple[str, int]]:
+        """Split file diff into pieces of hunk groups, each with the file header."""
+        available = max(max_token_count - diff_file.header_tokens, 1)
+        pieces: list[tuple[str, int]] = []
+        group: list[str] = []
+        group_tokens = 0
+        for hunk in diff_file.hunks:
+            text, tokens = hunk.text, hunk.tokens
+            if tokens > available:
+                # keep the head of a hunk which doesn't fit anywhere
+                text, tokens = self.__truncate_hunk(hunk, available), available
+            if group and group_tokens + tokens > available:
+                pieces.append((diff_file.header + "".join(group), diff_file.header_tokens + group_tokens))
+                group, group_tokens = [], 0
+            group.append(text)
+            group_tokens += tokens
+        pieces.append((diff_file.header + "".join(group), diff_file.header_tokens + group_tokens))
+        return pieces
+
+    @staticmethod
+    def __truncate_hunk(hunk: DiffHunk, max_token_count: int) -> str:
+        """Get head of the hunk of about `max_token_count` tokens - whole lines, at least the `@@` line."""
+        kept_lines = hunk.lines[: max(len(hunk.lines) * max_token_count // max(hunk.tokens, 1) - 1, 1)]
+        return "".join([*kept_lines, TRUNCATED_HUNK_MARKER])
+
+    @staticmethod
+    def __get_truncation_candidates(ranked: list[DiffHunk], included: set[int]) -> list[DiffHunk]:
+        """Get the first ranked hunk left out of every file - candidates for truncation."""
+        candidates: dict[int, DiffHunk] = {}
+        for hunk in ranked:
+            if id(hunk) not in included and id(hunk.diff_file) not in candidates:
+                candidates[id(hunk.diff_file)] = hunk
+        return list(candidates.values())
+
+    def __fill_truncated(self, candidates: list[DiffHunk], budget: int, opened: set[int]) -> dict[int, str]:
+        """Include heads of the candidate hunks - the budget is shared evenly, the share of a short hunk head goes to the next ones.
+
+        Returns:
+        Get `dict` id of the hunk -> truncated text.
+        """
+        truncated: dict[int, str] = {}
+        used = 0
+        for index, hunk in enumerate(candidates):
+            header_tokens = 0 if id(hunk.diff_file) in opened else hunk.diff_file.header_tokens
+            share = (budget - used) // (len(candidates) - index) - header_tokens
+            if share < TRUNCATED_HUNK_MIN_TOKENS:
+                continue
+            text = self.__truncate_hunk(hunk, share)
+            tokens = sum(self.count_tokens([text]))
+            # lines are not of the same length - shrink once more by the actual count
+            if tokens > share:
+                text = self.__truncate_hunk(hunk, share * share // tokens)
+                tokens = sum(self.count_tokens([text]))
+            if tokens > share:
+                continue
+            used += header_tokens + tokens
+            truncated[id(hunk)] = text
+            opened.add(id(hunk.diff_file))
+        return truncated
+
+    def __fill(self, ranked: list[DiffHunk], budget: int, included: set[int], opened: set[int]) -> int:
+        """Greedily include ranked hunks which fit into the budget."""
+        used = 0
+        for hunk in ranked:
+            if id(hunk) in included:
+                continue
+            cost = hunk.tokens if id(hunk.diff_file) in opened else hunk.tokens + hunk.diff_file.header_tokens
+            if used + cost > budget:
+                continue
+            used += cost
+            included.add(id(hunk))
+            opened.add(id(hunk.diff_file))
+        return used
+
+    def __get_omitted_stat_lines(self, included: set[int], truncated: Optional[dict[int, str]] = None) -> list[str]:
+        """Get stat lines of files with omitted (or truncated) hunks."""
+        truncated = truncated or {}
+        omitted = []
+        for diff_file in self.files:
+            included_hunks = sum(1 for hunk in diff_file.hunks if id(hunk) in included)
+            truncated_hunks = sum(1 for hunk in diff_file.hunks if id(hunk) in truncated)
+            if included_hunks < len(diff_file.hunks) or not diff_file.hunks:
+                omitted.append(diff_file.get_stat_line(included_hunks, truncated_hunks))
+        return omitted
+
+    def __render(self, included: set[int], truncated: dict[int, str]) -> str:
+        """Render included (and truncated) hunks in the original order, followed by stat lines of omitted ones."""
+        parts = []
+        for diff_file in self.files:
+            file_hunks = [hunk.text if id(hunk) in included else truncated[id(hunk)] for hunk in diff_file.hunks if id(hunk) in included or id(hunk) in truncated]
+            if file_hunks:
+                parts.append(diff_file.header)
+                parts.extend(file_hunks)
+        omitted = self.__get_omitted_stat_lines(included, truncated)
+        if omitted:
+            parts.append(OMITTED_HEADER)
+            parts.extend(omitted)
+        return "".join(parts).strip()
+
+    def __get_stat_only(self, stat_lines: list[str], max_token_count: int) -> str:
+        """Get stat lines only, truncated to the token budget."""
+        parts = [OMITTED_HEADER]
+        used = sum(self.count_tokens([OMITTED_HEADER]))
+        for index, (stat_line, count) in enumerate(zip(stat_lines, self.count_tokens(stat_lines))):
+            remaining = f" ... and {len(stat_lines) - index} more files\n"
+            if used + count + sum(self.count_tokens([remaining])) > max_token_count:
+                parts.append(remaining)
+                break
+            used += count
+            parts.append(stat_line)
+        return "".join(parts).strip()
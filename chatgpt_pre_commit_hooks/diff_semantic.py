@@ -0,0 +1,225 @@
+"""``diff_semantic``.
+
+A module containing the semantic compression of file diffs into structural deltas.
+
+Instead of the changed lines, a compressed file diff lists what changed in the structure of the file - e.g.
+"added function load(path, *, strict)", "renamed class Foo -> Bar" or "changed key tool.ruff.line-length" -
+followed by a few of the raw changed lines. Old and new sources are parsed with the standard library: `ast` for
+Python and `json` for JSON files. Files which can't be parsed keep their raw hunks.
+"""
+
+import ast
+import json
+from pathlib import PurePosixPath
+from typing import Any, NamedTuple, Optional
+
+from chatgpt_pre_commit_hooks.diff_packer import DiffFile
+
+SEMANTIC_HEADER = "@@ structural changes @@\n"
+# max structural changes and raw changed lines of a file
+MAX_CHANGES = 40
+MAX_RAW_LINES = 6
+# max length of JSON values and signatures in change lines
+MAX_VALUE_LENGTH = 60
+# nested JSON objects are compared up to this depth
+MAX_JSON_DEPTH = 3
+
+
+class Symbol(NamedTuple):
+    """Definition in a source file."""
+
+    kind: str
+    # qualified name, e.g. `Class.method`
+    name: str
+    # arguments of functions, bases of classes
+    signature: str
+    # dump of the definition without its name (renames) and docstring (docstring-only changes)
+    body: str
+    # dump of the definition, the value of variables
+    code: str
+
+
+def is_supported(path: str) -> bool:
+    """Check if the file can be compressed."""
+    return PurePosixPath(path).suffix in (".py", ".pyi", ".json")
+
+
+def get_blob_ids(diff_file: DiffFile) -> tuple[Optional[str], Optional[str]]:
+    """Get (abbreviated) old and new blob ids of the file diff (`index <old>..<new>` header line) - `None` for added or deleted files."""
+    for line in diff_file.header_lines:
+        if line.startswith("index ") and ".." in line:
+            old, new = line.split()[1].split("..", 1)
+            return (None if set(old) == {"0"} else old), (None if set(new) == {"0"} else new)
+    return None, None
+
+
+def parse_cat_file_batch(output: bytes) -> list[Optional[str]]:
+    """Parse output of `git cat-file --batch` into contents of the objects, in the order of the input (`None` for missing or ambiguous ones)."""
+    contents: list[Optional[str]] = []
+    position = 0
+    while position < len(output):
+        end = output.find(b"\n", position)
+        if end == -1:
+            break
+        header = output[position:end].decode("utf-8", errors="replace").split()
+        position = end + 1
+        if len(header) != 3 or not header[2].isdigit():  # noqa: PLR2004
+            contents.append(None)
+            continue
+        size = int(header[2])
+        contents.append(output[position : position + size].decode("utf-8", errors="replace"))
+        position += size + 1
+    return contents
+
+
+def compress(diff_file: DiffFile, old_source: str, new_source: str) -> Optional[str]:
+    """Compress file diff into structural changes and a few raw changed lines.
+
+    Args:
+    diff_file: diff of the file.
+    old_source: source of the file before the change (empty if added).
+    new_source: source of the file after the change (empty if deleted).
+
+    Returns:
+    Get `str` compressed file diff, `None` if the sources can't be parsed.
+    """
+    suffix = PurePosixPath(diff_file.path).suffix
+    changes = get_json_changes(old_source, new_source) if suffix == ".json" else get_python_changes(old_source, new_source)
+    if changes is None:
+        return None
+    if not changes:
+        changes = ["formatting or comment changes only"]
+    if len(changes) > MAX_CHANGES:
+        changes = [*changes[:MAX_CHANGES], f"... and {len(changes) - MAX_CHANGES} more changes"]
+
+    changed_lines = [line for hunk in diff_file.hunks for line in hunk.lines[1:] if line[:1] in ("+", "-") and line[1:].strip()]
+    raw_lines = changed_lines[:MAX_RAW_LINES]
+    if len(changed_lines) > MAX_RAW_LINES:
+        raw_lines.append(f" ... and {len(changed_lines) - MAX_RAW_LINES} more changed lines\n")
+    header = "".join(line for line in diff_file.header_lines if not line.startswith("index "))
+    return header + SEMANTIC_HEADER + "".join(f" {change}\n" for change in changes) + "".join(raw_lines)
+
+
+def get_python_changes(old_source: str, new_source: str) -> Optional[list[str]]:
+    """Get structural changes of Python source - `None` if any of the sources is not valid Python."""
+    try:
+        old_symbols, new_symbols = get_python_symbols(old_source), get_python_symbols(new_source)
+    except (SyntaxError, ValueError, RecursionError):
+        return None
+
+    removed = [name for name in old_symbols if name not in new_symbols]
+    added = [name for name in new_symbols if name not in old_symbols]
+    renamed = get_renames([old_symbols[name] for name in removed], [new_symbols[name] for name in added])
+    changes = []
+    for name, symbol in new_symbols.items():
+        if name in renamed.values():
+            old_name = next(old_name for old_name, new_name in renamed.items() if new_name == name)
+            changes.append(f"renamed {symbol.kind} {old_name} -> {name}")
+        elif name in added:
+            changes.append(f"added {symbol.kind} {get_symbol_label(symbol)}")
+        elif old_symbols[name].signature != symbol.signature:
+            changes.append(f"changed signature of {symbol.kind} {get_symbol_label(old_symbols[name])} -> {get_symbol_label(symbol)}")
+        elif old_symbols[name].code != symbol.code and symbol.kind in ("variable", "attribute"):
+            changes.append(f"changed {symbol.kind} {name}: {shorten(old_symbols[name].code)} -> {shorten(symbol.code)}")
+        elif old_symbols[name].code != symbol.code:
+            docstring_only = old_symbols[name].body == symbol.body
+            changes.append(f"changed {'docstring of ' if docstring_only else ''}{symbol.kind} {name}")
+    changes.extend(f"removed {old_symbols[name].kind} {get_symbol_label(old_symbols[name])}" for name in removed if name not in renamed)
+    return changes
+
+
+def get_renames(removed: list[Symbol], added: list[Symbol]) -> dict[str, str]:
+    """Get renamed symbols - old name -> new name of removed and added symbols of the same kind and body."""
+    renamed: dict[str, str] = {}
+    for old_symbol in removed:
+        for new_symbol in added:
+            if new_symbol.name not in renamed.values() and new_symbol.kind == old_symbol.kind != "import" and new_symbol.body == old_symbol.body:
+                renamed[old_symbol.name] = new_symbol.name
+                break
+    return renamed
+
+
+def get_python_symbols(source: str) -> dict[str, Symbol]:
+    """Get definitions of Python source - imports, classes, functions, methods and module or class level assignments, by qualified name."""
+    symbols: dict[str, Symbol] = {}
+    visit_python_body(ast.parse(source).body, "", symbols)
+    return symbols
+
+
+def visit_python_body(body: list[ast.stmt], prefix: str, symbols: dict[str, Symbol]) -> None:
+    """Add definitions of the statements to the symbols (classes recursively)."""
+    for node in body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            module = f"{'.' * node.level}{node.module or ''}" if isinstance(node, ast.ImportFrom) else ""
+            for alias in node.names:
+                name = f"{module}{'.' if module and module[-1] != '.' else ''}{alias.name}{f' as {alias.asname}' if alias.asname else ''}"
+                symbols[f"{prefix}import {name}"] = Symbol("import", name, "", name, name)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            returns = f" -> {ast.unparse(node.returns)}" if node.returns is not None else ""
+            symbols[prefix + node.name] = get_python_symbol("method" if prefix else "function", prefix + node.name, node, f"({ast.unparse(node.args)}){returns}")
+        elif isinstance(node, ast.ClassDef):
+            bases = ", ".join(ast.unparse(base) for base in [*node.bases, *node.keywords])
+            # methods and nested classes are symbols of their own
+            members = [member for member in node.body if not isinstance(member, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))]
+            shell = ast.ClassDef(node.name, node.bases, node.keywords, members or [ast.Pass()], node.decorator_list)
+            symbols[prefix + node.name] = get_python_symbol("class", prefix + node.name, shell, f"({bases})" if bases else "")
+            visit_python_body(node.body, f"{prefix}{node.name}.", symbols)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                if isinstance(target, ast.Name):
+                    value = ast.unparse(node.value) if node.value is not None else ""
+                    symbols[prefix + target.id] = Symbol("attribute" if prefix else "variable", prefix + target.id, "", value, value)
+
+
+def get_python_symbol(kind: str, name: str, node: ast.AST, signature: str) -> Symbol:
+    """Get symbol of the function or class definition."""
+    code = ast.dump(node)
+    body = getattr(node, "body", [])
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+        body = body[1:]
+    # name and docstring left out
+    return Symbol(kind, name, signature, ast.dump(ast.Module(body=body, type_ignores=[])) + signature, code)
+
+
+def get_symbol_label(symbol: Symbol) -> str:
+    """Get label of the symbol - name and signature (or value), shortened."""
+    if symbol.kind in ("variable", "attribute"):
+        return f"{symbol.name} = {shorten(symbol.code)}"
+    return shorten(f"{symbol.name}{symbol.signature}")
+
+
+def get_json_changes(old_source: str, new_source: str) -> Optional[list[str]]:
+    """Get changed keys of JSON source - `None` if any of the sources is not a valid JSON object."""
+    try:
+        old_data, new_data = (json.loads(source) if source.strip() else {} for source in (old_source, new_source))
+    except ValueError:
+        return None
+    if not isinstance(old_data, dict) or not isinstance(new_data, dict):
+        return None
+
+    old_values, new_values = flatten_json(old_data), flatten_json(new_data)
+    changes = []
+    for key, value in new_values.items():
+        if key not in old_values:
+            changes.append(f"added key {key} = {shorten(json.dumps(value))}")
+        elif old_values[key] != value:
+            changes.append(f"changed key {key}: {shorten(json.dumps(old_values[key]))} -> {shorten(json.dumps(value))}")
+    changes.extend(f"removed key {key}" for key in old_values if key not in new_values)
+    return changes
+
+
+def flatten_json(data: dict[str, Any], prefix: str = "", depth: int = 1) -> dict[str, Any]:
+    """Flatten nested JSON objects into dotted keys, up to MAX_JSON_DEPTH."""
+    values = {}
+    for key, value in data.items():
+        if isinstance(value, dict) and value and depth < MAX_JSON_DEPTH:
+            values.update(flatten_json(value, f"{prefix}{key}.", depth + 1))
+        else:
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def shorten(text: str) -> str:
+    """Shorten text to MAX_VALUE_LENGTH chars."""
+    return text if len(text) <= MAX_VALUE_LENGTH else f"{text[: MAX_VALUE_LENGTH - 3]}..."
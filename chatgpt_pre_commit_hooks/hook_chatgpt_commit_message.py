@@ -8,52 +8,425 @@ The commit message is then used to populate the commit message automatically.
 
 
 import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
+from chatgpt_pre_commit_hooks import daemon, diff_semantic, profiler
 from chatgpt_pre_commit_hooks.base import FAIL, PASS, ChatGptPreCommitHooks
+from chatgpt_pre_commit_hooks.cache import ResponseCache
+from chatgpt_pre_commit_hooks.deferred import DONE, FAILED, DeferredQueue
+from chatgpt_pre_commit_hooks.diff_filter import GITATTRIBUTES, DiffFilter
+from chatgpt_pre_commit_hooks.diff_packer import OMITTED_HEADER, PRIORITY_SOURCE, DiffHunk, DiffPacker, get_priority, get_stat_line
+from chatgpt_pre_commit_hooks.prompts import COMMIT_MESSAGE_TEMPLATE, INCREMENTAL_HEADER, INCREMENTAL_PROMPT, MAP_PROMPT, REDUCE_HEADER
+
+# git-generated messages which are kept as they are
+SKIP_MESSAGE_SOURCES = ["merge", "squash"]
+# keywords of user messages which are kept as they are
+SKIP_KEYWORDS = ["#no-ai", "#no-openai", "#no-chatgpt", "#no-gpt", "#skip-ai", "#skip-openai", "#skip-chatgpt", "#skip-gpt"]
+
+# diff is read up to this many chars per token of the budget - leaving room to rank hunks by priority
+READ_CHARS_PER_TOKEN = 16
+# a file with more changed lines than max_char_count // MIN_CHARS_PER_LINE makes the diff longer than max_char_count
+MIN_CHARS_PER_LINE = 2
+
+# map-reduce summarization of large diffs
+MAP_MAX_TOKENS = 256
+MAP_MIN_TOKENS = 32
+
+# incremental summarization - per-hunk summaries kept in an index under `.git/`
+INCREMENTAL_SUMMARY_TOKENS = 48
+INCREMENTAL_SUMMARY_LINE = re.compile(r"^\W*(\d+)\s*[:.)-]\s*(.+)$")
+
+# speculative generation - commit messages generated in background, keyed by the index tree and these arguments
+SPECULATE_ARGS = [
+    "openai_model",
+    "openai_max_tokens",
+    "openai_api_base",
+    "openai_api_type",
+    "max_char_count",
+    "max_token_count",
+    "map_reduce",
+    "map_reduce_chunk_tokens",
+    "incremental",
+    "diff_include",
+    "diff_exclude",
+    "diff_gitattributes",
+    "diff_collapse_lockfiles",
+    "diff_ignore_whitespace",
+    "diff_minimal",
+    "diff_renames",
+    "diff_context",
+    "diff_semantic",
+    "emoji",
+    "description",
+    "candidates",
+]
+SPECULATE_POLL_INTERVAL = 0.05
+
+# alternative commit messages, stored next to the commit message file
+CANDIDATES_SUFFIX = ".candidates.json"
+
+# deferred generation - commit message of commits made before their message is generated
+DEFERRED_PLACEHOLDER = "chore: commit message pending (chatgpt-commit-message --deferred-apply)"
 
 
 class ChatGptCommitMessage(ChatGptPreCommitHooks):
     """TODO."""
 
+    name = "chatgpt-commit-message"
+
     def __init__(self) -> None:
         """TODO."""
         super().__init__()
-        self.args = self.__get_args_hook()
+        with self.metrics.span("args"):
+            self.args = self.__get_args_hook()
+        # source files touched by the last read diff - used for routing
+        self.files_touched = 0
 
     def __call__(self) -> int:
         """TODO."""
-        return self.__main()
+        try:
+            return self.__main()
+        except Exception:
+            self.metrics.set_outcome("error")
+            raise
+        finally:
+            self.metrics.emit()
 
     def __get_args_hook(self) -> argparse.Namespace:
         """Get input arguments."""
         self.args_parser.add_argument("--max-char-count", type=int, default=10000)  # args.max_char_count
+        self.args_parser.add_argument("--max-token-count", type=int, default=None)  # args.max_token_count
+        self.args_parser.add_argument("--map-reduce", action=argparse.BooleanOptionalAction, default=False)  # args.map_reduce
+        self.args_parser.add_argument("--map-reduce-concurrency", type=int, default=4)  # args.map_reduce_concurrency
+        self.args_parser.add_argument("--map-reduce-chunk-tokens", type=int, default=2000)  # args.map_reduce_chunk_tokens
+        self.args_parser.add_argument("--incremental", action=argparse.BooleanOptionalAction, default=False)  # args.incremental
+        self.args_parser.add_argument("--diff-include", type=str, action="append", default=[])  # args.diff_include
+        self.args_parser.add_argument("--diff-exclude", type=str, action="append", default=[])  # args.diff_exclude
+        self.args_parser.add_argument("--diff-gitattributes", action=argparse.BooleanOptionalAction, default=True)  # args.diff_gitattributes
+        self.args_parser.add_argument("--diff-collapse-lockfiles", action=argparse.BooleanOptionalAction, default=True)  # args.diff_collapse_lockfiles
+        self.args_parser.add_argument("--diff-ignore-whitespace", action=argparse.BooleanOptionalAction, default=False)  # args.diff_ignore_whitespace
+        self.args_parser.add_argument("--diff-minimal", action=argparse.BooleanOptionalAction, default=False)  # args.diff_minimal
+        self.args_parser.add_argument("--diff-renames", action=argparse.BooleanOptionalAction, default=True)  # args.diff_renames
+        self.args_parser.add_argument("--diff-context", type=int, default=None)  # args.diff_context
+        self.args_parser.add_argument("--diff-semantic", action=argparse.BooleanOptionalAction, default=False)  # args.diff_semantic
         self.args_parser.add_argument("--emoji", action=argparse.BooleanOptionalAction, default=False)  # args.emoji
         self.args_parser.add_argument("--description", action=argparse.BooleanOptionalAction, default=False)  # args.description
+        self.args_parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=False)  # args.stream
+        self.args_parser.add_argument("--candidates", type=int, default=1)  # args.candidates
+        self.args_parser.add_argument("--batch", type=str, default=None)  # args.batch
+        self.args_parser.add_argument("--batch-apply", action=argparse.BooleanOptionalAction, default=False)  # args.batch_apply
+        self.args_parser.add_argument("--batch-concurrency", type=int, default=4)  # args.batch_concurrency
+        self.args_parser.add_argument("--speculate", action=argparse.BooleanOptionalAction, default=False)  # args.speculate
+        self.args_parser.add_argument("--speculate-wait", type=float, default=10.0)  # args.speculate_wait
+        self.args_parser.add_argument("--speculate-key", type=str, default=None, help=argparse.SUPPRESS)  # args.speculate_key
+        self.args_parser.add_argument("--deferred", action=argparse.BooleanOptionalAction, default=False)  # args.deferred
+        self.args_parser.add_argument("--deferred-apply", action=argparse.BooleanOptionalAction, default=False)  # args.deferred_apply
+        self.args_parser.add_argument("--deferred-check", action=argparse.BooleanOptionalAction, default=False)  # args.deferred_check
+        self.args_parser.add_argument("--deferred-worker", action="store_true", default=False, help=argparse.SUPPRESS)  # args.deferred_worker
         self.args_parser.add_argument("commit_msg_filename", nargs="?", type=Path, default=Path(".git", "COMMIT_EDITMSG"))  # args.commit_msg_filename
         self.args_parser.add_argument("prepare_commit_message_source", nargs="?", default=None)  # args.prepare_commit_message_source
         self.args_parser.add_argument("commit_object_name", nargs="?", default=None)  # args.commit_object_name
         self.args_parser.add_argument(dest="rest", nargs=argparse.REMAINDER)
+        self.args_parser.set_defaults(**self.get_config_settings())
         args, unparsed = self.args_parser.parse_known_args()
         self.log.debug(f"ARGS_HOOK: {args}")
         self.log.debug(f"ARGS_HOOK_UNPARSED: {unparsed}")
         return args
 
-    def __get_git_diff(self) -> str:
-        """Get git diff of staged changes - full or stat only.
+    def __get_git_diff(self, messages: list[dict[str, str]], revision: Optional[str] = None) -> Optional[str]:
+        """Get git diff of staged changes (or of the commit) - full, packed or summarized.
 
         - full - if length of diff is less than max_char_count
-        - stat - if length of diff is more than max_char_count
+        - incremental - if incremental is enabled, per-hunk summaries (only hunks missing in the summary index are sent)
+        - summarized - if map_reduce is enabled and the diff doesn't fit into the token budget left by the prompt messages
+        - packed - hunks ranked by priority up to the token budget, and stat lines for the rest
+
+        Returns:
+        Get `str` diff, `None` if there are no changes.
         """
-        commands = ["git", "diff", "--staged", "--cached"]
-        diff = self.utils.cmd_output(commands)
-        if len(diff) > self.args.max_char_count:
-            commands = ["git", "diff", "--staged", "--cached", "--stat"]
-            diff = self.utils.cmd_output(commands)
+        with self.metrics.span("git_diff"):
+            numstat, diff, truncated, max_token_count, diff_filter = self.__read_git_diff(messages, revision)
+        self.metrics.add_count("diff_chars", len(diff))
+        self.files_touched = sum(1 for path in numstat if get_priority(path) == PRIORITY_SOURCE)
+        if not diff and not numstat:
+            return None
+        if self.args.diff_semantic is True and diff:
+            # before packing - compressed files compete for the token budget, so more of them fit
+            with self.metrics.span("semantic"):
+                diff = self.__compress_git_diff(diff)
+        notes = diff_filter.get_notes() if diff_filter is not None else {}
+        if diff_filter is not None and diff_filter.keep_collapsed:
+            self.__report_diff_filter(diff_filter)
+        if max_token_count is not None:
+            packer = DiffPacker(diff, lambda texts: self.num_tokens_from_strings(texts, self.args.openai_model), numstat=numstat, notes=notes, truncated=truncated)
+            if self.args.incremental is True:
+                diff = self.__get_git_diff_incremental(packer, max_token_count)
+            elif self.args.map_reduce is True and packer.count() > max_token_count:
+                diff = self.__get_git_diff_summaries(packer, max_token_count)
+            else:
+                diff = packer.pack(max_token_count)
+        elif notes:
+            diff = (diff + OMITTED_HEADER + "".join(get_stat_line(path, *numstat.get(path, (0, 0)), note) for path, note in notes.items())).strip()
         self.log.debug(f"GIT_DIFF: {diff}")
         return diff
 
+    def __read_git_diff(
+        self,
+        messages: list[dict[str, str]],
+        revision: Optional[str] = None,
+    ) -> tuple[dict[str, tuple[int, int]], str, bool, Optional[int], Optional[DiffFilter]]:
+        """Read numstat and patch of staged changes (or of the commit) in a single git invocation, streamed line by line.
+
+        Files collapsed by the diff filter (e.g. lockfiles, or more changed lines than tokens of the budget) are not kept.
+        Once the diff is longer than max_char_count, the token budget is computed and reading stops at a ceiling derived
+        from it - files which were not read are summarized from the numstat. With map_reduce, incremental or diff_semantic,
+        the whole diff is read and no file is too large.
+
+        Returns:
+        Get `tuple` of numstat, diff, whether the diff was truncated, the token budget (if the diff is longer than max_char_count)
+        and the diff filter (`None` if there are no patches).
+        """
+        numstat: dict[str, tuple[int, int]] = {}
+        diff_filter: Optional[DiffFilter] = None
+        lines: list[str] = []
+        length = 0
+        max_token_count: Optional[int] = None
+        max_char_count: Optional[int] = None
+        truncated = False
+        stream = self.context.cmd_output_lines(self.__get_git_diff_commands(revision))
+        try:
+            for line in stream:
+                if diff_filter is None:
+                    if not line.startswith("diff --git "):
+                        stat = DiffPacker.parse_numstat_line(line)
+                        if stat is not None:
+                            numstat[stat[0]] = stat[1]
+                        continue
+                    if not self.__is_git_diff_read_whole() and max(map(sum, numstat.values()), default=0) > self.args.max_char_count // MIN_CHARS_PER_LINE:
+                        # the diff is longer than max_char_count anyway - the budget tells which files can't fit
+                        max_token_count = self.__get_max_token_count(messages)
+                        max_char_count = max(max_token_count * READ_CHARS_PER_TOKEN, self.args.max_char_count)
+                    diff_filter = self.__get_diff_filter(numstat, max_token_count)
+                if not diff_filter.is_kept(line):
+                    continue
+                lines.append(line)
+                length += len(line)
+                if max_token_count is None and length > self.args.max_char_count:
+                    max_token_count = self.__get_max_token_count(messages)
+                    if not self.__is_git_diff_read_whole():
+                        max_char_count = max(max_token_count * READ_CHARS_PER_TOKEN, self.args.max_char_count)
+                if max_char_count is not None and length > max_char_count:
+                    self.log.debug(f"GIT_DIFF: stopped reading after {length} chars")
+                    truncated = True
+                    break
+        finally:
+            stream.close()
+        self.log.debug(f"GIT_DIFF_NUMSTAT: {numstat}")
+        return numstat, "".join(lines).strip(), truncated, max_token_count, diff_filter
+
+    def __is_git_diff_read_whole(self) -> bool:
+        """Check if the whole diff is read - map_reduce, incremental and diff_semantic handle diffs larger than the token budget."""
+        return self.args.map_reduce is True or self.args.incremental is True or self.args.diff_semantic is True
+
+    def __get_git_diff_commands(self, revision: Optional[str] = None) -> list[str]:
+        """Get git command printing numstat and patch of staged changes (or of the commit)."""
+        commands = ["git", "diff", "--staged", "--cached"] if revision is None else ["git", "diff-tree", "--root", "--no-commit-id", "-r"]
+        commands.append("-M" if self.args.diff_renames is True else "--no-renames")
+        if self.args.diff_ignore_whitespace is True:
+            commands.append("-w")
+        if self.args.diff_minimal is True:
+            commands.append("--minimal")
+        if self.args.diff_context is not None:
+            commands.append(f"-U{self.args.diff_context}")
+        commands += ["--numstat", "--patch"]
+        return commands if revision is None else [*commands, revision]
+
+    def __compress_git_diff(self, diff: str) -> str:
+        """Compress diffs of Python and JSON files into structural changes - files keep their raw hunks if they can't be parsed or compressing doesn't save tokens.
+
+        Old and new sources are read by blob ids of the diff in a single git invocation.
+        """
+        files = DiffPacker.parse(diff)
+        candidates = [diff_file for diff_file in files if diff_file.hunks and diff_semantic.is_supported(diff_file.path)]
+        if not candidates:
+            self.log.debug("DIFF_SEMANTIC: no Python or JSON file diffs to compress")
+            return diff
+        blob_ids = {diff_file.path: diff_semantic.get_blob_ids(diff_file) for diff_file in candidates}
+        names = [blob_id for ids in blob_ids.values() for blob_id in ids if blob_id is not None]
+        output = self.utils.cmd_output_bytes(["git", "cat-file", "--batch"], "".join(f"{name}\n" for name in names).encode("utf-8"))
+        blobs = {name: content for name, content in zip(names, diff_semantic.parse_cat_file_batch(output)) if content is not None}
+
+        compressed: dict[int, str] = {}
+        for diff_file in candidates:
+            old_id, new_id = blob_ids[diff_file.path]
+            if (old_id is not None and old_id not in blobs) or (new_id is not None and new_id not in blobs):
+                continue
+            text = diff_semantic.compress(diff_file, blobs.get(old_id or "", ""), blobs.get(new_id or "", ""))
+            if text is not None:
+                compressed[id(diff_file)] = text
+        raw = {id(diff_file): diff_file.header + "".join(hunk.text for hunk in diff_file.hunks) for diff_file in candidates if id(diff_file) in compressed}
+        counts = self.num_tokens_from_strings([*raw.values(), *compressed.values()], self.args.openai_model)
+        raw_tokens = dict(zip(raw, counts[: len(raw)]))
+        compressed_tokens = dict(zip(compressed, counts[len(raw) :]))
+        # compressed only if it saves tokens
+        kept = {file_id for file_id in compressed if compressed_tokens[file_id] < raw_tokens[file_id]}
+
+        before, after = sum(raw_tokens[file_id] for file_id in kept), sum(compressed_tokens[file_id] for file_id in kept)
+        self.log.debug(f"DIFF_SEMANTIC: compressed {len(kept)} of {len(candidates)} files, {before} -> {after} tokens ({before / max(after, 1):.1f}x)")
+        self.metrics.add_count("tokens_saved_semantic", before - after)
+        parts = [compressed[id(diff_file)] if id(diff_file) in kept else diff_file.header + "".join(hunk.text for hunk in diff_file.hunks) for diff_file in files]
+        return "".join(parts).strip()
+
+    def __get_diff_filter(self, numstat: dict[str, tuple[int, int]], max_token_count: Optional[int]) -> DiffFilter:
+        """Get diff filter of the files - gitattributes are checked in a single git invocation.
+
+        Files with more changed lines than tokens of the budget can't fit (every line takes a token at least), so they are
+        collapsed - if the budget is known before reading the patches.
+        """
+        attributes: dict[str, set[str]] = {}
+        if self.args.diff_gitattributes is True and numstat:
+            output = self.context.cmd_output(["git", "check-attr", "-z", "--stdin", *GITATTRIBUTES], text_input="\0".join(numstat))
+            attributes = DiffFilter.parse_check_attr(output)
+        return DiffFilter(
+            numstat,
+            self.args.diff_include,
+            self.args.diff_exclude,
+            attributes,
+            max_token_count,
+            lockfiles=self.args.diff_collapse_lockfiles is True,
+            keep_collapsed=self.metrics.enabled or self.log.isEnabledFor(logging.DEBUG),
+        )
+
+    def __report_diff_filter(self, diff_filter: DiffFilter) -> None:
+        """Report tokens saved by each filter - tokens of the collapsed patches less tokens of their summary lines."""
+        for name, lines in diff_filter.collapsed_lines.items():
+            stat_lines = [get_stat_line(path, *diff_filter.numstat.get(path, (0, 0)), note) for path, (filter_name, note) in diff_filter.collapsed.items() if filter_name == name]
+            collapsed_tokens, stat_tokens = self.num_tokens_from_strings(["".join(lines), "".join(stat_lines)], self.args.openai_model)
+            self.log.debug(f"DIFF_FILTER: {name} collapsed {len(stat_lines)} files, saved {collapsed_tokens - stat_tokens} tokens")
+            self.metrics.add_count(f"tokens_saved_{name}", collapsed_tokens - stat_tokens)
+
+    def __get_git_diff_summaries(self, packer: DiffPacker, max_token_count: int) -> str:
+        """Get summaries of diff chunks - each chunk is summarized by a separate request, running concurrently."""
+        map_system_prompt = " ".join(MAP_PROMPT)
+        context_window = self.get_openai_model_context_window(self.args.openai_model)
+        map_prompt_tokens = self.num_tokens_from_messages([{"role": "system", "content": map_system_prompt}, {"role": "user", "content": ""}], self.args.openai_model)
+        chunk_tokens = max(min(self.args.map_reduce_chunk_tokens, context_window - MAP_MAX_TOKENS - map_prompt_tokens), 1)
+        chunks = packer.split(chunk_tokens)
+        # keep all summaries within the budget of the final (reduce) request
+        summary_max_tokens = max(min(max_token_count // len(chunks), MAP_MAX_TOKENS), MAP_MIN_TOKENS)
+        self.log.debug(f"MAP_REDUCE: {len(chunks)} chunks of up to {chunk_tokens} tokens, summaries of up to {summary_max_tokens} tokens")
+
+        requests = [[{"role": "system", "content": map_system_prompt}, {"role": "user", "content": chunk}] for chunk in chunks]
+        summaries = [summary.strip() for summary in self.get_openai_chat_responses(requests, max_tokens=summary_max_tokens, concurrency=self.args.map_reduce_concurrency)]
+
+        parts = [f"{REDUCE_HEADER}\n"] + [f"\nPart {index}/{len(summaries)}:\n{summary}\n" for index, summary in enumerate(summaries, start=1)]
+        return self.__join_parts(parts, max_token_count, "parts")
+
+    def __get_git_diff_incremental(self, packer: DiffPacker, max_token_count: int) -> str:
+        """Get per-hunk summaries of the diff - summaries of hunks seen in earlier runs are reused from the summary index, and only the unseen hunks are sent."""
+        index = self.__get_summary_index()
+        hunks = [hunk for diff_file in packer.files for hunk in diff_file.hunks]
+        keys = {id(hunk): ResponseCache.get_key({"hunk": hunk.content_hash, "model": self.args.openai_model, "prompt": INCREMENTAL_PROMPT}) for hunk in hunks}
+        summaries: dict[int, str] = {}
+        if index is not None:
+            for hunk in hunks:
+                summary = index.get(keys[id(hunk)])
+                if summary is not None:
+                    summaries[id(hunk)] = summary
+
+        unseen = [hunk for hunk in hunks if id(hunk) not in summaries]
+        self.log.debug(f"INCREMENTAL: {len(hunks) - len(unseen)} of {len(hunks)} hunk summaries reused")
+        self.metrics.add_count("summaries_reused", len(hunks) - len(unseen))
+        self.metrics.add_count("summaries_sent", len(unseen))
+        if unseen:
+            new_summaries = self.__summarize_hunks(packer, unseen)
+            summaries.update(new_summaries)
+            if index is not None:
+                index.put_many({keys[hunk_id]: summary for hunk_id, summary in new_summaries.items()})
+
+        parts = [f"{INCREMENTAL_HEADER}\n"]
+        for diff_file in packer.files:
+            if not diff_file.hunks:
+                parts.append(f"\n{diff_file.get_stat_line().strip()}\n")
+                continue
+            lines = [f"- {summaries.get(id(hunk), 'not summarized')}\n" for hunk in diff_file.hunks]
+            parts.append(f"\n{diff_file.path} | +{diff_file.added} -{diff_file.removed}:\n{''.join(lines)}")
+        return self.__join_parts(parts, max_token_count, "files")
+
+    def __summarize_hunks(self, packer: DiffPacker, hunks: list[DiffHunk]) -> dict[int, str]:
+        """Summarize hunks with concurrent requests of numbered hunk groups - hunks missing in the responses are left out."""
+        system_prompt = " ".join(INCREMENTAL_PROMPT)
+        context_window = self.get_openai_model_context_window(self.args.openai_model)
+        max_tokens = int(self.args.openai_max_tokens)
+        prompt_tokens = self.num_tokens_from_messages([{"role": "system", "content": system_prompt}, {"role": "user", "content": ""}], self.args.openai_model)
+        chunk_tokens = max(min(self.args.map_reduce_chunk_tokens, context_window - max_tokens - prompt_tokens), 1)
+        group_size = max(max_tokens // INCREMENTAL_SUMMARY_TOKENS, 1)
+        diff_tokens = packer.count()
+
+        groups: list[list[tuple[DiffHunk, str]]] = [[]]
+        group_tokens = 0
+        for hunk in hunks:
+            text, tokens = hunk.text, hunk.tokens
+            if tokens > chunk_tokens:
+                text, tokens = "".join([*hunk.lines[: max(len(hunk.lines) * chunk_tokens // tokens - 1, 1)], "... (hunk truncated)\n"]), chunk_tokens
+            if groups[-1] and (group_tokens + tokens > chunk_tokens or len(groups[-1]) >= group_size):
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append((hunk, f"### Hunk {len(groups[-1]) + 1} of {hunk.diff_file.path}\n{text}"))
+            group_tokens += tokens
+        self.log.debug(f"INCREMENTAL: {len(hunks)} hunks sent in {len(groups)} requests (of {diff_tokens} diff tokens)")
+
+        requests = [[{"role": "system", "content": system_prompt}, {"role": "user", "content": "".join(text for _, text in group)}] for group in groups]
+        summaries: dict[int, str] = {}
+        for group, response in zip(groups, self.get_openai_chat_responses(requests, max_tokens=max_tokens, concurrency=self.args.map_reduce_concurrency)):
+            for line in response.splitlines():
+                match = INCREMENTAL_SUMMARY_LINE.match(line.strip())
+                if match is not None and 1 <= int(match.group(1)) <= len(group):
+                    summaries[id(group[int(match.group(1)) - 1][0])] = match.group(2).strip()
+        return summaries
+
+    def __get_summary_index(self) -> Optional[ResponseCache]:
+        """Get index of per-hunk summaries stored under `.git/`."""
+        return self.__get_git_dir_store("summaries")
+
+    def __get_git_dir_store(self, name: str) -> Optional[ResponseCache]:
+        """Get store of the name under `.git/` - following the limits of the response cache."""
+        git_dir = self.get_git_dir()
+        if git_dir is None:
+            self.log.debug(f"STORE: {name} disabled - not a git repository")
+            return None
+        return ResponseCache(git_dir.joinpath("chatgpt-pre-commit-hooks", name), ttl=self.args_global.cache_ttl, max_size=self.args_global.cache_max_size, log=self.log)
+
+    def __join_parts(self, parts: list[str], max_token_count: int, name: str) -> str:
+        """Join summary parts up to the token budget - the rest is counted in the last line."""
+        used = 0
+        for index, count in enumerate(self.num_tokens_from_strings(parts, self.args.openai_model)):
+            used += count
+            if used > max_token_count:
+                parts = [*parts[:index], f"\n... and {len(parts) - index} more {name}\n"]
+                break
+        return "".join(parts).strip()
+
+    def __get_max_token_count(self, messages: list[dict[str, str]]) -> int:
+        """Get token budget of the diff - what is left in the model's context window after the prompt and the completion."""
+        if self.args.max_token_count is not None:
+            return self.args.max_token_count
+
+        # routing falls back to the model with the largest context window
+        context_window = max(self.get_openai_model_context_window(model) for model in self.get_openai_models())
+        prompt_tokens = self.num_tokens_from_messages(messages, self.args.openai_model)
+        max_token_count = max(context_window - int(self.args.openai_max_tokens) - prompt_tokens, 0)
+        self.log.debug(f"MAX_TOKEN_COUNT: {max_token_count}")
+        return max_token_count
+
     def __get_user_commit_message(self) -> Optional[str]:
         """Get user commit message (if specified)."""
         self.log.debug(f"PREPARE_COMMIT_MESSAGE_SOURCE: {self.args.prepare_commit_message_source}")
@@ -68,81 +441,522 @@ class ChatGptCommitMessage(ChatGptPreCommitHooks):
 
         self.log.debug(f"USER_COMMIT_MESSAGE: {user_commit_message}")
 
-        if user_commit_message is not None:
-            skip_keywords = ["#no-ai", "#no-openai", "#no-chatgpt", "#no-gpt", "#skip-ai", "#skip-openai", "#skip-chatgpt", "#skip-gpt"]
-            if any(skip_keyword.casefold() in user_commit_message.casefold() for skip_keyword in skip_keywords):
-                self.log.debug(f"USER_COMMIT_MESSAGE: {user_commit_message} - SKIPPED")
-                self.self_exit(PASS)
+        if user_commit_message is not None and self.__has_skip_keyword(user_commit_message):
+            self.log.debug(f"USER_COMMIT_MESSAGE: {user_commit_message} - SKIPPED")
+            self.metrics.set_outcome("skip_keyword")
+            self.self_exit(PASS)
 
         return user_commit_message
 
-    def __get_openai_chat_prompt_messages(self) -> list[dict[str, str]]:
-        """Get prompt messages."""
-        role_system = [
-            "You are a software engineer assistant to write a 'Commit message with scope'.",
-            "You aim to suggest a clean commit message in the 'Conventional Commits' convention.",
-            "You will get an output from the 'git diff --staged' or 'git diff --staged --stat' command, and you will suggest a commit message.",
-        ]
-        role_user = [self.__get_git_diff()]
+    def __has_skip_keyword(self, commit_message: str) -> bool:
+        """Check if the commit message asks to skip suggestions."""
+        return any(skip_keyword.casefold() in commit_message.casefold() for skip_keyword in SKIP_KEYWORDS)
 
-        # GitMoji
-        if self.args.emoji is True:
-            role_system.append("Use the 'GitMoji convention' to preface the commit with the UNICODE characters format.")
-            role_system.append("Do not use shortcode representation.")
-        else:
-            role_system.append("Do not preface the commit message with anything.")
+    def get_openai_chat_prompt_messages(self, user_commit_message: Optional[str], revision: Optional[str] = None) -> Optional[list[dict[str, str]]]:
+        """Get prompt messages.
 
-        # description
-        if self.args.description is True:
-            role_system.append("Add a short description to the commit message in the body section of why these changes were made.")
-            role_system.append('Omit "This commit" at the beginning - briefly describe changes.')
-            role_system.append("Each sentence of the description should be in new line.")
-        else:
-            role_system.append("Do not describe changes; just simply output without any explanation - the final commit message MUST have only one line!")
+        Args:
+        user_commit_message: commit message specified by the user, considered as a suggestion.
+        revision: commit to describe, staged changes if not set.
+
+        Returns:
+        Get `list[dict[str, str]]` prompt messages, `None` if there are no changes.
+        """
+        flags = {"emoji": self.args.emoji is True, "description": self.args.description is True}
+        git_diff = self.__get_git_diff(COMMIT_MESSAGE_TEMPLATE.get_messages(flags, "", user_commit_message), revision)
+        if git_diff is None:
+            return None
+        messages = COMMIT_MESSAGE_TEMPLATE.get_messages(flags, git_diff, user_commit_message)
+
+        self.log.debug(f"ROLE_SYSTEM_PROMPT: {messages[0]['content']}")
+        self.log.debug(f"ROLE_USER_PROMPT: {messages[1]['content']}")
+        if self.metrics.enabled:
+            self.metrics.add_count("prompt_prefix_tokens", self.num_tokens_from_messages(messages[:1], self.args.openai_model))
+
+        return messages
+
+    def __set_commit_message(self) -> None:
+        """Set the suggested commit message."""
+        if self.args.prepare_commit_message_source in SKIP_MESSAGE_SOURCES:
+            self.log.debug(f"PREPARE_COMMIT_MESSAGE_SOURCE: {self.args.prepare_commit_message_source} - SKIPPED")
+            self.metrics.set_outcome("skip_source")
+            self.self_exit(PASS)
+
+        if self.args.speculate is True:
+            # pre-commit stage - the commit message file is not written yet
+            self.metrics.set_outcome("speculate")
+            self.__speculate()
+            return
 
         user_commit_message = self.__get_user_commit_message()
-        # User message
-        if user_commit_message is not None:
-            role_system.append("The user has already specified the commit message; please consider it as a suggestion if applicable.")
-            role_system.append("Do not include user message itself in the final commit message and do not put any note why.")
-            role_system.append("The user's message starts after the 'USER-MESSAGE:'.")
-            role_user.append(f"\n\nUSER-MESSAGE: {user_commit_message}")
+        if self.args.deferred is True and self.__defer(user_commit_message):
+            return
+        candidates_key = self.__get_tree_key(user_commit_message) if self.args.candidates > 1 else None
+        commit_msg = self.__get_next_candidate(candidates_key) if candidates_key is not None else None
+        if commit_msg is None:
+            commit_msgs = self.__get_speculated_commit_messages() if user_commit_message is None else None
+            if commit_msgs is not None:
+                self.metrics.set_outcome("speculated")
+            else:
+                commit_msgs = self.__get_commit_messages(user_commit_message)
+            commit_msg = commit_msgs[0]
+            if candidates_key is not None and len(commit_msgs) > 1:
+                write_candidates(get_candidates_path(self.args.commit_msg_filename), {"key": candidates_key, "index": 0, "candidates": commit_msgs})
+        with self.metrics.span("write"):
+            commit_msg_file_wrapper = self.args.commit_msg_filename.open("wt", encoding="utf-8")
+            commit_msg_file_wrapper.write(commit_msg)
+            commit_msg_file_wrapper.close()
+        self.metrics.set_outcome("ok")
 
-        role_system.append("Use the present tense.")
-        role_system.append("Lines must be at most 72 characters.")
+    def __get_commit_messages(self, user_commit_message: Optional[str]) -> list[str]:
+        """Get the suggested commit message (or candidates) - exits if there are no staged changes."""
+        with self.metrics.span("prompt"):
+            messages = self.get_openai_chat_prompt_messages(user_commit_message)
+        if messages is None:
+            self.log.debug("GIT_DIFF: no staged changes - SKIPPED")
+            self.metrics.set_outcome("skip_empty")
+            self.self_exit(PASS)
+            return []
+        if self.args.stream is True and self.args.candidates <= 1:
+            return [self.__stream_commit_message(messages)]
+        return self.__request_commit_messages(messages)
 
-        role_system_prompt = " ".join(role_system)
-        role_user_prompt = " ".join(role_user)
+    def __request_commit_messages(self, messages: list[dict[str, str]]) -> list[str]:
+        """Request the suggested commit message - or `candidates` alternatives of it in a single request."""
+        model = self.__route(messages)
+        if self.args.candidates > 1:
+            return self.get_openai_chat_choices(messages, self.args.candidates, model=model)
+        return [self.get_openai_chat_response(messages, model=model)]
 
-        self.log.debug(f"ROLE_SYSTEM_PROMPT: {role_system_prompt}")
-        self.log.debug(f"ROLE_USER_PROMPT: {role_user_prompt}")
+    def __get_next_candidate(self, key: str) -> Optional[str]:
+        """Get the next stored candidate of the same staged changes and arguments - the "try again" of an aborted commit, without any request."""
+        candidates_path = get_candidates_path(self.args.commit_msg_filename)
+        candidates = read_candidates(candidates_path)
+        if candidates is None or candidates.get("key") != key:
+            return None
+        candidates["index"] = (candidates["index"] + 1) % len(candidates["candidates"])
+        write_candidates(candidates_path, candidates)
+        self.log.debug(f"CANDIDATES: {candidates['index'] + 1} of {len(candidates['candidates'])}")
+        self.metrics.set_outcome("candidate")
+        return candidates["candidates"][candidates["index"]]
 
-        return [
-            {"role": "system", "content": role_system_prompt},
-            {"role": "user", "content": role_user_prompt},
-        ]
+    def __route(self, messages: list[dict[str, str]]) -> str:
+        """Get model of the commit message request."""
+        with self.metrics.span("route"):
+            return self.route_openai_model(messages, self.files_touched)
 
-    def __set_commit_message(self) -> None:
-        """Set the suggested commit message."""
-        messages = self.__get_openai_chat_prompt_messages()
-        commit_msg = self.get_openai_chat_response(messages)
-        commit_msg_file_wrapper = self.args.commit_msg_filename.open("wt", encoding="utf-8")
-        commit_msg_file_wrapper.write(commit_msg)
-        commit_msg_file_wrapper.close()
+    def __get_tree_key(self, user_commit_message: Optional[str] = None) -> Optional[str]:
+        """Get key of commit messages of the staged changes - hash of the index tree (`git write-tree`), the user message and arguments affecting the prompt."""
+        tree = self.utils.cmd_output(["git", "write-tree"])
+        if not tree:
+            return None
+        args = {name: getattr(self.args, name) for name in SPECULATE_ARGS}
+        return ResponseCache.get_key({"tree": tree, "user": user_commit_message, "args": args, "routes": self.openai_routes, "backends": self.openai_backends})
+
+    def __speculate(self) -> None:
+        """Start generating the commit message of the staged changes in a detached background process."""
+        store = self.__get_git_dir_store("speculation")
+        key = self.__get_tree_key()
+        if store is None or key is None:
+            return
+        marker_path = store.directory.joinpath(f"{key}.pending")
+        if store.get(key) is not None or self.__is_speculation_running(marker_path):
+            self.log.debug(f"SPECULATION: {key} - already generated or running")
+            return
+
+        argv = [arg for arg in sys.argv[1:] if arg != "--speculate"]
+        commands = [sys.executable, "-m", "chatgpt_pre_commit_hooks.main", "--hook", "chatgpt-commit-message", "--no-daemon", "--speculate-key", key, *argv]
+        store.directory.mkdir(parents=True, exist_ok=True)
+        process = subprocess.Popen(commands, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)  # noqa: S603
+        marker_path.write_text(str(process.pid), encoding="utf-8")
+        self.log.debug(f"SPECULATION: {key} - started process {process.pid}")
+
+    def __run_speculation(self) -> int:
+        """Generate the commit message of the staged changes and store it - dropped if the index changed in the meantime."""
+        store = self.__get_git_dir_store("speculation")
+        if store is None:
+            return FAIL
+        key = self.args.speculate_key
+        try:
+            messages = self.get_openai_chat_prompt_messages(None)
+            if messages is None:
+                self.metrics.set_outcome("skip_empty")
+                return PASS
+            commit_msgs = self.__request_commit_messages(messages)
+            if self.__get_tree_key() != key:
+                self.log.debug(f"SPECULATION: {key} - index changed, dropped")
+                self.metrics.set_outcome("speculation_dropped")
+                return PASS
+            store.put(key, commit_msgs)
+            self.metrics.set_outcome("ok")
+        finally:
+            store.directory.joinpath(f"{key}.pending").unlink(missing_ok=True)
+        return PASS
+
+    def __get_speculated_commit_messages(self) -> Optional[list[str]]:
+        """Get commit message (or candidates) speculated for the staged changes - waiting up to speculate_wait seconds for a running speculation."""
+        store = self.__get_git_dir_store("speculation")
+        if store is None or not store.directory.is_dir():
+            return None
+        key = self.__get_tree_key()
+        if key is None:
+            return None
+        marker_path = store.directory.joinpath(f"{key}.pending")
+        deadline = time.monotonic() + self.args.speculate_wait
+        with self.metrics.span("speculate_wait"):
+            commit_msgs = store.get(key)
+            while commit_msgs is None and time.monotonic() < deadline and self.__is_speculation_running(marker_path):
+                time.sleep(SPECULATE_POLL_INTERVAL)
+                commit_msgs = store.get(key)
+        self.log.debug(f"SPECULATION: {key} - {'hit' if commit_msgs is not None else 'miss'}")
+        # speculations stored before candidates were a single message
+        return [commit_msgs] if isinstance(commit_msgs, str) else commit_msgs
+
+    def __is_speculation_running(self, marker_path: Path) -> bool:
+        """Check if the process generating the commit message (pid in the marker file) is running."""
+        try:
+            pid = int(marker_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return False
+        if sys.platform == "win32":
+            # bounded by speculate_wait
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            marker_path.unlink(missing_ok=True)
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def __stream_commit_message(self, messages: list[dict[str, str]]) -> str:
+        """Stream the suggested commit message into the commit message file and stderr.
+
+        Without description, the stream stops as soon as the one-line subject is complete. If the request fails or the
+        hook exits early (e.g. no response within the latency budget), the original content of the file is restored.
+        """
+        original = self.args.commit_msg_filename.read_text(encoding="utf-8") if self.args.commit_msg_filename.is_file() else None
+        try:
+            commit_msg = self.__stream_commit_message_file(messages)
+        except BaseException:
+            if original is None:
+                self.args.commit_msg_filename.unlink(missing_ok=True)
+            else:
+                self.args.commit_msg_filename.write_text(original, encoding="utf-8")
+            raise
+
+        sys.stderr.write("\n")
+        if self.args.description is not True:
+            commit_msg = commit_msg.strip().split("\n", 1)[0]
+        return commit_msg
+
+    def __stream_commit_message_file(self, messages: list[dict[str, str]]) -> str:
+        """Stream the suggested commit message into the commit message file and stderr."""
+        received: list[str] = []
+        with self.args.commit_msg_filename.open("wt", encoding="utf-8") as commit_msg_file_wrapper:
+
+            def on_delta(delta: str) -> bool:
+                received.append(delta)
+                commit_msg_file_wrapper.write(delta)
+                commit_msg_file_wrapper.flush()
+                sys.stderr.write(delta)
+                sys.stderr.flush()
+                return self.args.description is True or "\n" not in "".join(received).lstrip()
+
+            return self.get_openai_chat_response(messages, on_delta=on_delta, model=self.__route(messages))
+
+    def __defer(self, user_commit_message: Optional[str]) -> bool:
+        """Enqueue the staged changes and write the placeholder (or keep the user's draft), so the commit doesn't wait for the message.
+
+        The staged changes are kept as a snapshot commit (`git commit-tree`, not referenced by any branch) of the index
+        tree on top of `HEAD`, and a detached worker generates the message of its diff.
+
+        Returns:
+        Get `bool` if the commit message was deferred - falls back to generating it right away if not in a git repository.
+        """
+        queue = self.__get_deferred_queue()
+        tree = self.utils.cmd_output(["git", "write-tree"])
+        key = self.__get_tree_key(user_commit_message)
+        if queue is None or not tree or key is None:
+            return False
+        head = self.utils.cmd_output(["git", "rev-parse", "--verify", "--quiet", "HEAD^{commit}"])
+        if head and self.utils.cmd_output(["git", "rev-parse", f"{head}^{{tree}}"]) == tree:
+            self.log.debug("GIT_DIFF: no staged changes - SKIPPED")
+            self.metrics.set_outcome("skip_empty")
+            self.self_exit(PASS)
+        placeholder = user_commit_message or DEFERRED_PLACEHOLDER
+        snapshot = self.utils.cmd_output(["git", "commit-tree", tree, *(["-p", head] if head else []), "-m", placeholder])
+        if not snapshot:
+            return False
+
+        with self.metrics.span("write"):
+            if user_commit_message is None:
+                self.args.commit_msg_filename.write_text(placeholder + "\n", encoding="utf-8")
+            if queue.put(key, {"snapshot": snapshot, "tree": tree, "parent": head, "placeholder": placeholder, "user": user_commit_message}):
+                self.__start_deferred_worker()
+        self.metrics.set_outcome("deferred")
+        return True
+
+    def __start_deferred_worker(self) -> None:
+        """Start a detached worker generating commit messages of the pending jobs."""
+        argv = [arg for arg in sys.argv[1:] if arg != "--deferred"]
+        commands = [sys.executable, "-m", "chatgpt_pre_commit_hooks.main", "--hook", "chatgpt-commit-message", "--no-daemon", "--deferred-worker", *argv]
+        process = subprocess.Popen(commands, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)  # noqa: S603
+        self.log.debug(f"DEFERRED: started worker process {process.pid}")
+
+    def __run_deferred_worker(self) -> int:
+        """Generate commit messages of the pending jobs until there are none left - jobs enqueued in the meantime included."""
+        queue = self.__get_deferred_queue()
+        if queue is None:
+            return FAIL
+        # the worker is off the critical path - no latency budget
+        self.args_global.latency_budget_ms = None
+        jobs = 0
+        claimed = queue.claim()
+        while claimed is not None:
+            key, job = claimed
+            state, error = DONE, None
+            try:
+                messages = self.get_openai_chat_prompt_messages(job["user"], revision=job["snapshot"])
+                job["message"] = self.__request_commit_messages(messages)[0].strip() if messages is not None else job["placeholder"]
+            except Exception as err:  # noqa: BLE001
+                state, error = FAILED, err
+            if error is not None:
+                self.log.error(f"DEFERRED: {key} - {error}")
+                job["error"] = str(error)
+            queue.finish(key, job, state)
+            jobs += 1
+            claimed = queue.claim()
+        self.metrics.add_count("deferred_jobs", jobs)
+        self.metrics.set_outcome("ok")
+        return PASS
+
+    def __get_deferred_queue(self) -> Optional[DeferredQueue]:
+        """Get queue of deferred commit messages stored under `.git/`."""
+        git_dir = self.get_git_dir()
+        if git_dir is None:
+            self.log.debug("DEFERRED: disabled - not a git repository")
+            return None
+        return DeferredQueue(git_dir.joinpath("chatgpt-pre-commit-hooks", "deferred"), log=self.log)
+
+    def __get_unpushed_commits(self, head: str = "HEAD") -> list[dict[str, Any]]:
+        """Get commits of the head not pushed to any remote, oldest first - with parents, trees and messages, in a single git invocation."""
+        output = self.utils.cmd_output(["git", "log", "--reverse", "--format=%H%x1f%P%x1f%T%x1f%B%x1e", head, "--not", "--remotes"])
+        commits = []
+        for record in output.split("\x1e"):
+            fields = record.strip().split("\x1f")
+            if len(fields) == 4:  # noqa: PLR2004
+                commits.append({"commit": fields[0], "parents": fields[1].split(), "tree": fields[2], "message": fields[3].strip()})
+        return commits
+
+    def __get_deferred_jobs(self, queue: DeferredQueue, commits: list[dict[str, Any]]) -> dict[str, tuple[str, str, dict[str, Any]]]:
+        """Get deferred jobs of the commits - commit -> (key, state, job), matched by the tree, the parent and the untouched placeholder.
+
+        Placeholders are compared without comment and blank lines (see `get_message_key`) - git cleans up the message of
+        the commit, and the user's draft was read without them.
+        """
+        jobs = {(job.get("tree"), job.get("parent") or "", get_message_key(job.get("placeholder", ""))): (key, state, job) for key, (state, job) in queue.get_jobs().items()}
+        keys = {commit["commit"]: (commit["tree"], next(iter(commit["parents"]), ""), get_message_key(commit["message"])) for commit in commits}
+        return {commit: jobs[key] for commit, key in keys.items() if key in jobs}
+
+    def __apply_deferred(self) -> int:
+        """Rewrite the unpushed commits with their generated messages - commits edited after the commit keep their messages."""
+        queue = self.__get_deferred_queue()
+        if queue is None:
+            self.log.error("Not a git repository")
+            return FAIL
+        commits = self.__get_unpushed_commits()
+        jobs = self.__get_deferred_jobs(queue, commits)
+        queue.prune({key for key, _, _ in jobs.values()})
+        failed = {key for key, state, _ in jobs.values() if state == FAILED}
+        for key in failed:
+            queue.retry(key)
+        if failed:
+            sys.stdout.write(f"Retrying {len(failed)} failed deferred commit messages in background\n")
+            self.__start_deferred_worker()
+        done = [index for index, commit in enumerate(commits) if commit["commit"] in jobs and jobs[commit["commit"]][1] == DONE]
+        waiting = len(jobs) - len(done)
+        if not done:
+            sys.stdout.write(f"No deferred commit messages to apply ({waiting} not generated yet)\n")
+            return PASS
+
+        commits = commits[done[0] :]
+        results = [{"message": jobs[commit["commit"]][2]["message"] if commit["commit"] in jobs and jobs[commit["commit"]][1] == DONE else commit["message"]} for commit in commits]
+        exit_code = self.__apply_batch([[commit["commit"], *commit["parents"]] for commit in commits], results, f"{commits[0]['commit']}^..HEAD")
+        if exit_code == PASS:
+            for commit in commits:
+                if commit["commit"] in jobs and jobs[commit["commit"]][1] == DONE:
+                    queue.remove(jobs[commit["commit"]][0])
+        if waiting:
+            sys.stdout.write(f"{waiting} deferred commit messages not generated yet\n")
+        return exit_code
+
+    def __check_deferred(self) -> int:
+        """Check that the commits to push have no deferred commit messages left to apply (pre-push)."""
+        queue = self.__get_deferred_queue()
+        if queue is None:
+            return PASS
+        commits = self.__get_unpushed_commits(os.environ.get("PRE_COMMIT_TO_REF") or "HEAD")
+        jobs = self.__get_deferred_jobs(queue, commits)
+        pending = [commit["commit"] for commit in commits if commit["commit"] in jobs or commit["message"] == DEFERRED_PLACEHOLDER]
+        self.log.debug(f"DEFERRED: {len(pending)} of {len(commits)} unpushed commits not applied")
+        if pending:
+            self.log.error(f"{len(pending)} commits to push have deferred commit messages - apply them with `chatgpt-commit-message --deferred-apply` first")
+            return FAIL
+        return PASS
+
+    def __batch(self) -> int:
+        """Suggest commit messages of every commit in the revision range, and print them as JSON or apply them.
+
+        Prompts are built one by one, and requests are sent concurrently (up to batch_concurrency at the same time).
+        Every request is routed like the commit message request - the diff is packed for the largest context window of all models.
+        Merge commits and commits with skip keywords keep their messages.
+        """
+        commits = [line.split() for line in self.utils.cmd_output(["git", "rev-list", "--reverse", "--parents", self.args.batch]).splitlines()]
+        self.log.debug(f"BATCH: {len(commits)} commits in {self.args.batch}")
+        results = []
+        # routed model -> (result, prompt messages) of its requests
+        requests: dict[str, list[tuple[dict[str, Optional[str]], list[dict[str, str]]]]] = {}
+        for commit, *parents in commits:
+            commit_message = self.utils.cmd_output(["git", "log", "-1", "--format=%B", commit])
+            result = {"commit": commit, "original": commit_message, "message": commit_message, "skipped": None}
+            messages = None
+            if len(parents) > 1:
+                result["skipped"] = "merge"
+            elif self.__has_skip_keyword(commit_message):
+                result["skipped"] = "keyword"
+            else:
+                messages = self.get_openai_chat_prompt_messages(commit_message or None, revision=commit)
+                result["skipped"] = "empty" if messages is None else None
+            if messages is not None:
+                requests.setdefault(self.__route(messages), []).append((result, messages))
+            results.append(result)
+
+        for model, model_requests in requests.items():
+            responses = self.get_openai_chat_responses([messages for _, messages in model_requests], concurrency=self.args.batch_concurrency, model=model)
+            for (result, _), response in zip(model_requests, responses):
+                result["message"] = response.strip()
+        self.metrics.add_count("batch_commits", len(commits))
+
+        if self.args.batch_apply is True:
+            return self.__apply_batch(commits, results, self.args.batch)
+        sys.stdout.write(json.dumps(results, indent=2) + "\n")
+        return PASS
+
+    def __apply_batch(self, commits: list[list[str]], results: list[dict[str, Optional[str]]], revision_range: str) -> int:
+        """Rewrite the commits with the suggested messages - the range must be linear and end at `HEAD`.
+
+        Commits are recreated with their trees, authors and author dates, and `HEAD` is moved to the last one;
+        the working tree and the index are left as they are.
+        """
+        head = self.utils.cmd_output(["git", "rev-parse", "HEAD"])
+        if not commits or commits[-1][0] != head or any(len(parents) > 1 for _, *parents in commits):
+            self.log.error(f"Range {revision_range} must be a linear range (without merges) ending at HEAD")
+            return FAIL
+
+        parents = commits[0][1:]
+        for (commit, *_), result in zip(commits, results):
+            tree = self.utils.cmd_output(["git", "rev-parse", f"{commit}^{{tree}}"])
+            author_name, author_email, author_date = self.utils.cmd_output(["git", "log", "-1", "--format=%an%n%ae%n%aI", commit]).split("\n")
+            env = {**os.environ, "GIT_AUTHOR_NAME": author_name, "GIT_AUTHOR_EMAIL": author_email, "GIT_AUTHOR_DATE": author_date}
+            parent_args = [arg for parent in parents for arg in ("-p", parent)]
+            new_commit = self.utils.cmd_output(["git", "commit-tree", tree, *parent_args, "-m", result["message"] or ""], env=env)
+            if not new_commit:
+                self.log.error(f"Can't rewrite commit {commit}")
+                return FAIL
+            self.log.debug(f"BATCH_APPLY: {commit} -> {new_commit}")
+            parents = [new_commit]
+
+        self.utils.cmd_output(["git", "update-ref", "-m", f"chatgpt-pre-commit-hooks: rewrite {revision_range}", "HEAD", parents[0], head])
+        if self.utils.cmd_output(["git", "rev-parse", "HEAD"]) != parents[0]:
+            self.log.error(f"Can't move HEAD to {parents[0]}")
+            return FAIL
+        sys.stdout.write(f"Rewritten {len(commits)} commits, HEAD is now at {parents[0]} (previously {head})\n")
+        return PASS
 
     def __main(self) -> int:
         """Main function of module."""
+        # commands run instead of setting the commit message
+        commands = [
+            (self.args.batch is not None, self.__batch),
+            (self.args.speculate_key is not None, self.__run_speculation),
+            (self.args.deferred_worker is True, self.__run_deferred_worker),
+            (self.args.deferred_apply is True, self.__apply_deferred),
+            (self.args.deferred_check is True, self.__check_deferred),
+        ]
         try:
+            for enabled, command in commands:
+                if enabled:
+                    return command()
             self.__set_commit_message()
         except (ValueError, TypeError) as err:
             self.log.exception(err.with_traceback(err.__traceback__))
+            self.metrics.set_outcome("error")
             return FAIL
         else:
             return PASS
 
 
+def get_message_key(message: str) -> str:
+    """Get commit message without comment and blank lines - like the user's draft is read, whatever the cleanup mode of the commit."""
+    return "".join(line for line in message.splitlines(keepends=True) if not line.startswith("#") and line.strip()).strip()
+
+
+def get_candidates_path(commit_msg_filename: Path) -> Path:
+    """Get path of the candidates file stored next to the commit message file."""
+    return commit_msg_filename.with_name(commit_msg_filename.name + CANDIDATES_SUFFIX)
+
+
+def read_candidates(candidates_path: Path) -> Optional[dict[str, Any]]:
+    """Read candidates file - the key of the staged changes, the index of the current candidate and the candidates."""
+    try:
+        candidates = json.loads(candidates_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return candidates if isinstance(candidates, dict) and candidates.get("candidates") else None
+
+
+def write_candidates(candidates_path: Path, candidates: dict[str, Any]) -> None:
+    """Write candidates file."""
+    candidates_path.write_text(json.dumps(candidates, indent=2), encoding="utf-8")
+
+
+def pick_candidate(commit_msg_filename: Path, selection: str) -> Optional[str]:
+    """Pick a stored candidate and write it into the commit message file.
+
+    Args:
+    commit_msg_filename: commit message file, the candidates file is next to it.
+    selection: `next`, `previous` or the number of the candidate (from 1).
+
+    Returns:
+    Get `str` picked candidate, `None` if there are no candidates or the selection is invalid.
+    """
+    candidates_path = get_candidates_path(commit_msg_filename)
+    candidates = read_candidates(candidates_path)
+    if candidates is None:
+        return None
+    count = len(candidates["candidates"])
+    if selection in ("next", "previous"):
+        index = (candidates.get("index", 0) + (1 if selection == "next" else -1)) % count
+    elif selection.isdigit() and 1 <= int(selection) <= count:
+        index = int(selection) - 1
+    else:
+        return None
+    candidates["index"] = index
+    write_candidates(candidates_path, candidates)
+    commit_msg_filename.write_text(candidates["candidates"][index], encoding="utf-8")
+    return candidates["candidates"][index]
+
+
 def main() -> int:
-    """Hook entry point."""
+    """Hook entry point - the hook runs in the daemon if it's running, in-process otherwise (always with `--profile`)."""
+    profile_args = profiler.get_args(sys.argv[1:])
+    if profile_args.profile:
+        return profiler.run(lambda: int(ChatGptCommitMessage()()), "chatgpt-commit-message", profile_args.profile_output)
+    exit_code = daemon.forward(["--hook", "chatgpt-commit-message", *sys.argv[1:]])
+    if exit_code is not None:
+        return exit_code
     chatgpt_commit_message = ChatGptCommitMessage()
     return int(chatgpt_commit_message())
 
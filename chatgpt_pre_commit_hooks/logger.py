@@ -10,6 +10,10 @@ class Logger:
         """Initialize logger."""
         self.logger = logging.getLogger(name)
         self.logger.setLevel(level)
+        # the same logger is set up again by every hook run of a daemon process
+        for handler in self.logger.handlers[:]:
+            self.logger.removeHandler(handler)
+            handler.close()
         formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
         console_handler = logging.StreamHandler()
         console_handler.setLevel(level)
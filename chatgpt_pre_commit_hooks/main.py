@@ -2,17 +2,30 @@
 """Base entry point module."""
 import argparse
 import logging
+import sys
+from pathlib import Path
+from typing import Union
 
-from chatgpt_pre_commit_hooks.base import FAIL
-from chatgpt_pre_commit_hooks.hook_chatgpt_commit_message import ChatGptCommitMessage
+from chatgpt_pre_commit_hooks import daemon, profiler
+from chatgpt_pre_commit_hooks.base import FAIL, PASS
+from chatgpt_pre_commit_hooks.hook_chatgpt_commit_message import get_candidates_path, pick_candidate, read_candidates
 from chatgpt_pre_commit_hooks.logger import Logger
+from chatgpt_pre_commit_hooks.metrics import get_default_path, get_stats
+from chatgpt_pre_commit_hooks.runner import get_hook_names, run_hooks
+from chatgpt_pre_commit_hooks.utils import Utils
 
 
 def get_args() -> tuple[argparse.Namespace, list[str]]:
     """Get input arguments."""
     parser = argparse.ArgumentParser(prog="chatgpt-pre-commit-hooks-wrapper")
-    parser.add_argument("--hook", type=str.lower, default=None, required=False)  # args.hook
+    parser.add_argument("--hook", type=str.lower, action="append", default=None, required=False)  # args.hook
     parser.add_argument("--log-level", choices=[key.lower() for key in logging._nameToLevel], default="error", required=False)  # args.log_level  # noqa: SLF001
+    parser.add_argument("--daemon", choices=["start", "stop", "status", "run"], default=None, required=False)  # args.daemon
+    parser.add_argument("--daemon-idle-timeout", type=float, default=daemon.DAEMON_IDLE_TIMEOUT)  # args.daemon_idle_timeout
+    parser.add_argument("--no-daemon", action="store_true", default=False)  # args.no_daemon
+    parser.add_argument("--stats", nargs="?", type=Path, const=True, default=None, required=False)  # args.stats
+    parser.add_argument("--pick", nargs="?", type=str.lower, const="next", default=None, required=False)  # args.pick
+    profiler.add_arguments(parser)  # args.profile, args.profile_output
     args, unparsed = parser.parse_known_args()
     return args, unparsed
 
@@ -22,19 +35,80 @@ def set_logger(level: str) -> logging.Logger:
     return Logger(__name__, logging.getLevelName(level.upper())).logger
 
 
-def main() -> int:
-    """TODO."""
+def run_hook() -> int:
+    """Run hooks of the current arguments in-process."""
     args, unparsed = get_args()
     log = set_logger(args.log_level)
     log.debug(f"ARGS_MAIN: {args}")
     log.debug(f"ARGS_MAIN_UNPARSED: {unparsed}")
-    if args.hook == "chatgpt-commit-message":
-        hook_return = ChatGptCommitMessage()()
-    else:
-        log.error(f"Unknown hook: {args.hook}")
-        hook_return = FAIL
+    return run_hooks(get_hook_names(args.hook), log)
+
+
+def run_daemon_command(command: str, idle_timeout: float, log: logging.Logger) -> int:
+    """Run daemon command - start, stop, status or run (in foreground)."""
+    if command == "run":
+        return daemon.serve(run_hook, idle_timeout)
+    if command == "start":
+        if not daemon.start(idle_timeout):
+            log.error("Daemon did not start")
+            return FAIL
+    elif command == "stop":
+        daemon.stop()
+    status = daemon.get_status()
+    sys.stdout.write(f"{daemon.get_socket_path()}: {status if status is not None else 'not running'}\n")
+    return PASS
+
+
+def print_stats(path: Union[Path, bool], log: logging.Logger) -> int:
+    """Print p50/p95 of metrics recorded in the JSON lines file (default one of the current git repository)."""
+    if isinstance(path, bool):
+        git_dir = Utils().cmd_output(["git", "rev-parse", "--git-dir"])
+        path = get_default_path(Path(git_dir) if git_dir else None) or Path()
+    if not path.is_file():
+        log.error(f"No metrics recorded in {path} - enable them with --metrics jsonl")
+        return FAIL
+    sys.stdout.write(get_stats(path))
+    return PASS
+
+
+def pick_commit_message(selection: str, log: logging.Logger) -> int:
+    """Pick candidate commit message - next, previous, the number of it, or list them - without any request."""
+    git_dir = Utils().cmd_output(["git", "rev-parse", "--git-dir"])
+    if not git_dir:
+        log.error("Not a git repository")
+        return FAIL
+    commit_msg_filename = Path(git_dir).joinpath("COMMIT_EDITMSG")
+    if selection == "list":
+        candidates = read_candidates(get_candidates_path(commit_msg_filename))
+        if candidates is None:
+            log.error(f"No candidates stored next to {commit_msg_filename} - generate them with --candidates")
+            return FAIL
+        for index, candidate in enumerate(candidates["candidates"]):
+            marker = "*" if index == candidates.get("index", 0) else " "
+            sys.stdout.write(f"{marker} {index + 1}: {candidate.strip()}\n\n")
+        return PASS
+    commit_msg = pick_candidate(commit_msg_filename, selection)
+    if commit_msg is None:
+        log.error(f"No candidate {selection} stored next to {commit_msg_filename} - generate them with --candidates")
+        return FAIL
+    sys.stdout.write(commit_msg.rstrip("\n") + "\n")
+    return PASS
+
+
+def main() -> int:
+    """Entry point - the hook runs in the daemon if it's running, in-process otherwise (always with `--profile`)."""
+    args, _ = get_args()
+    if args.daemon is not None:
+        return run_daemon_command(args.daemon, args.daemon_idle_timeout, set_logger(args.log_level))
+    if args.stats is not None:
+        return print_stats(args.stats, set_logger(args.log_level))
+    if args.pick is not None:
+        return pick_commit_message(args.pick, set_logger(args.log_level))
+    if args.profile:
+        return profiler.run(run_hook, ",".join(get_hook_names(args.hook)) or "chatgpt-pre-commit-hooks", args.profile_output)
 
-    return int(hook_return)
+    exit_code = daemon.forward(sys.argv[1:])
+    return run_hook() if exit_code is None else exit_code
 
 
 if __name__ == "__main__":
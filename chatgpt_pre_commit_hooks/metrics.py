@@ -0,0 +1,180 @@
+"""``metrics``.
+
+A module containing per-run timing spans, token counts and outcomes of hooks, and their sinks.
+
+Sinks are set with `--metrics` as a comma-separated list of:
+
+- `jsonl` - JSON lines appended to `.git/chatgpt-pre-commit-hooks/metrics.jsonl`
+- `jsonl:<path>` - JSON lines appended to the file
+- `statsd` or `statsd:<host>:<port>` - StatsD timers and counters over UDP (`127.0.0.1:8125` by default)
+"""
+
+import json
+import logging
+import math
+import socket
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Optional, Union
+
+METRICS_FILE_NAME = "metrics.jsonl"
+STATSD_HOST = "127.0.0.1"
+STATSD_PORT = 8125
+STATSD_PREFIX = "chatgpt_pre_commit_hooks"
+
+_current: ContextVar[Optional["Metrics"]] = ContextVar("chatgpt_pre_commit_hooks_metrics", default=None)
+
+
+class Metrics:
+    """Metrics of a single hook run - timing spans in ms, counts and the outcome.
+
+    Recording is a no-op without sinks, so the hooks don't pay for what is not collected.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        hook: Optional[str],
+        sinks: Optional[str],
+        git_dir: Optional[Path],
+        start: Optional[float] = None,
+        log: Optional[logging.Logger] = None,
+    ) -> None:
+        """Initialize metrics - the run starts at `start` (`time.perf_counter()`), now if not set."""
+        self.hook = hook
+        self.sinks = [sink.strip() for sink in sinks.split(",") if sink.strip()] if sinks else []
+        self.git_dir = git_dir
+        self.log = log or logging.getLogger(__name__)
+        self.start = time.perf_counter() if start is None else start
+        self.spans: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        self.tags: dict[str, Union[str, int, float, bool, None]] = {}
+        self.outcome: Optional[str] = None
+        self.__emitted = False
+
+    @property
+    def enabled(self) -> bool:
+        """Check if any sink is set."""
+        return bool(self.sinks)
+
+    def activate(self) -> None:
+        """Make the metrics current - recorded by code without access to the hook (e.g. the HTTP client)."""
+        _current.set(self)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the block - durations of the same span are summed up."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, (time.perf_counter() - start) * 1000)
+
+    def add_span(self, name: str, duration_ms: float) -> None:
+        """Add duration to the span."""
+        if self.enabled:
+            self.spans[name] = self.spans.get(name, 0.0) + duration_ms
+
+    def mark(self, name: str, since: float) -> None:
+        """Record time elapsed from `since` (`time.perf_counter()`) - the first mark of the name wins."""
+        if self.enabled and name not in self.spans:
+            self.spans[name] = (time.perf_counter() - since) * 1000
+
+    def add_count(self, name: str, value: int) -> None:
+        """Add value to the count."""
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def set_outcome(self, outcome: str) -> None:
+        """Set outcome of the run (the first one wins), e.g. `skip_keyword`, `cache_hit`, `ok`."""
+        if self.outcome is None:
+            self.outcome = outcome
+
+    def get_record(self) -> dict[str, Any]:
+        """Get record of the run."""
+        return {
+            "time": round(time.time(), 3),
+            "hook": self.hook,
+            "outcome": self.outcome,
+            "spans_ms": {"total": round((time.perf_counter() - self.start) * 1000, 3), **{name: round(value, 3) for name, value in self.spans.items()}},
+            "counts": self.counts,
+            "tags": self.tags,
+        }
+
+    def emit(self) -> None:
+        """Write the record to all sinks (once) - failing sinks are logged and skipped."""
+        if not self.enabled or self.__emitted:
+            return
+        self.__emitted = True
+        record = self.get_record()
+        self.log.debug(f"METRICS: {record}")
+        for sink in self.sinks:
+            try:
+                if sink == "jsonl" or sink.startswith("jsonl:"):
+                    self.__emit_jsonl(record, sink.split(":", 1)[1] if ":" in sink else None)
+                elif sink == "statsd" or sink.startswith("statsd:"):
+                    self.__emit_statsd(record, sink.split(":", 1)[1] if ":" in sink else None)
+                else:
+                    self.log.warning(f"METRICS: unknown sink {sink}")
+            except OSError as err:
+                self.log.warning(f"METRICS: can't write to {sink} - {err}")
+
+    def __emit_jsonl(self, record: dict[str, Any], path: Optional[str]) -> None:
+        """Append record to the JSON lines file."""
+        file_path = Path(path) if path else get_default_path(self.git_dir)
+        if file_path is None:
+            self.log.debug("METRICS: jsonl sink disabled - not a git repository")
+            return
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with file_path.open("at", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+
+    def __emit_statsd(self, record: dict[str, Any], address: Optional[str]) -> None:
+        """Send record as StatsD timers (spans) and counters (counts and the outcome) in a single datagram."""
+        host, _, port = (address or "").rpartition(":")
+        prefix = f"{STATSD_PREFIX}.{(self.hook or 'unknown').replace('-', '_')}"
+        lines = [f"{prefix}.{name}:{value}|ms" for name, value in record["spans_ms"].items()]
+        lines += [f"{prefix}.{name}:{value}|c" for name, value in record["counts"].items()]
+        lines.append(f"{prefix}.outcome.{record['outcome'] or 'unknown'}:1|c")
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as connection:
+            connection.sendto("\n".join(lines).encode("utf-8"), (host or STATSD_HOST, int(port) if port else STATSD_PORT))
+
+
+def get_current() -> Optional[Metrics]:
+    """Get metrics of the current hook run (if any)."""
+    return _current.get()
+
+
+def get_default_path(git_dir: Optional[Path]) -> Optional[Path]:
+    """Get default path of the JSON lines file (under `.git/`)."""
+    return git_dir.joinpath("chatgpt-pre-commit-hooks", METRICS_FILE_NAME) if git_dir is not None else None
+
+
+def get_percentile(values: list[float], percentile: float) -> float:
+    """Get percentile of the values (nearest rank)."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percentile / 100 * len(ordered)) - 1, 0)]
+
+
+def get_stats(path: Path) -> str:
+    """Get p50/p95 report of spans and counts, and the outcomes, of runs recorded in the JSON lines file."""
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    spans: dict[str, list[float]] = {}
+    counts: dict[str, list[float]] = {}
+    outcomes: dict[str, int] = {}
+    for record in records:
+        for name, value in record.get("spans_ms", {}).items():
+            spans.setdefault(name, []).append(value)
+        for name, value in record.get("counts", {}).items():
+            counts.setdefault(name, []).append(value)
+        outcome = record.get("outcome") or "unknown"
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    lines = [f"{len(records)} runs recorded in {path}", "", f"{'span (ms) / count':<28} {'runs':>6} {'p50':>10} {'p95':>10}"]
+    for name, values in [*sorted(spans.items()), *sorted(counts.items())]:
+        lines.append(f"{name:<28} {len(values):>6} {get_percentile(values, 50):>10.1f} {get_percentile(values, 95):>10.1f}")
+    lines += ["", f"{'outcome':<28} {'runs':>6}"]
+    lines += [f"{name:<28} {count:>6}" for name, count in sorted(outcomes.items())]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,254 @@
+"""``profiler``.
+
+A module containing the profiler of a single invocation of the hooks (`--profile`).
+
+The report is a single zip file, which can be attached to issues:
+
+- `report.txt` - wall time, timings of subprocesses, tiktoken encoding and network phases of requests, and the top functions
+- `profile.pstats` - cProfile stats of the invoking thread, e.g. for `python -m pstats` or snakeviz
+- `stacks.collapsed` - stacks sampled in all threads, in the collapsed format of flamegraph.pl and speedscope
+
+Only code locations, sizes and timings are recorded - never the diff, the prompt or the response. Arguments of
+subprocesses and of the invocation are redacted to their option names.
+"""
+
+import argparse
+import contextlib
+import os
+import re
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+PROFILE_DIR_NAME = "profiles"
+# profiles kept in the default directory, the oldest ones are removed
+PROFILE_KEEP = 20
+# name of reports written to the default directory - `{name}-{date}-{time}-{pid}.zip`
+PROFILE_NAME_PATTERN = re.compile(r".+-\d{8}-\d{6}-\d+\.zip")
+# interval of stack samples in seconds
+SAMPLE_INTERVAL = 0.005
+# functions listed in the report, by cumulative time
+TOP_FUNCTIONS = 40
+REDACTED = "…"
+
+_active: Optional["Profiler"] = None
+_inactive = contextlib.nullcontext()
+
+
+class Profiler:
+    """Profile of a single invocation - cProfile of the invoking thread, stacks sampled in all threads, and timed events."""
+
+    def __init__(self, name: str) -> None:
+        """Initialize profiler of the entry point `name`."""
+        self.name = name
+        # (category, name) -> durations in ms
+        self.events: dict[tuple[str, str], list[float]] = {}
+        # network phases of requests, in ms
+        self.requests: list[dict[str, Any]] = []
+        # collapsed stack -> samples
+        self.stacks: dict[str, int] = {}
+        self.samples = 0
+        self.duration_ms = 0.0
+        self.__start = 0.0
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__sampler: Optional[threading.Thread] = None
+        self.__profile: Any = None
+
+    def start(self) -> None:
+        """Start profiling - the invoking thread with cProfile, all threads with the sampler."""
+        import cProfile
+
+        global _active  # noqa: PLW0603
+        _active = self
+        self.__start = time.perf_counter()
+        self.__sampler = threading.Thread(target=self.__sample, name="chatgpt-pre-commit-hooks-profiler", daemon=True)
+        self.__sampler.start()
+        self.__profile = cProfile.Profile()
+        self.__profile.enable()
+
+    def stop(self) -> None:
+        """Stop profiling."""
+        global _active  # noqa: PLW0603
+        self.__profile.disable()
+        self.duration_ms = (time.perf_counter() - self.__start) * 1000
+        self.__stopped.set()
+        if self.__sampler is not None:
+            self.__sampler.join()
+        _active = None
+
+    def add_event(self, category: str, name: str, duration_ms: float) -> None:
+        """Add duration of the event, e.g. a subprocess."""
+        with self.__lock:
+            self.events.setdefault((category, name), []).append(duration_ms)
+
+    def add_request(self, method: str, host: str) -> dict[str, Any]:
+        """Add request - its network phases are filled in the returned record."""
+        request: dict[str, Any] = {"method": method, "host": host, "dns": None, "connect": None, "ttfb": None, "body": None, "bytes": 0, "status": None}
+        with self.__lock:
+            self.requests.append(request)
+        return request
+
+    def write(self, path: Path) -> Path:
+        """Write the report zip file."""
+        import io
+        import marshal
+        import pstats
+        import zipfile
+
+        top_functions = io.StringIO()
+        stats = pstats.Stats(self.__profile, stream=top_functions)
+        stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("report.txt", self.get_report() + top_functions.getvalue())
+            # format of `pstats.Stats.dump_stats`
+            archive.writestr("profile.pstats", marshal.dumps(stats.stats))  # type: ignore  # noqa: PGH003
+            archive.writestr("stacks.collapsed", "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items())))
+        return path
+
+    def get_report(self) -> str:
+        """Get report of timings - without the top functions."""
+        import platform
+
+        lines = [
+            f"profile of {self.name}: {' '.join(redact_command(sys.argv))}",
+            f"python {platform.python_version()} on {platform.platform()}",
+            f"wall time {self.duration_ms:.1f} ms, {self.samples} stack samples every {SAMPLE_INTERVAL * 1000:g} ms",
+        ]
+        categories: dict[str, list[tuple[str, list[float]]]] = {}
+        for (category, name), durations in sorted(self.events.items(), key=lambda item: -sum(item[1])):
+            categories.setdefault(category, []).append((name, durations))
+        for category, events in categories.items():
+            lines += ["", f"{category:<60} {'calls':>6} {'total ms':>10} {'max ms':>10}"]
+            lines += [f"{name[:60]:<60} {len(durations):>6} {sum(durations):>10.1f} {max(durations):>10.1f}" for name, durations in events]
+        if self.requests:
+            lines += ["", f"{'requests':<40} {'dns ms':>8} {'connect ms':>10} {'ttfb ms':>8} {'body ms':>8} {'bytes':>8} {'status':>7}"]
+            for request in self.requests:
+                dns, connect, ttfb, body = (f"{request[phase]:.1f}" if request[phase] is not None else "-" for phase in ("dns", "connect", "ttfb", "body"))
+                name = f"{request['method']} {request['host']}"
+                lines.append(f"{name:<40} {dns:>8} {connect:>10} {ttfb:>8} {body:>8} {request['bytes']:>8} {request['status'] or '-':>7}")
+            lines.append("dns and connect are empty for reused connections, connect includes the TLS handshake, ttfb is measured from the connection to the response headers")
+        return "\n".join(lines) + "\n\ntop functions of the invoking thread (cProfile)\n"
+
+    def __sample(self) -> None:
+        """Sample stacks of all threads every SAMPLE_INTERVAL seconds - except the sampler."""
+        sampler = threading.get_ident()
+        while not self.__stopped.wait(SAMPLE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():  # noqa: SLF001
+                if ident == sampler:
+                    continue
+                labels = []
+                current: Any = frame
+                while current is not None:
+                    labels.append(get_frame_label(current))
+                    current = current.f_back
+                stack = ";".join([names.get(ident, str(ident)), *reversed(labels)])
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+
+def get_active() -> Optional[Profiler]:
+    """Get profiler of the current invocation (if any)."""
+    return _active
+
+
+def timed(category: str, name: Union[str, list[str]]) -> contextlib.AbstractContextManager[Any]:
+    """Time the block as an event of the active profiler - a no-op if there is none. Commands (lists) are redacted."""
+    if _active is None:
+        return _inactive
+    return _time(_active, category, " ".join(redact_command(name)) if isinstance(name, list) else name)
+
+
+@contextlib.contextmanager
+def _time(profiler: Profiler, category: str, name: str) -> Iterator[None]:
+    """Time the block as an event of the profiler."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.add_event(category, name, (time.perf_counter() - start) * 1000)
+
+
+def redact_command(commands: list[str]) -> list[str]:
+    """Redact command - the program, git subcommand and option names are kept, values and other arguments (paths, revisions, messages) are not."""
+    redacted = []
+    for index, command in enumerate(commands):
+        if command.startswith("-"):
+            name, separator, _ = command.partition("=")
+            redacted.append(f"{name}={REDACTED}" if separator else name)
+        elif index == 0:
+            redacted.append(Path(command).name)
+        elif index == 1 and redacted[0] == "git":
+            redacted.append(command)
+        elif not redacted or redacted[-1] != REDACTED:
+            redacted.append(REDACTED)
+    return redacted
+
+
+def get_frame_label(frame: Any) -> str:  # noqa: ANN401
+    """Get label of the stack frame - function, file and line of its definition."""
+    code = frame.f_code
+    path = Path(code.co_filename)
+    return f"{code.co_name} ({path.parent.name}/{path.name}:{code.co_firstlineno})"
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add profiling arguments - `--profile` (or `CHATGPT_PRE_COMMIT_HOOKS_PROFILE`) and `--profile-output`."""
+    enabled = os.environ.get("CHATGPT_PRE_COMMIT_HOOKS_PROFILE", "").lower() in ("1", "true", "yes")
+    parser.add_argument("--profile", action=argparse.BooleanOptionalAction, default=enabled)  # args.profile
+    parser.add_argument("--profile-output", type=Path, default=None, required=False)  # args.profile_output
+
+
+def get_args(argv: list[str]) -> argparse.Namespace:
+    """Get profiling arguments of the command line - before the hook parses the rest of them."""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_arguments(parser)
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
+def get_default_dir() -> Optional[Path]:
+    """Get default directory of profiles - under `.git/` of the current repository, `None` outside of it."""
+    from chatgpt_pre_commit_hooks.utils import Utils
+
+    git_dir = Utils().cmd_output(["git", "rev-parse", "--git-dir"])
+    return Path(git_dir).joinpath("chatgpt-pre-commit-hooks", PROFILE_DIR_NAME) if git_dir else None
+
+
+def prune(directory: Path) -> None:
+    """Remove the oldest reports of the profiles directory - only files named like reports, keeping the PROFILE_KEEP - 1 newest ones."""
+    reports = [path for path in directory.glob("*.zip") if PROFILE_NAME_PATTERN.fullmatch(path.name)]
+    for stale_path in sorted(reports, key=lambda item: item.stat().st_mtime)[: 1 - PROFILE_KEEP]:
+        stale_path.unlink(missing_ok=True)
+
+
+def run(function: Callable[[], int], name: str, output: Optional[Path] = None) -> int:
+    """Run the entry point under the profiler and write the report.
+
+    Args:
+    function: entry point, returning the exit code.
+    name: name of the entry point, e.g. the hook id.
+    output: path of the report, a timestamped file of the default directory (or the current directory outside of a repository) if not set.
+
+    Returns:
+    Get `int` exit code of the function.
+    """
+    profiler = Profiler(name)
+    profiler.start()
+    try:
+        return function()
+    finally:
+        profiler.stop()
+        path = output
+        if path is None:
+            directory = get_default_dir()
+            path = (directory or Path()).joinpath(f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.zip")
+            # only the dedicated directory is pruned - never the current directory
+            if directory is not None and directory.is_dir():
+                prune(directory)
+        sys.stderr.write(f"Profile written to {profiler.write(path)}\n")
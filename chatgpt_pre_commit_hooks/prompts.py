@@ -0,0 +1,101 @@
+"""``prompts``.
+
+A module containing the prompt templates of the hooks.
+
+Prompts are laid out from the most to the least stable part, so that providers caching shared prompt prefixes
+hit on every run: the system message is a byte-identical prefix of instructions and conventions, independent
+of any argument, followed by the user message of the rules selected by arguments, the diff and the user's
+commit message.
+"""
+
+from typing import Optional
+
+# commit message - the system message never changes, rules of arguments are sent with the diff
+COMMIT_MESSAGE_SYSTEM = [
+    "You are a software engineer assistant to write a 'Commit message with scope'.",
+    "You aim to suggest a clean commit message in the 'Conventional Commits' convention.",
+    "Types of the convention are: feat, fix, docs, style, refactor, perf, test, build, ci, chore and revert.",
+    "You will get an output from the 'git diff --staged' or 'git diff --staged --stat' command, and you will suggest a commit message.",
+    "The diff is preceded by the 'RULES:' of this commit message, which you must follow.",
+    "If the user has already specified the commit message, please consider it as a suggestion if applicable.",
+    "Do not include user message itself in the final commit message and do not put any note why.",
+    "The user's message starts after the 'USER-MESSAGE:'.",
+    "Use the present tense.",
+    "Lines must be at most 72 characters.",
+]
+# rules of flag arguments: argument -> (rules if set, rules if not set)
+COMMIT_MESSAGE_RULES = {
+    "emoji": (
+        ["Use the 'GitMoji convention' to preface the commit with the UNICODE characters format.", "Do not use shortcode representation."],
+        ["Do not preface the commit message with anything."],
+    ),
+    "description": (
+        [
+            "Add a short description to the commit message in the body section of why these changes were made.",
+            'Omit "This commit" at the beginning - briefly describe changes.',
+            "Each sentence of the description should be in new line.",
+        ],
+        ["Do not describe changes; just simply output without any explanation - the final commit message MUST have only one line!"],
+    ),
+}
+
+# map-reduce summarization of large diffs
+MAP_PROMPT = [
+    "You are a software engineer assistant summarizing a part of a large 'git diff --staged' output.",
+    "Summarize the changes in at most five short bullet points, mentioning the affected files and the purpose of the changes.",
+    "Do not write a commit message and do not add any introduction.",
+]
+REDUCE_HEADER = "The 'git diff --staged' output is too large; below are summaries of its parts instead."
+
+# incremental summarization - per-hunk summaries kept in an index under `.git/`
+INCREMENTAL_PROMPT = [
+    "You are a software engineer assistant summarizing numbered hunks of a large 'git diff --staged' output.",
+    "Reply with exactly one line per hunk in the form '<number>: <summary>', where the summary is a short sentence about the purpose of the change.",
+    "Do not write a commit message and do not add any introduction.",
+]
+INCREMENTAL_HEADER = "The 'git diff --staged' output is too large; below are summaries of its hunks instead."
+
+
+class PromptTemplate:
+    """Prompt of a stable system message (the cacheable prefix) and a volatile user message.
+
+    The user message is made of the rules of flag arguments, the diff and the user's commit message - in this order,
+    so that runs with the same arguments share the rules as well.
+    """
+
+    def __init__(self, system: list[str], rules: dict[str, tuple[list[str], list[str]]]) -> None:
+        """Initialize template.
+
+        Args:
+        system: sentences of the system message.
+        rules: flag argument -> (rules if set, rules if not set).
+        """
+        self.system = " ".join(system)
+        self.rules = rules
+
+    def get_rules(self, flags: dict[str, bool]) -> str:
+        """Get rules of the flag arguments, in the order of the template."""
+        rules = [rule for name, (rules_set, rules_not_set) in self.rules.items() for rule in (rules_set if flags.get(name) else rules_not_set)]
+        return f"RULES: {' '.join(rules)}"
+
+    def get_messages(self, flags: dict[str, bool], diff: str, user_message: Optional[str]) -> list[dict[str, str]]:
+        """Get prompt messages.
+
+        Args:
+        flags: flag arguments selecting the rules.
+        diff: diff of the changes (or its summaries).
+        user_message: commit message specified by the user, `None` if not specified.
+
+        Returns:
+        Get `list[dict[str, str]]` the system message (prefix) and the user message (suffix).
+        """
+        user = [self.get_rules(flags), diff]
+        if user_message is not None:
+            user.append(f"USER-MESSAGE: {user_message}")
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": "\n\n".join(user)},
+        ]
+
+
+COMMIT_MESSAGE_TEMPLATE = PromptTemplate(COMMIT_MESSAGE_SYSTEM, COMMIT_MESSAGE_RULES)
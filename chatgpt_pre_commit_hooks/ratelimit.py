@@ -0,0 +1,190 @@
+"""``ratelimit``.
+
+A module containing the client-side rate limiter shared by all processes of the host.
+
+Requests and tokens are scheduled with two token buckets per endpoint, API key and model - the same keys OpenAI
+limits on. Their state is a small JSON file in the user cache directory, read and written under an exclusive
+file lock, so concurrent hooks, CI jobs and the daemon take turns instead of colliding into 429 responses.
+Limits are learned from the `x-ratelimit-*` response headers (or set with `--openai-rate-limit-rpm` and
+`--openai-rate-limit-tpm`), and a request reserves its cost up front - the prompt tokens and max tokens of the
+completion, as OpenAI counts them - waiting until the buckets are refilled if they are exhausted.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections.abc import Iterator, Mapping
+from pathlib import Path
+from typing import IO, Any, Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows, locked within the process only
+    fcntl = None  # type: ignore  # noqa: PGH003
+
+# limits are per minute
+WINDOW = 60.0
+# max wait before a request, longer waits are left to the retries of 429 responses
+MAX_WAIT = 60.0
+RESET_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+RESET_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+BUCKETS = ["requests", "tokens"]
+
+_lock = threading.Lock()
+
+
+def get_state_dir() -> Path:
+    """Get per-user directory of rate limiter states (`CHATGPT_PRE_COMMIT_HOOKS_RATE_LIMIT_DIR` if set)."""
+    if os.environ.get("CHATGPT_PRE_COMMIT_HOOKS_RATE_LIMIT_DIR"):
+        return Path(os.environ["CHATGPT_PRE_COMMIT_HOOKS_RATE_LIMIT_DIR"])
+    base_dir = Path(os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache"))
+    return base_dir.joinpath("chatgpt-pre-commit-hooks", "ratelimit")
+
+
+def get_state_path(api_base: str, api_key: Optional[str], model: str) -> Path:
+    """Get path of the rate limiter state of the endpoint, API key and model - the key is hashed, never stored."""
+    key = hashlib.sha256("\0".join([api_base, api_key or "", model]).encode("utf-8")).hexdigest()[:32]
+    return get_state_dir().joinpath(f"{key}.json")
+
+
+def parse_reset(value: str) -> Optional[float]:
+    """Parse reset duration of `x-ratelimit-reset-*` headers, e.g. `20ms`, `1s` or `6m0s`, into seconds."""
+    parts = RESET_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * RESET_UNITS[unit] for number, unit in parts)
+
+
+class RateLimiter:
+    """Token buckets of requests and tokens per minute, shared between processes through a locked state file."""
+
+    def __init__(
+        self,
+        path: Path,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        log: Optional[logging.Logger] = None,
+    ) -> None:
+        """Initialize rate limiter.
+
+        Args:
+        path: path of the state file.
+        requests_per_minute: limit of requests, learned from response headers if not set.
+        tokens_per_minute: limit of tokens, learned from response headers if not set.
+        log: logger.
+        """
+        self.path = path
+        self.limits = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.log = log or logging.getLogger(__name__)
+
+    @property
+    def key(self) -> tuple[Any, ...]:
+        """Get key of the limiter - clients with the same key share it."""
+        return (str(self.path), self.limits["requests"], self.limits["tokens"])
+
+    def acquire(self, get_tokens: Callable[[], int]) -> float:
+        """Reserve a request and its tokens.
+
+        Args:
+        get_tokens: function returning tokens of the request - called only if the token limit is known.
+
+        Returns:
+        Get `float` seconds to wait before sending the request (0 if the buckets are not exhausted).
+        """
+        with self.__state() as state:
+            now = time.time()
+            limits = self.__get_limits(state)
+            wait = max(state.get("blocked_until", 0.0) - now, 0.0)
+            for bucket, limit in limits.items():
+                if limit is None or limit <= 0:
+                    continue
+                cost = 1 if bucket == "requests" else get_tokens()
+                available = self.__refill(state, bucket, limit, now) - cost
+                state[bucket] = available
+                if available < 0:
+                    wait = max(wait, -available * WINDOW / limit)
+            state["updated"] = now
+        wait = min(wait, MAX_WAIT)
+        if wait > 0:
+            self.log.debug(f"RATE_LIMIT: waiting {wait:.2f}s - {self.path.stem}")
+        return wait
+
+    def update(self, headers: Mapping[str, str], status: int) -> None:
+        """Adjust the buckets to the `x-ratelimit-*` headers of a response - limits, remaining requests and tokens, and their reset on 429."""
+        values = {name.lower(): value for name, value in headers.items() if name.lower().startswith("x-ratelimit-") or name.lower() == "retry-after"}
+        if not values:
+            return
+        with self.__state() as state:
+            now = time.time()
+            for bucket in BUCKETS:
+                limit = values.get(f"x-ratelimit-limit-{bucket}", "")
+                if limit.isdigit():
+                    state.setdefault("limits", {})[bucket] = int(limit)
+            for bucket, limit in self.__get_limits(state).items():
+                if limit is not None and limit > 0:
+                    state[bucket] = self.__refill(state, bucket, limit, now)
+                remaining = values.get(f"x-ratelimit-remaining-{bucket}", "")
+                if remaining.isdigit():
+                    # the server is authoritative, but doesn't know about requests reserved in the meantime
+                    state[bucket] = min(float(state.get(bucket, remaining)), float(remaining))
+            if status == 429:  # noqa: PLR2004
+                self.__block(state, values, now)
+            state["updated"] = now
+        self.log.debug(f"RATE_LIMIT: {values}")
+
+    def __block(self, state: dict[str, Any], values: dict[str, str], now: float) -> None:
+        """Block all requests after a 429 response - until `retry-after`, or the reset of the limits if they are unknown (the buckets wait otherwise)."""
+        names = ["retry-after"] if "retry-after" in values or all(self.__get_limits(state).values()) else ["x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"]
+        resets = [reset for reset in (parse_reset(values[name]) for name in names if name in values) if reset is not None]
+        if not resets:
+            return
+        state["blocked_until"] = max(state.get("blocked_until", 0.0), now + min(max(resets), MAX_WAIT))
+        self.log.debug(f"RATE_LIMIT: rate limited for {max(resets):.2f}s - {self.path.stem}")
+
+    def __get_limits(self, state: dict[str, Any]) -> dict[str, Optional[int]]:
+        """Get limits - set ones, learned ones otherwise."""
+        learned = state.get("limits", {})
+        return {bucket: self.limits[bucket] or learned.get(bucket) for bucket in BUCKETS}
+
+    @staticmethod
+    def __refill(state: dict[str, Any], bucket: str, limit: int, now: float) -> float:
+        """Get available amount of the bucket, refilled since the last update - full if it's new."""
+        if bucket not in state:
+            return float(limit)
+        elapsed = max(now - state.get("updated", now), 0.0)
+        return min(float(state[bucket]) + elapsed * limit / WINDOW, float(limit))
+
+    @contextlib.contextmanager
+    def __state(self) -> Iterator[dict[str, Any]]:
+        """Read the state under an exclusive lock of the file, and write it back on exit."""
+        with _lock:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                handle: IO[str] = self.path.open("a+", encoding="utf-8")
+            except OSError as err:
+                # no shared state - the limiter is a no-op
+                self.log.debug(f"RATE_LIMIT_ERROR: {err}")
+                yield {}
+                return
+            with handle:
+                if fcntl is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+                handle.seek(0)
+                try:
+                    state = json.loads(handle.read() or "{}")
+                except ValueError:
+                    state = {}
+                state = state if isinstance(state, dict) else {}
+                yield state
+                handle.seek(0)
+                handle.truncate()
+                handle.write(json.dumps(state))
+                handle.flush()
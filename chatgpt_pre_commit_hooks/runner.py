@@ -0,0 +1,62 @@
+"""``runner``.
+
+A module containing the registry of hooks and the runner of several hooks in a single process.
+
+Hooks of a run share one `context.HookContext` (the `.git` directory, the staged diff and token counts) and the
+memoized OpenAI clients (pooled connections), and independent hooks run concurrently in threads.
+"""
+
+import contextvars
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from chatgpt_pre_commit_hooks.base import FAIL, PASS, ChatGptPreCommitHooks
+from chatgpt_pre_commit_hooks.context import HookContext
+from chatgpt_pre_commit_hooks.hook_chatgpt_commit_message import ChatGptCommitMessage
+
+# hook id -> hook class
+HOOKS: dict[str, type[ChatGptPreCommitHooks]] = {hook.name: hook for hook in [ChatGptCommitMessage] if hook.name is not None}
+
+
+def get_hook_names(values: Optional[list[str]]) -> list[str]:
+    """Get hook ids of `--hook` arguments - repeated or comma-separated, in order and without duplicates."""
+    names = [name.strip().lower() for value in values or [] for name in value.split(",")]
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def run_hooks(names: list[str], log: logging.Logger) -> int:
+    """Run hooks sharing a single context - concurrently if there are more of them.
+
+    Args:
+    names: hook ids.
+    log: logger.
+
+    Returns:
+    Get `int` exit code - FAIL if any of the hooks failed.
+    """
+    unknown = [name for name in names if name not in HOOKS]
+    if not names or unknown:
+        log.error(f"Unknown hook: {', '.join(unknown) or None}")
+        return FAIL
+
+    HookContext().activate()
+    if len(names) == 1:
+        return run_hook(HOOKS[names[0]])
+    with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="chatgpt-pre-commit-hooks") as executor:
+        # every hook runs in a copy of the context - sharing the hook context, but with its own metrics
+        futures = [executor.submit(contextvars.copy_context().run, run_hook, HOOKS[name]) for name in names]
+        exit_codes = [future.result() for future in futures]
+    log.debug(f"HOOKS: {dict(zip(names, exit_codes))}")
+    return FAIL if any(exit_code != PASS for exit_code in exit_codes) else PASS
+
+
+def run_hook(hook: type[ChatGptPreCommitHooks]) -> int:
+    """Run hook - `SystemExit` is converted into the exit code."""
+    try:
+        return int(hook()())
+    except SystemExit as err:
+        if isinstance(err.code, str):
+            sys.stderr.write(f"{err.code}\n")
+        return err.code if isinstance(err.code, int) else int(err.code is not None)
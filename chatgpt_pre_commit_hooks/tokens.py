@@ -0,0 +1,200 @@
+"""``tokens``.
+
+A module containing the process-wide tiktoken encoder registry and token counting.
+"""
+
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Union
+
+from chatgpt_pre_commit_hooks import profiler
+
+if TYPE_CHECKING:
+    import tiktoken
+
+log = logging.getLogger(__name__)
+
+# ref: https://platform.openai.com/docs/models
+# ref: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+# (model name prefix, encoding, tokens per message, tokens per name, context window) - the longest matching prefix wins
+# o200k_base isn't known to the pinned tiktoken (<0.5) - its models are counted with ENCODING_FALLBACK, close enough for budgets
+MODEL_SPECS = [
+    ("gpt-3.5-turbo-0301", "cl100k_base", 4, -1, 4096),
+    ("gpt-3.5-turbo-0613", "cl100k_base", 3, 1, 4096),
+    ("gpt-3.5-turbo-16k", "cl100k_base", 3, 1, 16384),
+    ("gpt-3.5-turbo-1106", "cl100k_base", 3, 1, 16385),
+    ("gpt-3.5-turbo-0125", "cl100k_base", 3, 1, 16385),
+    ("gpt-3.5-turbo", "cl100k_base", 3, 1, 4096),
+    ("gpt-35-turbo-16k", "cl100k_base", 3, 1, 16384),
+    ("gpt-35-turbo", "cl100k_base", 3, 1, 4096),
+    ("gpt-4-32k", "cl100k_base", 3, 1, 32768),
+    ("gpt-4-1106", "cl100k_base", 3, 1, 128000),
+    ("gpt-4-0125", "cl100k_base", 3, 1, 128000),
+    ("gpt-4-turbo", "cl100k_base", 3, 1, 128000),
+    ("gpt-4-vision", "cl100k_base", 3, 1, 128000),
+    ("gpt-4o", "o200k_base", 3, 1, 128000),
+    ("gpt-4.1", "o200k_base", 3, 1, 1047576),
+    ("gpt-4", "cl100k_base", 3, 1, 8192),
+    ("o1", "o200k_base", 3, 1, 128000),
+    ("o3", "o200k_base", 3, 1, 200000),
+    ("o4-mini", "o200k_base", 3, 1, 200000),
+]
+MODEL_SPEC_DEFAULT = ("", "cl100k_base", 3, 1, 4096)
+ENCODING_FALLBACK = "cl100k_base"
+
+# BPE files of known encodings - tiktoken caches them under sha1(url), see `tiktoken.load.read_file_cached`
+ENCODING_URLS = {
+    "cl100k_base": "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken",
+    "o200k_base": "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+    "p50k_base": "https://openaipublic.blob.core.windows.net/encodings/p50k_base.tiktoken",
+    "r50k_base": "https://openaipublic.blob.core.windows.net/encodings/r50k_base.tiktoken",
+}
+
+# encode in threads only when it pays off
+BATCH_MIN_SIZE = 16
+
+_lock = threading.RLock()
+_encodings: dict[str, Union["tiktoken.Encoding", "ApproximateEncoding"]] = {}
+_counters: dict[str, "TokenCounter"] = {}
+
+
+class ApproximateEncoding:
+    """Offline stand-in for a tiktoken encoding - about four bytes of UTF-8 text per token."""
+
+    name = "approximate"
+
+    def encode_ordinary(self, text: str) -> list[int]:
+        """Get pseudo tokens of the text."""
+        return [0] * ((len(text.encode("utf-8")) + 3) // 4)
+
+    def encode_ordinary_batch(self, texts: list[str]) -> list[list[int]]:
+        """Get pseudo tokens of each text."""
+        return [self.encode_ordinary(text) for text in texts]
+
+
+def get_cache_dir() -> Path:
+    """Get persistent cache directory of BPE files (`TIKTOKEN_CACHE_DIR` if set)."""
+    if os.environ.get("TIKTOKEN_CACHE_DIR"):
+        return Path(os.environ["TIKTOKEN_CACHE_DIR"])
+    if sys.platform == "win32":
+        base_dir = Path(os.environ.get("LOCALAPPDATA", Path.home().joinpath("AppData", "Local")))
+    else:
+        base_dir = Path(os.environ.get("XDG_CACHE_HOME", Path.home().joinpath(".cache")))
+    return base_dir.joinpath("chatgpt-pre-commit-hooks", "tiktoken")
+
+
+def _seed_cache_dir(cache_dir: Path, encoding_name: str) -> None:
+    """Make a pre-downloaded `<encoding_name>.tiktoken` file in the cache directory visible to tiktoken."""
+    url = ENCODING_URLS.get(encoding_name)
+    named_file = cache_dir.joinpath(f"{encoding_name}.tiktoken")
+    if url is None or not named_file.is_file():
+        return
+    cache_file = cache_dir.joinpath(hashlib.sha1(url.encode()).hexdigest())  # noqa: S324
+    if not cache_file.exists():
+        log.debug(f"TIKTOKEN: seeding {cache_file} from {named_file}")
+        shutil.copyfile(named_file, cache_file)
+
+
+def get_encoding(encoding_name: str) -> Union["tiktoken.Encoding", ApproximateEncoding]:
+    """Get memoized encoding - loaded from the persistent cache directory, downloaded once if missing.
+
+    Falls back to an approximate encoding when the BPE file can't be loaded (e.g. offline without a seeded cache).
+    """
+    with _lock:
+        if encoding_name in _encodings:
+            return _encodings[encoding_name]
+
+        import tiktoken
+
+        cache_dir = get_cache_dir()
+        encoding: Union["tiktoken.Encoding", ApproximateEncoding]
+        try:
+            _seed_cache_dir(cache_dir, encoding_name)
+            with profiler.timed("tiktoken", f"load {encoding_name}"), _cache_dir_env(cache_dir):
+                encoding = tiktoken.get_encoding(encoding_name)
+        except ValueError:
+            log.debug(f"TIKTOKEN: unknown encoding {encoding_name} - using {ENCODING_FALLBACK}")
+            encoding = get_encoding(ENCODING_FALLBACK)
+        except Exception as err:  # noqa: BLE001
+            log.warning(f"TIKTOKEN: can't load {encoding_name} ({err.__class__.__name__}) - counting tokens approximately. Put {encoding_name}.tiktoken into {cache_dir}")
+            encoding = ApproximateEncoding()
+
+        _encodings[encoding_name] = encoding
+        return encoding
+
+
+@contextlib.contextmanager
+def _cache_dir_env(cache_dir: Path) -> Iterator[None]:
+    """Set `TIKTOKEN_CACHE_DIR` (read by tiktoken when loading a BPE file) to the cache directory while loading - restored afterwards."""
+    previous = os.environ.get("TIKTOKEN_CACHE_DIR")
+    os.environ["TIKTOKEN_CACHE_DIR"] = str(cache_dir)
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ["TIKTOKEN_CACHE_DIR"]
+        else:
+            os.environ["TIKTOKEN_CACHE_DIR"] = previous
+
+
+def get_model_spec(model: str) -> tuple[str, str, int, int, int]:
+    """Get spec of the model - the longest matching model name prefix wins."""
+    matches = [spec for spec in MODEL_SPECS if model.startswith(spec[0])]
+    if not matches:
+        log.debug(f"MODEL_SPEC: unknown model {model} - using defaults {MODEL_SPEC_DEFAULT}")
+        return MODEL_SPEC_DEFAULT
+    return max(matches, key=lambda spec: len(spec[0]))
+
+
+class TokenCounter:
+    """Token counter of a model."""
+
+    def __init__(self, model: str) -> None:
+        """Initialize counter - the encoding is loaded on first use."""
+        self.model = model
+        _, self.encoding_name, self.tokens_per_message, self.tokens_per_name, self.context_window = get_model_spec(model)
+        self.__encoding: Optional[Union["tiktoken.Encoding", ApproximateEncoding]] = None
+
+    @property
+    def encoding(self) -> Union["tiktoken.Encoding", ApproximateEncoding]:
+        """Get encoding of the model."""
+        if self.__encoding is None:
+            self.__encoding = get_encoding(self.encoding_name)
+        return self.__encoding
+
+    def count(self, text: str) -> int:
+        """Return the number of tokens of the text."""
+        encoding = self.encoding
+        with profiler.timed("tiktoken", "encode_ordinary"):
+            return len(encoding.encode_ordinary(text))
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        """Return the number of tokens of each text."""
+        if len(texts) < BATCH_MIN_SIZE:
+            return [self.count(text) for text in texts]
+        encoding = self.encoding
+        with profiler.timed("tiktoken", "encode_ordinary_batch"):
+            return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+    def count_messages(self, messages: list[dict[str, str]]) -> int:
+        """Return the number of tokens used by a list of messages."""
+        num_tokens = len(messages) * self.tokens_per_message
+        num_tokens += sum(self.count_batch([value for message in messages for value in message.values()]))
+        num_tokens += sum(self.tokens_per_name for message in messages if "name" in message)
+        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+        return num_tokens
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    """Get memoized token counter of the model."""
+    with _lock:
+        if model not in _counters:
+            _counters[model] = TokenCounter(model)
+        return _counters[model]
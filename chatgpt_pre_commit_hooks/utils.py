@@ -4,37 +4,84 @@ A module containing utility functions.
 """
 
 import subprocess
+from collections.abc import Iterator
+from typing import Optional
+
+from chatgpt_pre_commit_hooks import profiler
 
 
 class Utils:
     """Utils."""
 
-    def cmd_output(self, commands: list[str]) -> str:
+    def cmd_output(self, commands: list[str], env: Optional[dict[str, str]] = None, text_input: Optional[str] = None) -> str:
         """Run cmd command.
 
         Args:
         commands: list of commands.
+        env: environment variables of the command, inherited if not set.
+        text_input: standard input of the command.
 
         Returns:
         Get `str` output.
         """
         try:
-            result = self.__cmd_output(commands)
+            result = self.__cmd_output(commands, env, text_input)
         except subprocess.CalledProcessError:
             result = ""
 
         return result
 
-    def __cmd_output(self, commands: list[str]) -> str:
+    def cmd_output_bytes(self, commands: list[str], data: bytes) -> bytes:
+        """Run cmd command with binary input and output - e.g. `git cat-file --batch`, whose output is sized in bytes.
+
+        Args:
+        commands: list of commands.
+        data: standard input of the command.
+
+        Returns:
+        Get `bytes` output, empty if the command failed.
+        """
+        with profiler.timed("subprocess", commands):
+            output = subprocess.run(commands, capture_output=True, check=False, input=data)  # noqa: S603
+        return output.stdout if output.returncode == 0 else b""
+
+    def cmd_output_lines(self, commands: list[str]) -> Iterator[str]:
+        """Run cmd command and stream its output.
+
+        The command is terminated if the iterator is closed before the end of the output,
+        so the caller can stop reading once it has enough.
+
+        Args:
+        commands: list of commands.
+
+        Returns:
+        Get `Iterator[str]` output lines.
+        """
+        with profiler.timed("subprocess", commands):
+            process = subprocess.Popen(commands, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding="utf-8", errors="replace")  # noqa: S603
+            try:
+                if process.stdout is not None:
+                    yield from process.stdout
+            finally:
+                if process.poll() is None:
+                    process.terminate()
+                if process.stdout is not None:
+                    process.stdout.close()
+                process.wait()
+
+    def __cmd_output(self, commands: list[str], env: Optional[dict[str, str]] = None, text_input: Optional[str] = None) -> str:
         """Run cmd command.
 
         Args:
         commands: list of commands.
+        env: environment variables of the command, inherited if not set.
+        text_input: standard input of the command.
 
         Returns:
         Get `str` output.
         """
-        output = subprocess.run(commands, capture_output=True, encoding="utf-8", check=True)  # noqa: S603
+        with profiler.timed("subprocess", commands):
+            output = subprocess.run(commands, capture_output=True, encoding="utf-8", errors="replace", check=True, env=env, input=text_input)  # noqa: S603
         result = ""
         if output.returncode == 0 and output.stdout is not None:
             result = output.stdout